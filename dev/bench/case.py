@@ -0,0 +1,73 @@
+"""Measures one scan. This is run in a fresh interpreter for every case, so
+that the peak RSS (of this process, and of the worker processes that it
+starts) belongs to that case alone.
+
+    case.py '{"scanner": ..., "shape": ..., "path": ..., "workers": ...}'
+
+The result is printed as JSON.
+"""
+
+import os
+import sys
+import json
+import time
+import resource
+
+_DEV_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+_APP_PATH = os.path.abspath(os.path.join(_DEV_PATH, '..'))
+sys.path.insert(0, _APP_PATH)
+sys.path.insert(0, _DEV_PATH)
+
+import bench.scanners
+import bench.trees
+
+def _get_cpu_s(usage):
+    return usage.ru_utime + usage.ru_stime
+
+def measure(case):
+    scan = bench.scanners.SCANNERS[case['scanner']]
+    filter_rules = bench.trees.get_filter_rules(case['shape'])
+
+    self_before = resource.getrusage(resource.RUSAGE_SELF)
+    children_before = resource.getrusage(resource.RUSAGE_CHILDREN)
+
+    entry_count = 0
+    first_result_s = None
+
+    epoch = time.perf_counter()
+
+    for entry in scan(case['path'], filter_rules, case['workers']):
+        if entry_count == 0:
+            first_result_s = time.perf_counter() - epoch
+
+        entry_count += 1
+
+    elapsed_s = time.perf_counter() - epoch
+
+    # The worker processes have been joined by now, so they're included.
+    self_after = resource.getrusage(resource.RUSAGE_SELF)
+    children_after = resource.getrusage(resource.RUSAGE_CHILDREN)
+
+    return {
+        'entries': entry_count,
+        'seconds': elapsed_s,
+        'entries_per_s': entry_count / elapsed_s if elapsed_s > 0 else 0,
+        'first_result_s': first_result_s,
+        'cpu_parent_s': _get_cpu_s(self_after) - _get_cpu_s(self_before),
+        'cpu_workers_s':
+            _get_cpu_s(children_after) - _get_cpu_s(children_before),
+
+        # In kilobytes (on Linux). The workers' figure is the largest of
+        # them.
+        'peak_rss_parent_kb': self_after.ru_maxrss,
+        'peak_rss_workers_kb': children_after.ru_maxrss,
+    }
+
+def _main():
+    case = json.loads(sys.argv[1])
+    result = measure(case)
+
+    json.dump(result, sys.stdout)
+
+if __name__ == '__main__':
+    _main()
@@ -0,0 +1,111 @@
+"""Runs the cases (each in its own interpreter, see case.py) and collects a
+report that can be written as JSON and compared with an earlier one.
+"""
+
+import os
+import sys
+import json
+import time
+import platform
+import subprocess
+
+import fss
+import bench.scanners
+import bench.trees
+
+_CASE_FILEPATH = os.path.join(os.path.dirname(__file__), 'case.py')
+
+# Bump this if the layout of the report changes.
+REPORT_VERSION = 1
+
+def run_case(case):
+    output = subprocess.check_output(
+                [sys.executable, _CASE_FILEPATH, json.dumps(case)])
+
+    return json.loads(output.decode('utf-8'))
+
+def get_cases(shapes, scanners, worker_counts, tree_paths):
+    cases = []
+    for shape in shapes:
+        for scanner in scanners:
+            if scanner in bench.scanners.BASELINES:
+                scanner_worker_counts = [None]
+            else:
+                scanner_worker_counts = worker_counts
+
+            for workers in scanner_worker_counts:
+                cases.append({
+                    'shape': shape,
+                    'scanner': scanner,
+                    'workers': workers,
+                    'path': tree_paths[shape],
+                })
+
+    return cases
+
+def run(cases, repeat, scale, log=None):
+    """Run each case (repeat) times and keep the fastest run (the first run
+    of each also warms the page-cache for the others).
+    """
+
+    results = []
+    for case in cases:
+        if log is not None:
+            log("Running: %s %s (%s)" %
+                (case['shape'], case['scanner'], case['workers']))
+
+        runs = [run_case(case) for i in range(repeat)]
+        best = min(runs, key=lambda r: r['seconds'])
+
+        result = {
+            'shape': case['shape'],
+            'scanner': case['scanner'],
+            'workers': case['workers'],
+            'filter_rules': len(bench.trees.get_filter_rules(case['shape'])),
+            'runs_s': [r['seconds'] for r in runs],
+        }
+
+        result.update(best)
+        results.append(result)
+
+    return {
+        'version': REPORT_VERSION,
+        'fss_version': fss.__version__,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'scale': scale,
+        'repeat': repeat,
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'results': results,
+    }
+
+def _get_key(result):
+    return (result['shape'], result['scanner'], result['workers'])
+
+def compare(old_report, new_report, threshold):
+    """Return a list of (shape, scanner, workers, old entries/s, new
+    entries/s, ratio, is-regression) for every case that's in both reports.
+    A case has regressed if its throughput dropped by more than the threshold
+    (a fraction).
+    """
+
+    old_results = dict((_get_key(r), r) for r in old_report['results'])
+
+    rows = []
+    for result in new_report['results']:
+        old_result = old_results.get(_get_key(result))
+        if old_result is None or old_result['entries_per_s'] == 0:
+            continue
+
+        ratio = result['entries_per_s'] / old_result['entries_per_s']
+
+        rows.append(
+            _get_key(result) + (
+                old_result['entries_per_s'],
+                result['entries_per_s'],
+                ratio,
+                ratio < 1.0 - threshold,
+            ))
+
+    return rows
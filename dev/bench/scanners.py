@@ -0,0 +1,68 @@
+"""The things that are benchmarked. Each yields one item for every entry
+below the root. The baselines don't apply the filter-rules (so, for the
+heavy-filters tree, they report more entries than the orchestrator does).
+"""
+
+import os
+
+import fss.constants
+import fss.orchestrator
+
+def scan_process(path, filter_rules, workers):
+    o = fss.orchestrator.Orchestrator(
+            path,
+            filter_rules,
+            workers=workers,
+            backend=fss.constants.BACKEND_PROCESS)
+
+    return o.recurse()
+
+def scan_process_raw(path, filter_rules, workers):
+    o = fss.orchestrator.Orchestrator(
+            path,
+            filter_rules,
+            workers=workers,
+            backend=fss.constants.BACKEND_PROCESS)
+
+    return o.recurse(raw=True)
+
+def scan_thread(path, filter_rules, workers):
+    o = fss.orchestrator.Orchestrator(
+            path,
+            filter_rules,
+            workers=workers,
+            backend=fss.constants.BACKEND_THREAD)
+
+    return o.recurse()
+
+def scan_os_walk(path, filter_rules, workers):
+    for (dirpath, dirnames, filenames) in os.walk(path):
+        for dirname in dirnames:
+            yield os.path.join(dirpath, dirname)
+
+        for filename in filenames:
+            yield os.path.join(dirpath, filename)
+
+def scan_os_scandir(path, filter_rules, workers):
+    pending = [path]
+    while pending:
+        with os.scandir(pending.pop()) as it:
+            for entry in it:
+                if entry.is_dir() is True:
+                    pending.append(entry.path)
+
+                yield entry.path
+
+SCANNERS = {
+    'process': scan_process,
+    'process_raw': scan_process_raw,
+    'thread': scan_thread,
+    'os_walk': scan_os_walk,
+    'os_scandir': scan_os_scandir,
+}
+
+# The scanners that don't take a worker-count.
+BASELINES = [
+    'os_walk',
+    'os_scandir',
+]
@@ -0,0 +1,192 @@
+"""Builds the synthetic trees that the benchmarks scan. Every tree is
+determined entirely by its shape and scale (the names, the layout and the
+content of the files come from a seeded random-number generator), so a tree
+that's built on one machine is the same as one built on another.
+
+A tree is only built once. A marker, with the spec that it was built from, is
+written when it's complete, and the tree is reused as long as the spec still
+matches.
+"""
+
+import os
+import json
+import random
+import shutil
+
+import fss.constants
+
+# The name of the file that marks a tree as complete.
+_MARKER_FILENAME = '.bench-tree.json'
+
+_SEED = 1
+
+# The extensions that files are given, for the filter-rules to work on.
+_EXTENSIONS = [
+    'c', 'h', 'py', 'pyc', 'txt', 'log', 'json', 'o', 'so', 'tmp', 'bak',
+    'md',
+]
+
+# Each shape is a description of the tree at a scale of 1:
+#
+#   branches:   the number of subdirectories of each directory
+#   depth:      the number of levels of subdirectories below the root
+#   files:      the number of files in each directory
+#   file_size:  the maximum size of each file (the size is random)
+#   roots:      the number of separate trees below the root (1, if not given)
+#
+# The scale multiplies the number of files in each directory or, for the
+# deep-narrow tree, the number of chains (so that the paths don't get too
+# long).
+
+SHAPES = {
+    # A few levels, with many entries in each directory.
+    'wide_flat': {
+        'branches': 100,
+        'depth': 1,
+        'files': 1000,
+        'file_size': 0,
+    },
+
+    # Long chains of directories with only a few entries in each.
+    'deep_narrow': {
+        'branches': 1,
+        'depth': 200,
+        'files': 5,
+        'file_size': 0,
+        'roots': 50,
+    },
+
+    # Lots of small files (a scale of 10 is a million).
+    'tiny_files': {
+        'branches': 10,
+        'depth': 2,
+        'files': 900,
+        'file_size': 128,
+    },
+
+    # A mixed tree that is scanned with a large set of filter-rules.
+    'heavy_filters': {
+        'branches': 8,
+        'depth': 3,
+        'files': 80,
+        'file_size': 0,
+    },
+}
+
+def get_spec(shape, scale):
+    spec = dict(SHAPES[shape])
+    spec['shape'] = shape
+    spec['scale'] = scale
+    spec['seed'] = _SEED
+
+    if shape == 'deep_narrow':
+        spec['roots'] = max(1, int(spec['roots'] * scale))
+    else:
+        spec['files'] = max(1, int(spec['files'] * scale))
+
+    return spec
+
+def get_filter_rules(shape):
+    """Return the filter-rules that the given shape is scanned with (the
+    heavy-filters shape is the only one that has any).
+    """
+
+    if shape != 'heavy_filters':
+        return []
+
+    filter_rules = []
+
+    # Literal names.
+    for i in range(50):
+        filter_rules.append((
+            fss.constants.FT_FILE,
+            fss.constants.FILTER_EXCLUDE,
+            'f%d.bak' % (i * 7,)))
+
+    # Extensions.
+    for extension in _EXTENSIONS[6:]:
+        filter_rules.append((
+            fss.constants.FT_FILE,
+            fss.constants.FILTER_EXCLUDE,
+            '*.' + extension))
+
+    # Prefixes and character-classes.
+    for i in range(50):
+        filter_rules.append((
+            fss.constants.FT_FILE,
+            fss.constants.FILTER_EXCLUDE,
+            'f%d[0-4]*.[ch]' % (i,)))
+
+    # Path-rules.
+    for i in range(20):
+        filter_rules.append((
+            fss.constants.FT_FILE,
+            fss.constants.FILTER_EXCLUDE,
+            'd%d/**/f%d*.py' % (i % 8, i)))
+
+    for i in range(4):
+        filter_rules.append((
+            fss.constants.FT_DIR,
+            fss.constants.FILTER_EXCLUDE,
+            'd%d/d%d/d%d' % (i, i, i)))
+
+    return filter_rules
+
+def get_tree(tree_root, shape, scale, rebuild=False):
+    """Return the path of the tree for the given shape and scale, building it
+    if it doesn't already exist (or if asked to).
+    """
+
+    spec = get_spec(shape, scale)
+    path = os.path.join(tree_root, '%s-%s' % (shape, scale))
+    marker_filepath = os.path.join(path, _MARKER_FILENAME)
+
+    if rebuild is False:
+        try:
+            with open(marker_filepath) as f:
+                if json.load(f) == spec:
+                    return path
+        except (OSError, ValueError):
+            pass
+
+    if os.path.exists(path) is True:
+        shutil.rmtree(path)
+
+    os.makedirs(path)
+    _build(path, spec)
+
+    with open(marker_filepath, 'w') as f:
+        json.dump(spec, f)
+
+    return path
+
+def _build(path, spec):
+    r = random.Random(spec['seed'])
+
+    for i in range(spec.get('roots', 1)):
+        if 'roots' in spec:
+            root_path = os.path.join(path, 'r%d' % (i,))
+            os.mkdir(root_path)
+        else:
+            root_path = path
+
+        _build_directory(r, root_path, spec, spec['depth'])
+
+def _build_directory(r, path, spec, remaining_depth):
+    file_size = spec['file_size']
+
+    for i in range(spec['files']):
+        filename = 'f%d.%s' % (i, r.choice(_EXTENSIONS))
+
+        with open(os.path.join(path, filename), 'wb') as f:
+            if file_size > 0:
+                f.write(r.randbytes(r.randint(1, file_size)))
+
+    if remaining_depth == 0:
+        return
+
+    for i in range(spec['branches']):
+        child_path = os.path.join(path, 'd%d' % (i,))
+        os.mkdir(child_path)
+
+        _build_directory(r, child_path, spec, remaining_depth - 1)
@@ -0,0 +1,6 @@
+# The largest request (a line of JSON) that the scan server will read.
+DAEMON_MAX_REQUEST_SIZE = 1024 * 1024
+
+# The results are written to (and read from) the socket through buffers of 
+# this size.
+DAEMON_BUFFER_SIZE = 64 * 1024
@@ -0,0 +1,24 @@
+# Any algorithm that hashlib.new() accepts.
+HASH_ALGORITHM = 'blake2b'
+
+# Files in the same size-group are first compared by a hash of their first 
+# and last blocks of this size. Only those that still match are hashed in 
+# full (in chunks of FULL_HASH_CHUNK_SIZE).
+PARTIAL_HASH_BLOCK_SIZE = 64 * 1024
+FULL_HASH_CHUNK_SIZE = 1024 * 1024
+
+# Files smaller than this are never reported as duplicates.
+DEFAULT_MIN_SIZE = 1
+
+# The number of hash-jobs to send to the hashers in each message. While the 
+# scan is running, the jobs are also sent (however few there are), and the 
+# digests that have come back are collected, whenever 
+# HASH_JOB_FLUSH_INTERVAL_S has passed since that was last done. This is 
+# checked as each result of the scan arrives.
+HASH_JOB_BATCH_SIZE = 100
+HASH_JOB_FLUSH_INTERVAL_S = 0.02
+
+HASH_MAX_OUTPUT_QUEUE_SIZE = 200
+
+# How often an idle hash worker checks whether it's been told to quit.
+HASH_POLL_INTERVAL_S = 0.1
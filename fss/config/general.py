@@ -1,2 +1,6 @@
 MAX_LOG_BATCH_READ_COUNT = 100
 MAX_RESULT_BATCH_READ_COUNT = 1000
+
+# How long the foreground loop will block waiting for results or log messages 
+# before checking that the pipeline is still alive.
+FOREGROUND_WAIT_TIMEOUT_S = 1
@@ -0,0 +1,9 @@
+# How long to wait on a database that's locked by another worker.
+INDEX_BUSY_TIMEOUT_S = 60
+
+# Directories modified more recently than this are always read again on the 
+# next scan (their mtime might not reflect a change made in the same tick).
+INDEX_MTIME_SAFETY_WINDOW_S = 2
+
+# The number of directory-listings to write between commits.
+INDEX_COMMIT_INTERVAL = 500
@@ -0,0 +1,11 @@
+# The number of worker processes in a ScanPool, if not given (None is one per 
+# CPU).
+POOL_DEFAULT_SIZE = None
+
+# A pool's worker process is replaced with a fresh one once it has run this 
+# many jobs, so that nothing that it accumulates lives forever.
+POOL_MAX_JOBS_PER_WORKER = 1000
+
+# While a job is being cancelled (or the pool closed), how long to wait for a 
+# worker's output at a time.
+POOL_DRAIN_INTERVAL_S = 0.01
@@ -0,0 +1,13 @@
+# The upper bounds (in seconds) of the buckets of the directory-read latency 
+# histogram. Anything slower goes into a final, unbounded bucket.
+DIRECTORY_LATENCY_BUCKETS_S = [
+    0.0001,
+    0.001,
+    0.01,
+    0.1,
+    1.0,
+    10.0,
+]
+
+# The number of slowest directories to keep (per worker, and in the total).
+SLOWEST_DIRECTORY_COUNT = 10
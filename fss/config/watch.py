@@ -0,0 +1,5 @@
+# The size of each read of the inotify file-descriptor.
+WATCH_READ_BUFFER_SIZE = 65536
+
+# How long to block waiting for events at a time.
+WATCH_POLL_INTERVAL_S = 1
@@ -6,10 +6,88 @@ QUIT_CHECK_INTERVAL_S = 1
 
 PROGRESS_LOG_TICK_INTERVAL = 1000
 
-GENERATOR_MAX_OUTPUT_QUEUE_SIZE = 5000
+# This is a count of messages (batches of results), not of results.
+GENERATOR_MAX_OUTPUT_QUEUE_SIZE = 200
 
-SHUTDOWN_LOG_DEPLETE_CHECK_INTERVAL_S = 1
+# Results are pushed downstream in batches (one message per batch). A batch is
+# sent when it is full, or, once its oldest result has waited this long, at the
+# next opportunity (after every result, and after every item processed). A
+# batch-size of 1 disables batching.
+OUTPUT_BATCH_SIZE = 500
+OUTPUT_BATCH_FLUSH_INTERVAL_S = 0.02
+
+# If enabled, when the generator's results go straight to the parent, each 
+# batch is packed into a block of shared memory (of 
+# GENERATOR_RESULT_BLOCK_SIZE bytes) rather than being pickled, and only a 
+# small message is queued for it. Each worker has GENERATOR_RESULT_BLOCK_COUNT 
+# blocks. A batch that doesn't fit is sent as it is. A worker whose blocks are 
+# all waiting to be read checks again this often. Measured on /usr/share (30k 
+# entries), packing was no faster than pickling (within the noise, with or 
+# without metadata), so it's off by default.
+GENERATOR_PACK_RESULTS = False
+GENERATOR_RESULT_BLOCK_COUNT = 16
+GENERATOR_RESULT_BLOCK_SIZE = 256 * 1024
+GENERATOR_RESULT_BLOCK_WAIT_S = 0.001
+
+# Use os.scandir() (and the file-type that the directory-listing already 
+# carries) rather than os.listdir() plus a stat() for every entry.
+GENERATOR_USE_SCANDIR = True
+
+# How often an idle generator worker checks whether the traversal has finished 
+# while it waits for another worker to share a directory.
+GENERATOR_FRONTIER_POLL_INTERVAL_S = 0.05
+
+# How many of its queued directories a generator worker will hand over, at 
+# most, each time it notices that another worker is idle.
+GENERATOR_MAX_SHARE_COUNT = 50
+
+# The number of pending directories that a generator worker (or the thread 
+# backend) keeps in memory. Past that, they're spilled to a temporary file (in 
+# GENERATOR_FRONTIER_SPILL_PATH, or the default temp-directory if None) and 
+# read back as they're needed. Directories are written to the file 
+# GENERATOR_FRONTIER_SPILL_BATCH_SIZE at a time.
+GENERATOR_FRONTIER_MEMORY_LIMIT = 100000
+GENERATOR_FRONTIER_SPILL_PATH = None
+GENERATOR_FRONTIER_SPILL_BATCH_SIZE = 1000
+
+# Breadth-first, once more than half of the spill-file has been read back, 
+# the rest is moved to the front of it (this many bytes at a time), so that 
+# the file doesn't keep growing while the traversal keeps spilling.
+GENERATOR_FRONTIER_COMPACT_CHUNK_SIZE = 1024 * 1024
+
+# The number of directories that can be recorded (as having been read) in the 
+# table that's shared by the generator processes when following symlinks 
+# uniquely. Each costs 16 bytes. The table is considered full at the given 
+# load.
+GENERATOR_VISITED_CAPACITY = 1024 * 1024
+GENERATOR_VISITED_MAX_LOAD = 0.75
+
+# The in-process, thread-based generator.
+THREADED_DEFAULT_THREAD_COUNT = 16
+THREADED_MAX_OUTPUT_QUEUE_SIZE = 1000
+THREADED_QUIT_CHECK_INTERVAL_S = 0.1
+
+# The content-search stage. Files larger than this are skipped, as are files 
+# that have a NUL in their first SEARCH_BINARY_CHECK_SIZE bytes (binary). At 
+# most SEARCH_MAX_MATCHES_PER_FILE matching lines are reported for a file, 
+# each truncated to SEARCH_MAX_LINE_LENGTH bytes.
+SEARCH_MAX_OUTPUT_QUEUE_SIZE = 200
+SEARCH_MAX_FILE_SIZE = 256 * 1024 * 1024
+SEARCH_BINARY_CHECK_SIZE = 8192
+SEARCH_MAX_MATCHES_PER_FILE = 1000
+SEARCH_MAX_LINE_LENGTH = 1024
+
+# How often an idle search worker checks whether the generator has finished.
+SEARCH_UPSTREAM_POLL_INTERVAL_S = 0.05
+
+SHUTDOWN_LOG_DEPLETE_CHECK_INTERVAL_S = 0.01
+
+# While stopping, how long to wait for a worker to exit before draining its 
+# queues again.
+STOP_DRAIN_INTERVAL_S = 0.01
 
 COMPONENTS = [
     fss.constants.PC_GENERATOR,
+    fss.constants.PC_SEARCH,
+    fss.constants.PC_HASHER,
 ]
@@ -3,9 +3,34 @@
 FT_DIR = 'dir'
 FT_FILE = 'file'
 
+# Not an entry: the result that stands for a directory having been read, 
+# which is only produced when it's asked for (see 
+# fss.options.ScanOptions.report_reads).
+FT_READ_DIR = 'read_dir'
+
 # Pipeline components.
 
 PC_GENERATOR = 'generator'
+PC_SEARCH = 'search'
+PC_HASHER = 'hasher'
+
+# Traversal backends.
+
+BACKEND_PROCESS = 'process'
+BACKEND_THREAD = 'thread'
+
+# How directory symlinks are treated: followed, not followed, or followed 
+# unless the directory has already been read (which breaks cycles).
+
+SYMLINKS_FOLLOW = 'follow'
+SYMLINKS_SKIP = 'skip'
+SYMLINKS_UNIQUE = 'unique'
+
+# The order in which the pending directories are read: breadth-first (oldest 
+# first) or depth-first (newest first).
+
+ORDER_BFS = 'bfs'
+ORDER_DFS = 'dfs'
 
 # Pipeline component states.
 
@@ -14,6 +39,45 @@ PCS_RUNNING = 1
 PCS_FINISHED = 2
 PCS_STOPPED = 3
 
+# Progress counters (see Orchestrator.progress()).
+
+PROGRESS_ENTRIES = 'entries'
+PROGRESS_DIRECTORIES = 'directories'
+PROGRESS_QUEUED = 'queued'
+PROGRESS_BYTES = 'bytes'
+PROGRESS_ERRORS = 'errors'
+PROGRESS_RESULTS = 'results'
+
+# Instrumentation phases (see fss.stats.ScanStats).
+
+PHASE_WAIT = 'wait'
+PHASE_GUARD = 'guard'
+PHASE_READ = 'read'
+PHASE_STAT = 'stat'
+PHASE_FILTER = 'filter'
+PHASE_OUTPUT = 'output'
+
+# Index change types.
+
+CHANGE_ADDED = 'added'
+CHANGE_REMOVED = 'removed'
+
+# Watch event types.
+
+EVENT_EXISTING = 'existing'
+EVENT_CREATE = 'create'
+EVENT_DELETE = 'delete'
+EVENT_MOVED_FROM = 'moved_from'
+EVENT_MOVED_TO = 'moved_to'
+
+# Events may have been lost. The affected root has been rescanned.
+EVENT_OVERFLOW = 'overflow'
+
+# Duplicate-detection hash types.
+
+HASH_PARTIAL = 'partial'
+HASH_FULL = 'full'
+
 # Filter types.
 
 FILTER_INCLUDE = 'include'
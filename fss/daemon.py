@@ -0,0 +1,402 @@
+import logging
+import os
+import stat
+import json
+import time
+import socket
+import socketserver
+import struct
+import threading
+
+import fss.constants
+import fss.config.daemon
+import fss.filters
+import fss.orchestrator
+import fss.tree
+
+_LOGGER = logging.getLogger(__name__)
+
+# Each result is written as its type, the index of the root (of the request)
+# that it was found under and the length of its path, followed by the path
+# (as os.fsencode() would give it).
+_RECORD_HEADER = struct.Struct('<cII')
+
+_TYPE_CODES = {
+    fss.constants.FT_DIR: b'D',
+    fss.constants.FT_FILE: b'F',
+}
+
+_CODE_TYPES = dict((code, type_) for (type_, code) in _TYPE_CODES.items())
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    """Reads one request (a line of JSON) and streams the results back. The
+    request is:
+
+        {"roots": [[path, absolute-path], ...], "filter_rules": [...],
+         "max_depth": ...}
+
+    The response is a line of JSON ({"error": ...}, the error being null if
+    the request was accepted), followed by the results.
+    """
+
+    wbufsize = fss.config.daemon.DAEMON_BUFFER_SIZE
+
+    def handle(self):
+        try:
+            self.__handle()
+        except (BrokenPipeError, ConnectionResetError):
+            # The client stopped reading (e.g. it only wanted the first
+            # result).
+            _LOGGER.debug("Client went away.")
+
+    def finish(self):
+        # Whatever is still buffered is flushed here.
+        try:
+            super(_RequestHandler, self).finish()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def __write_response(self, error):
+        self.wfile.write(json.dumps({'error': error}).encode('ascii') + b'\n')
+
+    def __handle(self):
+        line = self.rfile.readline(fss.config.daemon.DAEMON_MAX_REQUEST_SIZE)
+
+        # The tree is only ever swapped, not changed, so we can keep using
+        # this one even if it's replaced while we're reading it.
+        tree = self.server.tree
+
+        try:
+            request = json.loads(line.decode('ascii'))
+
+            filter_rules = fss.filters.FilterRules(
+                            [tuple(rule) for rule in request['filter_rules']])
+
+            max_depth = request.get('max_depth')
+
+            nodes = []
+            for (path, absolute_path) in request['roots']:
+                node = tree.find(absolute_path)
+                if node is None:
+                    raise ValueError("Path is not in a served tree: [%s]" %
+                                     (path,))
+
+                nodes.append((node, path))
+        except (ValueError, KeyError, TypeError) as e:
+            _LOGGER.warning("Rejecting request: %s", e)
+
+            self.__write_response(str(e))
+            return
+
+        self.__write_response(None)
+
+        pack_header = _RECORD_HEADER.pack
+        write = self.wfile.write
+
+        for (root_index, (node, path)) in enumerate(nodes):
+            for (entry_type, entry_filepath) in tree.query(
+                                                node,
+                                                path,
+                                                filter_rules,
+                                                max_depth=max_depth):
+                entry_filepath = os.fsencode(entry_filepath)
+
+                write(
+                    pack_header(
+                        _TYPE_CODES[entry_type], 
+                        root_index, 
+                        len(entry_filepath)) + \
+                    entry_filepath)
+
+
+class _Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path, tree):
+        self.tree = tree
+
+        socketserver.UnixStreamServer.__init__(
+            self,
+            socket_path,
+            _RequestHandler)
+
+
+class ScanServer(object):
+    """Scans a set of roots once, into a PathTree, and answers queries (see
+    ScanClient) from it over a Unix socket, so that the filesystem isn't read
+    again for each. The filter-rules of a query are applied in memory.
+
+    If a refresh-interval is given, the roots are scanned again that often,
+    and the new tree replaces the old one once it's complete (queries that
+    are running finish with the old one). Otherwise, the tree is only as
+    fresh as the scan that built it.
+
+    Since every entry is kept, symlinks can't simply be followed (a cycle 
+    would never finish, and the tree would grow until memory ran out). By 
+    default, no directory is read twice (SYMLINKS_UNIQUE); SYMLINKS_SKIP is 
+    also allowed.
+    """
+
+    def __init__(self, socket_path, path, refresh_interval_s=None,
+                 workers=None, backend=fss.constants.BACKEND_PROCESS,
+                 index_filepath=None, max_depth=None,
+                 symlinks=fss.constants.SYMLINKS_UNIQUE,
+                 one_filesystem=False):
+        if symlinks == fss.constants.SYMLINKS_FOLLOW:
+            raise ValueError("The server can't follow symlinks "
+                             "unconditionally. Use SYMLINKS_UNIQUE or "
+                             "SYMLINKS_SKIP.")
+
+        if issubclass(path.__class__, (list, tuple)) is False:
+            path = [path]
+
+        self.__socket_path = socket_path
+        self.__refresh_interval_s = refresh_interval_s
+        self.__stop_ev = threading.Event()
+        self.__server = None
+        self.__refresh_thread = None
+
+        # The tree only has the entries that the scan yields, so nothing is
+        # filtered.
+        self.__o = fss.orchestrator.Orchestrator(
+                    list(path),
+                    [],
+                    workers=workers,
+                    backend=backend,
+                    index_filepath=index_filepath,
+                    max_depth=max_depth,
+                    symlinks=symlinks,
+                    one_filesystem=one_filesystem)
+
+    def __build_tree(self):
+        epoch = time.time()
+
+        tree = fss.tree.PathTree()
+        for root in self.__o.roots:
+            tree.add_root(root)
+
+        for (root, entry_type, entry_filepath) in self.__o.recurse():
+            tree.add(entry_type, entry_filepath)
+
+        tree.finish()
+
+        _LOGGER.info("Scanned (%d) entries (%d distinct names) in (%.3f) "
+                     "seconds.",
+                     tree.entry_count, tree.name_count, time.time() - epoch)
+
+        return tree
+
+    def __remove_stale_socket(self):
+        try:
+            s = os.stat(self.__socket_path)
+        except FileNotFoundError:
+            return
+
+        if stat.S_ISSOCK(s.st_mode) is False:
+            raise ValueError("Not a socket: [%s]" % (self.__socket_path,))
+
+        os.unlink(self.__socket_path)
+
+    def __refresh(self, server):
+        while self.__stop_ev.wait(self.__refresh_interval_s) is False:
+            _LOGGER.info("Refreshing tree.")
+
+            try:
+                server.tree = self.__build_tree()
+            except Exception:
+                _LOGGER.exception("Refresh failed. Keeping the old tree.")
+
+    def start(self):
+        """Scan the roots and start listening (the requests are served in
+        the background).
+        """
+
+        tree = self.__build_tree()
+
+        self.__remove_stale_socket()
+        self.__server = _Server(self.__socket_path, tree)
+
+        t = threading.Thread(target=self.__server.serve_forever)
+        t.daemon = True
+        t.start()
+
+        if self.__refresh_interval_s is not None:
+            self.__refresh_thread = threading.Thread(
+                                        target=self.__refresh, 
+                                        args=(self.__server,))
+
+            self.__refresh_thread.daemon = True
+            self.__refresh_thread.start()
+
+        _LOGGER.info("Serving on [%s].", self.__socket_path)
+
+    def stop(self):
+        self.__stop_ev.set()
+
+        if self.__server is not None:
+            self.__server.shutdown()
+            self.__server.server_close()
+            self.__server = None
+
+            os.unlink(self.__socket_path)
+
+        if self.__refresh_thread is not None:
+            self.__refresh_thread.join()
+            self.__refresh_thread = None
+
+    def serve_forever(self):
+        """Start, and block until interrupted."""
+
+        self.start()
+
+        try:
+            self.__stop_ev.wait()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stop()
+
+    @property
+    def tree(self):
+        return self.__server.tree
+
+
+class ScanClient(object):
+    """Queries a ScanServer, in the manner of an Orchestrator: recurse()
+    yields the same results that it would (without metadata), but they come
+    from the server's tree rather than from the filesystem. The path (or
+    each of a list of paths) has to be one of the server's roots, or a
+    directory below one.
+    """
+
+    def __init__(self, socket_path, path, filter_rules, max_depth=None):
+        if issubclass(path.__class__, (list, tuple)) is True:
+            self.__roots = list(path)
+            self.__is_multi_root = True
+        else:
+            self.__roots = [path]
+            self.__is_multi_root = False
+
+        self.__socket_path = socket_path
+        self.__filter_rules = filter_rules
+        self.__max_depth = max_depth
+
+    def recurse(self, limit=None, raw=False):
+        """Yield (entry-type, path) for every entry that passes the
+        filter-rules, prefixed with the root if a list of roots was given. If
+        a limit is given, stop after that many results. If raw, the paths are
+        yielded as bytes.
+
+        ValueError is raised if the server rejects the query.
+        """
+
+        request = {
+            'roots': [
+                [root, os.path.abspath(root)]
+                for root
+                in self.__roots
+            ],
+            'filter_rules': [list(rule) for rule in self.__filter_rules],
+            'max_depth': self.__max_depth,
+        }
+
+        s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        s.connect(self.__socket_path)
+
+        # Surrogates (from paths that aren't valid UTF-8) are escaped, and
+        # restored on the other side.
+        s.sendall(json.dumps(request).encode('ascii') + b'\n')
+
+        f = s.makefile('rb', buffering=fss.config.daemon.DAEMON_BUFFER_SIZE)
+
+        is_accepted = False
+
+        try:
+            response = json.loads(f.readline().decode('ascii'))
+            if response['error'] is not None:
+                raise ValueError(response['error'])
+
+            is_accepted = True
+        finally:
+            if is_accepted is False:
+                f.close()
+                s.close()
+
+        scan = self.__read_results(s, f, raw)
+
+        if limit is None:
+            return scan
+
+        return self.__limit(scan, limit)
+
+    def __limit(self, scan, limit):
+        if limit <= 0:
+            scan.close()
+            return
+
+        i = 0
+        for entry in scan:
+            yield entry
+
+            i += 1
+            if i >= limit:
+                break
+
+        scan.close()
+
+    def __read_results(self, s, f, raw):
+        header_size = _RECORD_HEADER.size
+        roots = self.__roots
+        is_multi_root = self.__is_multi_root
+
+        try:
+            buffer_ = b''
+            while True:
+                data = f.read1(fss.config.daemon.DAEMON_BUFFER_SIZE)
+                if not data:
+                    break
+
+                buffer_ += data
+
+                # Whatever is left over is the start of the next record.
+
+                offset = 0
+                while len(buffer_) - offset >= header_size:
+                    (code, root_index, length) = \
+                        _RECORD_HEADER.unpack_from(buffer_, offset)
+
+                    start = offset + header_size
+                    stop = start + length
+                    if stop > len(buffer_):
+                        break
+
+                    entry_type = _CODE_TYPES[code]
+
+                    if raw is True:
+                        entry_filepath = buffer_[start:stop]
+                    else:
+                        entry_filepath = os.fsdecode(buffer_[start:stop])
+
+                    if is_multi_root is True:
+                        yield (roots[root_index], entry_type, entry_filepath)
+                    else:
+                        yield (entry_type, entry_filepath)
+
+                    offset = stop
+
+                buffer_ = buffer_[offset:]
+        finally:
+            f.close()
+            s.close()
+
+    def first(self):
+        """Return the first result that recurse() would yield, or None."""
+
+        for entry in self.recurse(limit=1):
+            return entry
+
+        return None
+
+    def exists(self):
+        return self.first() is not None
@@ -0,0 +1,171 @@
+import fss.constants
+import fss.config.duplicates
+
+
+class DuplicateFinder(object):
+    """Decides which files have to be hashed (and how) in order to find the
+    ones that have identical content. It's given the size of every file and,
+    later, the digests that come back from the hashers, and returns the
+    hash-jobs that are needed next.
+
+    Files are only compared with files of the same size. Within a size-group,
+    the first and last blocks are hashed (HASH_PARTIAL), and only the files
+    whose partial digests collide are hashed in full (HASH_FULL). Files that
+    are small enough to be read whole by the partial hash are never hashed
+    twice.
+
+    A size-group is complete once the scan has finished (nothing else can
+    join it) and none of its hashes are outstanding. Its duplicate sets,
+    (size, [path, ...]), are returned at that point.
+    """
+
+    def __init__(self, min_size=fss.config.duplicates.DEFAULT_MIN_SIZE):
+        self.__min_size = min_size
+        self.__partial_max_size = \
+            fss.config.duplicates.PARTIAL_HASH_BLOCK_SIZE * 2
+
+        self.__is_scan_finished = False
+
+        # size -> [path, ...]
+        self.__sizes = {}
+
+        # size -> {partial-digest: [path, ...]}
+        self.__partials = {}
+
+        # size -> {full-digest: [path, ...]}
+        self.__fulls = {}
+
+        # size -> the number of hashes requested but not yet received.
+        self.__pending = {}
+
+        self.__file_count = 0
+        self.__byte_count = 0
+        self.__set_count = 0
+        self.__duplicate_count = 0
+        self.__duplicate_bytes = 0
+
+    def add_file(self, filepath, size):
+        """Register a file that was found by the scan. Return a list of the
+        (hash-type, size, path) jobs that are now needed.
+        """
+
+        assert self.__is_scan_finished is False, \
+               "The scan has already finished."
+
+        if size < self.__min_size:
+            return []
+
+        self.__file_count += 1
+        self.__byte_count += size
+
+        filepaths = self.__sizes.get(size)
+        if filepaths is None:
+            # Nothing to compare it with (yet).
+            self.__sizes[size] = [filepath]
+            self.__pending[size] = 0
+
+            return []
+
+        filepaths.append(filepath)
+
+        # The first file of the group wasn't hashed until now.
+        if len(filepaths) == 2:
+            return self.__request(fss.constants.HASH_PARTIAL, size, filepaths)
+
+        return self.__request(fss.constants.HASH_PARTIAL, size, [filepath])
+
+    def add_digest(self, hash_type, size, filepath, digest):
+        """Register a result from the hashers (the digest is None if the file
+        couldn't be read). Return a 2-tuple of the jobs that are now needed and
+        the duplicate sets that are now complete.
+        """
+
+        self.__pending[size] -= 1
+        jobs = []
+
+        if digest is None:
+            pass
+        elif hash_type == fss.constants.HASH_FULL:
+            self.__fulls.setdefault(size, {}).\
+                setdefault(digest, []).\
+                append(filepath)
+        elif size <= self.__partial_max_size:
+            # The whole file was read, so the partial digest is final.
+            self.__fulls.setdefault(size, {}).\
+                setdefault(digest, []).\
+                append(filepath)
+        else:
+            filepaths = self.__partials.setdefault(size, {}).\
+                            setdefault(digest, [])
+
+            filepaths.append(filepath)
+
+            if len(filepaths) == 2:
+                jobs = self.__request(fss.constants.HASH_FULL, size, filepaths)
+            elif len(filepaths) > 2:
+                jobs = self.__request(
+                        fss.constants.HASH_FULL,
+                        size,
+                        [filepath])
+
+        if self.__is_scan_finished is True and self.__pending[size] == 0:
+            return (jobs, self.__complete(size))
+
+        return (jobs, [])
+
+    def finish_scan(self):
+        """Register that the scan has finished. Return the duplicate sets that
+        are already complete.
+        """
+
+        self.__is_scan_finished = True
+
+        sets = []
+        for size in list(self.__sizes.keys()):
+            if self.__pending[size] == 0:
+                sets += self.__complete(size)
+
+        return sets
+
+    def is_finished(self):
+        """Return True if the scan has finished and every size-group has been
+        completed.
+        """
+
+        return self.__is_scan_finished is True and not self.__sizes
+
+    def __request(self, hash_type, size, filepaths):
+        self.__pending[size] += len(filepaths)
+        return [(hash_type, size, filepath) for filepath in filepaths]
+
+    def __complete(self, size):
+        del self.__sizes[size]
+        del self.__pending[size]
+        self.__partials.pop(size, None)
+
+        sets = []
+        for filepaths in self.__fulls.pop(size, {}).values():
+            if len(filepaths) < 2:
+                continue
+
+            self.__set_count += 1
+            self.__duplicate_count += len(filepaths) - 1
+            self.__duplicate_bytes += size * (len(filepaths) - 1)
+
+            sets.append((size, sorted(filepaths)))
+
+        return sets
+
+    def get_counters(self):
+        """The total size of the files that were considered, as well as what
+        was found. "duplicate_bytes" is the space that would be freed by
+        keeping only one file of each set.
+        """
+
+        return {
+            'candidate_files': self.__file_count,
+            'total_bytes': self.__byte_count,
+            'duplicate_sets': self.__set_count,
+            'duplicate_files': self.__duplicate_count,
+            'duplicate_bytes': self.__duplicate_bytes,
+        }
@@ -0,0 +1,441 @@
+import logging
+import os
+import re
+import fnmatch
+import pprint
+
+import fss.constants
+import fss.config
+
+_LOGGER = logging.getLogger(__name__)
+
+_LOGGER_FILTER = logging.getLogger(__name__ + '.-filter–')
+
+_IS_FILTER_DEBUG = bool(int(os.environ.get('FSS_FILTER_DEBUG', '0')))
+
+if _IS_FILTER_DEBUG is True:
+    _LOGGER_FILTER.setLevel(logging.DEBUG)
+else:
+    _LOGGER_FILTER.setLevel(logging.WARNING)
+
+_MAGIC_CHARACTERS = ('*', '?', '[')
+
+# Patterns that contain this are matched against the path relative to the 
+# root rather than against the filename.
+_PATH_SEPARATOR = '/'
+
+
+def _is_literal(pattern):
+    for c in _MAGIC_CHARACTERS:
+        if c in pattern:
+            return False
+
+    return True
+
+def is_path_pattern(pattern):
+    return _PATH_SEPARATOR in pattern
+
+def normalize_path(rel_path):
+    """Relative paths (and path-patterns) always use forward-slashes, even 
+    where normcase() would change them.
+    """
+
+    return os.path.normcase(rel_path).replace(os.sep, _PATH_SEPARATOR)
+
+def join_path(rel_path, filename):
+    """Return the relative path of an entry, given that of its directory 
+    (the root's is an empty string).
+    """
+
+    if not rel_path:
+        return filename
+
+    return rel_path + _PATH_SEPARATOR + filename
+
+def get_depth(rel_path):
+    """The root is at a depth of 0, and its entries at a depth of 1."""
+
+    if not rel_path:
+        return 0
+
+    return rel_path.count(_PATH_SEPARATOR) + 1
+
+def truncate_path(rel_path, depth):
+    """Return the ancestor of the given relative path that's at the given 
+    depth (or the path itself, if it's not deeper than that).
+    """
+
+    if depth == 0:
+        return ''
+
+    parts = rel_path.split(_PATH_SEPARATOR, depth)
+    if len(parts) <= depth:
+        return rel_path
+
+    return _PATH_SEPARATOR.join(parts[:depth])
+
+def split_path(rel_path):
+    """Return the relative path of the parent, and the name."""
+
+    parts = rel_path.rsplit(_PATH_SEPARATOR, 1)
+    if len(parts) == 1:
+        return ('', rel_path)
+
+    return (parts[0], parts[1])
+
+def _split_path_pattern(pattern):
+    """Path-patterns are always anchored at the root, so a leading (or 
+    trailing) separator doesn't mean anything.
+    """
+
+    return normalize_path(pattern).strip(_PATH_SEPARATOR).\
+        split(_PATH_SEPARATOR)
+
+def _translate_component(part):
+    """Like fnmatch.translate(), but nothing matches a separator."""
+
+    phrase = ''
+    i = 0
+    n = len(part)
+    while i < n:
+        c = part[i]
+        i += 1
+
+        if c == '*':
+            phrase += '[^/]*'
+        elif c == '?':
+            phrase += '[^/]'
+        elif c == '[':
+            j = i
+            if j < n and part[j] == '!':
+                j += 1
+
+            if j < n and part[j] == ']':
+                j += 1
+
+            j = part.find(']', j)
+            if j == -1:
+                phrase += '\\['
+                continue
+
+            stuff = part[i:j].replace('\\', '\\\\')
+            i = j + 1
+
+            if stuff[0] == '!':
+                stuff = '^/' + stuff[1:]
+            elif stuff[0] == '^':
+                stuff = '\\' + stuff
+
+            phrase += '[' + stuff + ']'
+        else:
+            phrase += re.escape(c)
+
+    return phrase
+
+def _translate_path_pattern(parts):
+    """Translate the components of a path-pattern into a regular-expression. 
+    A "**" component matches any number of components (including none).
+    """
+
+    phrase = ''
+    last_index = len(parts) - 1
+
+    for (i, part) in enumerate(parts):
+        if part == '**':
+            if i == last_index:
+                phrase += '.*'
+            else:
+                phrase += '(?:[^/]+/)*'
+        else:
+            phrase += _translate_component(part)
+
+            if i < last_index:
+                phrase += '/'
+
+    return '(?:' + phrase + ')\\Z'
+
+def _could_match_below(pattern_parts, path_parts, i=0, j=0):
+    """Return True if something below the given path could match the 
+    pattern (the path is a possible ancestor of a match).
+    """
+
+    if j == len(path_parts):
+        return i < len(pattern_parts)
+
+    if i == len(pattern_parts):
+        return False
+
+    if pattern_parts[i] == '**':
+        return _could_match_below(pattern_parts, path_parts, i + 1, j) or \
+               _could_match_below(pattern_parts, path_parts, i, j + 1)
+
+    if fnmatch.fnmatchcase(path_parts[j], pattern_parts[i]) is False:
+        return False
+
+    return _could_match_below(pattern_parts, path_parts, i + 1, j + 1)
+
+
+class PatternMatcher(object):
+    """Matches a filename against a list of fnmatch-style patterns in one
+    step. Literal patterns become a set lookup, "*<literal>" patterns become
+    suffix lookups (grouped by suffix-length), and everything else is
+    combined into a single regular expression.
+
+    Patterns that contain a "/" are matched against the path relative to the 
+    root (with "**" matching any number of directories), and are combined 
+    into a second regular expression.
+    """
+
+    def __init__(self, patterns):
+        self.__patterns = list(patterns)
+
+        self.__match_all = False
+        self.__literals = set()
+        self.__suffixes = {}
+        complex_patterns = []
+        self.__path_patterns = []
+
+        for pattern in self.__patterns:
+            if is_path_pattern(pattern) is True:
+                self.__path_patterns.append(_split_path_pattern(pattern))
+                continue
+
+            pattern = os.path.normcase(pattern)
+
+            if pattern == '*':
+                self.__match_all = True
+            elif _is_literal(pattern) is True:
+                self.__literals.add(pattern)
+            elif pattern[0] == '*' and _is_literal(pattern[1:]) is True:
+                suffix = pattern[1:]
+
+                try:
+                    self.__suffixes[len(suffix)].add(suffix)
+                except KeyError:
+                    self.__suffixes[len(suffix)] = set([suffix])
+            else:
+                complex_patterns.append(pattern)
+
+        # Check the longest suffixes first (arbitrary, but stable).
+        self.__suffixes = sorted(
+                            self.__suffixes.items(),
+                            key=lambda x: x[0],
+                            reverse=True)
+
+        if complex_patterns:
+            phrase = '|'.join(fnmatch.translate(p) for p in complex_patterns)
+            self.__regex = re.compile(phrase)
+        else:
+            self.__regex = None
+
+        if self.__path_patterns:
+            phrase = '|'.join(
+                        _translate_path_pattern(parts) 
+                        for parts 
+                        in self.__path_patterns)
+
+            self.__path_regex = re.compile(phrase)
+        else:
+            self.__path_regex = None
+
+    def __bool__(self):
+        return bool(self.__patterns)
+
+    @property
+    def patterns(self):
+        return self.__patterns
+
+    @property
+    def has_path_patterns(self):
+        return bool(self.__path_patterns)
+
+    def is_match(self, filename, rel_path=None):
+        """The filename is expected to already be normalized (normcase), and 
+        the relative path, if there are path-patterns, as well (see 
+        normalize_path()).
+        """
+
+        if self.__match_all is True:
+            return True
+
+        if filename in self.__literals:
+            return True
+
+        for (length, suffixes) in self.__suffixes:
+            if filename[-length:] in suffixes:
+                return True
+
+        if self.__regex is not None and \
+           self.__regex.match(filename) is not None:
+            return True
+
+        if self.__path_regex is not None and \
+           rel_path is not None and \
+           self.__path_regex.match(rel_path) is not None:
+            return True
+
+        return False
+
+    def could_match_below(self, rel_path):
+        """Return True if a path-pattern could match something below the 
+        given (normalized) directory.
+        """
+
+        path_parts = rel_path.split(_PATH_SEPARATOR)
+
+        for pattern_parts in self.__path_patterns:
+            if _could_match_below(pattern_parts, path_parts) is True:
+                return True
+
+        return False
+
+    def find_pattern(self, filename, rel_path=None):
+        """Return the first pattern that matches. This is slow and only used
+        for debugging.
+        """
+
+        for pattern in self.__patterns:
+            if is_path_pattern(pattern) is True:
+                if rel_path is not None and \
+                   PatternMatcher([pattern]).is_match(filename, rel_path):
+                    return pattern
+            elif fnmatch.fnmatch(filename, pattern):
+                return pattern
+
+        return None
+
+
+class FilterRules(object):
+    """Applies the include/exclude rules for each entry-type. Include rules
+    are always checked before exclude rules, and anything that doesn't match
+    either is implicitly included.
+
+    A pattern that contains a "/" is matched against the path of the entry 
+    relative to the root (e.g. "build/**/cache") rather than its filename.
+    """
+
+    def __init__(self, filter_rules_raw):
+        _LOGGER.debug("Loading filter-rules.")
+
+        # We expect this to be a listof 3-tuples:
+        #
+        #     (entry-type, filter-type, pattern)
+
+        rules = {
+            fss.constants.FT_DIR: {
+                fss.constants.FILTER_INCLUDE: [],
+                fss.constants.FILTER_EXCLUDE: [],
+            },
+            fss.constants.FT_FILE: {
+                fss.constants.FILTER_INCLUDE: [],
+                fss.constants.FILTER_EXCLUDE: [],
+            },
+        }
+
+        for (entry_type, filter_type, pattern) in filter_rules_raw:
+            rules[entry_type][filter_type].append(pattern)
+
+        # If an include filter was given for DIRECTORIES, add an exclude filter
+        # for "*". Since we check the include rules, first, we'll simply not be
+        # implicitly including anything else.
+
+        type_rules = rules[fss.constants.FT_DIR]
+        if type_rules[fss.constants.FILTER_INCLUDE]:
+            type_rules[fss.constants.FILTER_EXCLUDE].append('*')
+
+        # If an include filter was given for FILES, add an exclude filter for
+        # "*". Since we check the include rules, first, we'll simply not be
+        # implicitly including anything else.
+
+        type_rules = rules[fss.constants.FT_FILE]
+        if type_rules[fss.constants.FILTER_INCLUDE]:
+            type_rules[fss.constants.FILTER_EXCLUDE].append('*')
+
+        if fss.config.IS_DEBUG is True:
+            _LOGGER.debug("Final rules:\n%s", pprint.pformat(rules))
+
+        self.__matchers = {}
+        self.__is_path_aware = False
+
+        for (entry_type, type_rules) in rules.items():
+            include = PatternMatcher(type_rules[fss.constants.FILTER_INCLUDE])
+            exclude = PatternMatcher(type_rules[fss.constants.FILTER_EXCLUDE])
+
+            if include.has_path_patterns is True or \
+               exclude.has_path_patterns is True:
+                self.__is_path_aware = True
+
+            self.__matchers[entry_type] = (include, exclude)
+
+    @property
+    def is_path_aware(self):
+        """Whether any of the rules need the relative path of the entries. 
+        If not, the traversal doesn't have to build them.
+        """
+
+        return self.__is_path_aware
+
+    def check_to_permit(self, entry_type, entry_filename, rel_path=None):
+        """Applying the filter rules. The relative path is the path of the 
+        entry below the root, separated by "/". If not given, the entry is 
+        assumed to be directly in the root.
+        """
+
+        (include, exclude) = self.__matchers[entry_type]
+        entry_filename = os.path.normcase(entry_filename)
+
+        if self.__is_path_aware is True:
+            rel_path = normalize_path(rel_path) \
+                        if rel_path is not None \
+                        else entry_filename
+
+        # Should explicitly include?
+        if include and include.is_match(entry_filename, rel_path) is True:
+            if _IS_FILTER_DEBUG is True:
+                _LOGGER_FILTER.debug("Entry explicitly INCLUDED: [%s] [%s] "
+                                     "[%s]",
+                                     entry_type,
+                                     include.find_pattern(
+                                        entry_filename, 
+                                        rel_path),
+                                     entry_filename)
+
+            return True
+
+        # Should explicitly exclude?
+        if exclude and exclude.is_match(entry_filename, rel_path) is True:
+            if _IS_FILTER_DEBUG is True:
+                _LOGGER_FILTER.debug("Entry explicitly EXCLUDED: [%s] [%s] "
+                                     "[%s]",
+                                     entry_type,
+                                     exclude.find_pattern(
+                                        entry_filename, 
+                                        rel_path),
+                                     entry_filename)
+
+            return False
+
+        # Implicitly include.
+
+        if _IS_FILTER_DEBUG is True:
+            _LOGGER_FILTER.debug("Entry IMPLICITLY included: [%s] [%s]",
+                                 entry_type, entry_filename)
+
+        return True
+
+    def check_to_descend(self, rel_path):
+        """Return True if a directory that wasn't permitted should still be 
+        descended into, because a path-pattern could include something below 
+        it (e.g. "src" for "src/*/include").
+        """
+
+        if self.__is_path_aware is False:
+            return False
+
+        rel_path = normalize_path(rel_path)
+
+        for (include, exclude) in self.__matchers.values():
+            if include.could_match_below(rel_path) is True:
+                return True
+
+        return False
@@ -0,0 +1,258 @@
+import logging
+import os
+import time
+import sqlite3
+
+import fss.constants
+import fss.config.index
+
+_LOGGER = logging.getLogger(__name__)
+
+_SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS `directories` (
+        `path` TEXT PRIMARY KEY NOT NULL,
+        `dev` INTEGER NOT NULL,
+        `inode` INTEGER NOT NULL,
+        `mtime_ns` INTEGER NOT NULL,
+        `listing` BLOB NOT NULL
+    )""",
+
+    """CREATE TABLE IF NOT EXISTS `changes` (
+        `change_type` TEXT NOT NULL,
+        `entry_type` TEXT NOT NULL,
+        `path` TEXT NOT NULL
+    )""",
+]
+
+_DIR_PREFIX = b'D'
+_FILE_PREFIX = b'F'
+
+
+def _encode_listing(children):
+    """Pack a list of (filename, is_dir) into a single blob."""
+
+    return b'\0'.join(
+            (_DIR_PREFIX if is_dir is True else _FILE_PREFIX) + \
+                os.fsencode(filename)
+            for (filename, is_dir)
+            in children)
+
+def _decode_listing(blob):
+    if not blob:
+        return []
+
+    return [
+        (os.fsdecode(item[1:]), item[:1] == _DIR_PREFIX)
+        for item
+        in blob.split(b'\0')
+    ]
+
+
+class ScanIndex(object):
+    """An on-disk (SQLite) record of the listing of every directory that was
+    read, keyed by the directory's path and validated by its device, inode and
+    mtime. A directory's mtime changes whenever an entry is added, removed or
+    renamed within it, so, as long as those still match, the stored listing
+    can be trusted instead of reading the directory again.
+
+    Every process (or thread) that uses the index opens its own instance.
+    """
+
+    def __init__(self, filepath):
+        self.__filepath = filepath
+
+        # We manage our own transactions. Reads happen outside of any 
+        # transaction, and writes are buffered and then applied in short 
+        # IMMEDIATE transactions, so that the workers, which all write to the 
+        # same database, never hold a lock while waiting for one.
+        self.__conn = sqlite3.connect(
+                        filepath,
+                        timeout=fss.config.index.INDEX_BUSY_TIMEOUT_S,
+                        isolation_level=None)
+
+        self.__conn.execute('PRAGMA journal_mode=WAL')
+        self.__conn.execute('PRAGMA synchronous=NORMAL')
+
+        for query in _SCHEMA:
+            self.__conn.execute(query)
+
+        # A list of (query, parameter-rows) to execute on the next commit.
+        self.__writes = []
+        self.__uncommitted_count = 0
+
+    def begin_scan(self):
+        """Clear the changes recorded by the last scan. Returns True if there
+        is an existing snapshot to compare against.
+        """
+
+        self.__conn.execute('DELETE FROM `changes`')
+
+        c = self.__conn.execute('SELECT 1 FROM `directories` LIMIT 1')
+        return c.fetchone() is not None
+
+    def get_listing(self, path, st):
+        """Return a list of (filename, is_dir) if we have a listing for the
+        directory and it's still current, or None.
+        """
+
+        c = self.__conn.execute(
+                'SELECT `dev`, `inode`, `mtime_ns`, `listing` '
+                'FROM `directories` WHERE `path` = ?',
+                (path,))
+
+        row = c.fetchone()
+        if row is None:
+            return None
+
+        (dev, inode, mtime_ns, listing) = row
+        if dev != st.st_dev or \
+           inode != st.st_ino or \
+           mtime_ns != st.st_mtime_ns:
+            return None
+
+        return _decode_listing(listing)
+
+    def set_listing(self, path, st, children, record_changes=False):
+        """Store the current listing of a directory (a list of
+        (filename, is_dir)). If requested, record how it differs from the
+        listing that we had before.
+        """
+
+        mtime_ns = st.st_mtime_ns
+
+        # The directory may change again without its mtime changing if it's
+        # modified within the granularity of the filesystem's timestamps. Don't
+        # trust a listing of a directory that was modified very recently.
+        if (time.time() * 1e9) - mtime_ns < \
+                fss.config.index.INDEX_MTIME_SAFETY_WINDOW_S * 1e9:
+            mtime_ns = -1
+
+        if record_changes is True:
+            self.__record_changes(path, children)
+
+        self.__writes.append((
+            'INSERT OR REPLACE INTO `directories` '
+            '(`path`, `dev`, `inode`, `mtime_ns`, `listing`) '
+            'VALUES (?, ?, ?, ?, ?)',
+            [(path, st.st_dev, st.st_ino, mtime_ns, 
+              _encode_listing(children))]))
+
+        self.__uncommitted_count += 1
+        if self.__uncommitted_count >= \
+                fss.config.index.INDEX_COMMIT_INTERVAL:
+            self.commit()
+
+    def __record_changes(self, path, children):
+        c = self.__conn.execute(
+                'SELECT `listing` FROM `directories` WHERE `path` = ?',
+                (path,))
+
+        row = c.fetchone()
+        previous = _decode_listing(row[0]) if row is not None else []
+
+        current_s = set(children)
+        previous_s = set(previous)
+
+        changes = []
+
+        for (filename, is_dir) in children:
+            if (filename, is_dir) not in previous_s:
+                changes.append(
+                    self.__get_change(
+                        fss.constants.CHANGE_ADDED,
+                        path,
+                        filename,
+                        is_dir))
+
+        for (filename, is_dir) in previous:
+            if (filename, is_dir) in current_s:
+                continue
+
+            changes.append(
+                self.__get_change(
+                    fss.constants.CHANGE_REMOVED,
+                    path,
+                    filename,
+                    is_dir))
+
+            if is_dir is True:
+                changes += self.__remove_subtree(os.path.join(path, filename))
+
+        if changes:
+            self.__writes.append((
+                'INSERT INTO `changes` (`change_type`, `entry_type`, `path`) '
+                'VALUES (?, ?, ?)',
+                changes))
+
+    def __get_change(self, change_type, path, filename, is_dir):
+        entry_type = fss.constants.FT_DIR \
+                        if is_dir is True \
+                        else fss.constants.FT_FILE
+
+        return (change_type, entry_type, os.path.join(path, filename))
+
+    def __remove_subtree(self, path):
+        """Forget everything that we know below a directory that has gone away.
+        Returns removal-changes for everything that it contained.
+        """
+
+        prefix = os.path.join(path, '')
+
+        c = self.__conn.execute(
+                'SELECT `path`, `listing` FROM `directories` '
+                'WHERE `path` = ? OR substr(`path`, 1, ?) = ?',
+                (path, len(prefix), prefix))
+
+        changes = []
+        for (subtree_path, listing) in c.fetchall():
+            for (filename, is_dir) in _decode_listing(listing):
+                changes.append(
+                    self.__get_change(
+                        fss.constants.CHANGE_REMOVED,
+                        subtree_path,
+                        filename,
+                        is_dir))
+
+        self.__writes.append((
+            'DELETE FROM `directories` '
+            'WHERE `path` = ? OR substr(`path`, 1, ?) = ?',
+            [(path, len(prefix), prefix)]))
+
+        return changes
+
+    def get_changes(self):
+        """Return (change-type, entry-type, path) for everything that was added
+        or removed during the last scan.
+        """
+
+        c = self.__conn.execute(
+                'SELECT `change_type`, `entry_type`, `path` FROM `changes` '
+                'ORDER BY `rowid`')
+
+        return c.fetchall()
+
+    def commit(self):
+        if not self.__writes:
+            return
+
+        self.__conn.execute('BEGIN IMMEDIATE')
+
+        try:
+            for (query, rows) in self.__writes:
+                self.__conn.executemany(query, rows)
+        except:
+            self.__conn.execute('ROLLBACK')
+            raise
+        else:
+            self.__conn.execute('COMMIT')
+
+        self.__writes = []
+        self.__uncommitted_count = 0
+
+    def close(self):
+        self.commit()
+        self.__conn.close()
+
+    @property
+    def filepath(self):
+        return self.__filepath
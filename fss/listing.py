@@ -0,0 +1,237 @@
+import logging
+import os
+
+import fss.constants
+import fss.config.workers
+import fss.index
+import fss.metadata
+import fss.options
+
+_LOGGER = logging.getLogger(__name__)
+
+
+def _stat(filepath):
+    try:
+        return os.stat(filepath)
+    except OSError:
+        # Probably a broken symlink.
+        return os.lstat(filepath)
+
+def _stat_entry(entry):
+    try:
+        return entry.stat()
+    except OSError:
+        # Probably a broken symlink.
+        return entry.stat(follow_symlinks=False)
+
+
+class DirectoryLister(object):
+    """Lists directories and determines the type of each entry, while counting
+    how many stat() calls that required. This is shared by all of the
+    traversal backends.
+
+    If a ScanStats is given, the stat() calls are timed.
+    """
+
+    def __init__(self, scan_options=None, stats=None):
+        if scan_options is None:
+            scan_options = fss.options.ScanOptions()
+
+        self.__scan_options = scan_options
+        self.__index = None
+
+        if stats is None:
+            self.__isdir = os.path.isdir
+            self.__stat_directory = os.stat
+            self.__stat = _stat
+            self.__stat_entry = _stat_entry
+        else:
+            self.__isdir = stats.wrap(
+                            fss.constants.PHASE_STAT, 
+                            os.path.isdir)
+
+            self.__stat_directory = stats.wrap(
+                                        fss.constants.PHASE_STAT, 
+                                        os.stat)
+
+            self.__stat = stats.wrap(fss.constants.PHASE_STAT, _stat)
+            self.__stat_entry = stats.wrap(
+                                    fss.constants.PHASE_STAT, 
+                                    _stat_entry)
+
+        self.__entry_count = 0
+        self.__stat_count = 0
+        self.__stat_avoided_count = 0
+        self.__index_hit_count = 0
+        self.__index_miss_count = 0
+        self.__vanished_count = 0
+
+    def list(self, entry_path):
+        """Return (filename, filepath, is_dir, is_symlink, stat-source) for 
+        each child of the given directory. is_symlink is None if the listing 
+        doesn't tell us (it came from the index, or from os.listdir()). If 
+        metadata was requested, the stat-source is what get_metadata() needs 
+        to get it (nothing is stat'ed until then, so the entries that the 
+        filter-rules reject cost nothing). Otherwise, it's None.
+        """
+
+        if self.__scan_options.index_filepath is not None:
+            return self.__list_indexed(entry_path)
+
+        return self.__list_direct(entry_path)
+
+    def __list_direct(self, entry_path):
+        if fss.config.workers.GENERATOR_USE_SCANDIR is True:
+            return self.__list_scandir(entry_path)
+        else:
+            return self.__list_listdir(entry_path)
+
+    def __list_indexed(self, entry_path):
+        """Use the listing stored in the index if the directory hasn't changed 
+        since it was recorded (this costs one stat() rather than reading the 
+        directory). Otherwise, read it and update the index.
+        """
+
+        if self.__index is None:
+            self.__index = fss.index.ScanIndex(
+                            self.__scan_options.index_filepath)
+
+        st = self.__stat_directory(entry_path)
+        children = self.__index.get_listing(entry_path, st)
+
+        if children is not None:
+            self.__index_hit_count += 1
+            self.__entry_count += len(children)
+
+            is_metadata = self.__scan_options.metadata
+
+            # The path is the stat-source.
+            entries = []
+            for (filename, is_dir) in children:
+                filepath = os.path.join(entry_path, filename)
+                entries.append((
+                    filename, 
+                    filepath, 
+                    is_dir, 
+                    None,
+                    filepath if is_metadata is True else None))
+
+            return entries
+
+        self.__index_miss_count += 1
+
+        entries = list(self.__list_direct(entry_path))
+
+        self.__index.set_listing(
+            entry_path, 
+            st, 
+            [
+                (filename, is_dir) 
+                for (filename, filepath, is_dir, is_symlink, stat_source) 
+                in entries
+            ],
+            record_changes=self.__scan_options.record_changes)
+
+        return entries
+
+    def __list_scandir(self, entry_path):
+        """Use the file-type that the directory-listing provides (d_type). A
+        stat() is only required for symlinks (which are followed, like
+        os.path.isdir() does) and on filesystems that report DT_UNKNOWN (which
+        DirEntry handles internally).
+        """
+
+        with os.scandir(entry_path) as it:
+            for entry in it:
+                self.__entry_count += 1
+
+                try:
+                    is_symlink = entry.is_symlink()
+                except OSError:
+                    is_symlink = False
+
+                # A symlink's target is stat'ed for its type in every mode 
+                # (a skipped one is still reported as a directory). What 
+                # DirEntry does by itself on DT_UNKNOWN can't be seen, so 
+                # that's counted as avoided (see get_counters()).
+                if is_symlink is True:
+                    self.__stat_count += 1
+                else:
+                    self.__stat_avoided_count += 1
+
+                try:
+                    is_dir = entry.is_dir()
+                except OSError:
+                    is_dir = False
+
+                # The DirEntry is the stat-source.
+                if self.__scan_options.metadata is True:
+                    yield (entry.name, entry.path, is_dir, is_symlink, entry)
+                else:
+                    yield (entry.name, entry.path, is_dir, is_symlink, None)
+
+    def get_metadata(self, stat_source):
+        """Return the metadata tuple (see fss.metadata.get_metadata_tuple()) 
+        of an entry, given the stat-source that list() produced for it, or 
+        None if it has gone away since the directory was read (it should 
+        then be skipped). DirEntry caches its stat(). On Windows it's free; 
+        elsewhere it costs one call, but that saves the consumer from having 
+        to make it.
+        """
+
+        self.__stat_count += 1
+
+        try:
+            if issubclass(stat_source.__class__, str) is True:
+                st = self.__stat(stat_source)
+            else:
+                st = self.__stat_entry(stat_source)
+        except OSError:
+            _LOGGER.debug("Entry vanished before it could be stat'ed: [%s]", 
+                          stat_source)
+
+            self.__vanished_count += 1
+            return None
+
+        return fss.metadata.get_metadata_tuple(st)
+
+    def __list_listdir(self, entry_path):
+        for filename in os.listdir(entry_path):
+            self.__entry_count += 1
+            self.__stat_count += 1
+
+            filepath = os.path.join(entry_path, filename)
+            is_dir = self.__isdir(filepath)
+
+            # The path is the stat-source.
+            if self.__scan_options.metadata is True:
+                yield (filename, filepath, is_dir, None, filepath)
+            else:
+                yield (filename, filepath, is_dir, None, None)
+
+    def close(self):
+        if self.__index is not None:
+            self.__index.close()
+            self.__index = None
+
+    def get_counters(self):
+        """"stats" is the number of stat() calls that we made, or that 
+        DirEntry made for us where we know it had to (symlinks). 
+        "stats_avoided" is the number of entries whose type came from the 
+        listing, as far as we can tell: it's an upper bound, since on a 
+        filesystem that doesn't report d_type (DT_UNKNOWN), DirEntry has to 
+        lstat() every entry itself, and that can't be detected from here.
+        """
+
+        counters = {
+            'entries': self.__entry_count,
+            'stats': self.__stat_count,
+            'stats_avoided': self.__stat_avoided_count,
+            'vanished_entries': self.__vanished_count,
+        }
+
+        if self.__scan_options.index_filepath is not None:
+            counters['index_hits'] = self.__index_hit_count
+            counters['index_misses'] = self.__index_miss_count
+
+        return counters
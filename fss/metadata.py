@@ -0,0 +1,15 @@
+import collections
+
+# The metadata that can be attached to each result (opt-in). The fields are 
+# taken from the stat() of the entry.
+EntryMetadata = collections.namedtuple(
+                    'EntryMetadata', 
+                    ['size', 'mtime', 'inode', 'dev', 'mode'])
+
+
+def get_metadata_tuple(st):
+    """Reduce a stat-result to the plain tuple that is sent from the workers 
+    (it's cheaper to pickle than an EntryMetadata).
+    """
+
+    return (st.st_size, st.st_mtime, st.st_ino, st.st_dev, st.st_mode)
@@ -0,0 +1,67 @@
+import fss.constants
+
+
+class ScanOptions(object):
+    """The traversal settings that are passed down to the generator workers
+    (so it has to stay picklable).
+    """
+
+    def __init__(self, index_filepath=None, record_changes=False, 
+                 metadata=False, max_depth=None, 
+                 symlinks=fss.constants.SYMLINKS_FOLLOW, one_filesystem=False, 
+                 collect_stats=False, order=fss.constants.ORDER_BFS, 
+                 frontier_memory_limit=None, count_only=False, 
+                 summarize_depth=None, nested_roots=None, 
+                 report_reads=False):
+        # The path of a ScanIndex database to reuse directory-listings from.
+        self.index_filepath = index_filepath
+
+        # Whether to record added/removed entries in the index.
+        self.record_changes = record_changes
+
+        # Whether to attach the size, mtime, inode, device and mode of each 
+        # entry to its result.
+        self.metadata = metadata
+
+        # Entries deeper than this are neither reported nor read (the entries 
+        # directly in the root are at a depth of 1). None for no limit.
+        self.max_depth = max_depth
+
+        # How directory symlinks are treated (one of the SYMLINKS_* 
+        # constants).
+        self.symlinks = symlinks
+
+        # Whether to stay on the filesystem of the root.
+        self.one_filesystem = one_filesystem
+
+        # Whether to time the phases of the traversal (see 
+        # fss.stats.ScanStats).
+        self.collect_stats = collect_stats
+
+        # The order in which pending directories are read (one of the 
+        # ORDER_* constants), and how many of them each worker keeps in 
+        # memory before spilling them to disk (None for the default).
+        self.order = order
+        self.frontier_memory_limit = frontier_memory_limit
+
+        # Whether to only count the results (see Orchestrator.count()) rather 
+        # than producing them.
+        self.count_only = count_only
+
+        # If not None, the results are only added up per directory, down to 
+        # this depth (see Orchestrator.summarize()), rather than being 
+        # produced. This requires the metadata, for the sizes.
+        self.summarize_depth = summarize_depth
+
+        # The roots that are below another root, as that root's traversal 
+        # would arrive at them. They aren't read as part of the other root, 
+        # since they're read as themselves.
+        if nested_roots is None:
+            nested_roots = frozenset()
+
+        self.nested_roots = nested_roots
+
+        # Whether to also produce a result (of type FT_READ_DIR, without 
+        # metadata) for every directory that's read, before its entries, so 
+        # that the watcher can watch exactly those.
+        self.report_reads = report_reads
@@ -1,88 +1,1221 @@
 import logging
+import os
+import re
+import asyncio
 import time
 import multiprocessing
+import multiprocessing.connection
 import queue
 import threading
 
+import fss.constants
+import fss.config.duplicates
 import fss.config.general
 import fss.config.workers
+import fss.duplicates
+import fss.filters
+import fss.index
+import fss.metadata
+import fss.options
+import fss.rollups
+import fss.watch
 import fss.workers.generator
+import fss.workers.hasher
+import fss.workers.search
+import fss.workers.state
+import fss.workers.threaded
+import fss.workers.transport
 import fss.workers.worker_base
 
 _LOGGER = logging.getLogger(__name__)
 
 
+def _get_queue_reader(q):
+    """Return the connection that a multiprocessing queue is read from, so 
+    that we can wait on it (along with others) using 
+    multiprocessing.connection.wait().
+    """
+
+    return q._reader
+
+def _collapse_roots(paths, is_nested_dropped=True):
+    """Drop any root that's the same as another (comparing their real paths), 
+    or, if is-nested-dropped, below another, so that nothing is read twice. 
+    The order is kept.
+    """
+
+    real_paths = [os.path.realpath(path) for path in paths]
+
+    # Consider the shallowest roots first.
+    order = sorted(
+                range(len(paths)), 
+                key=lambda i: (len(real_paths[i]), i))
+
+    kept_real_paths = []
+    kept_indices = set()
+
+    for i in order:
+        real_path = real_paths[i]
+
+        for kept_real_path in kept_real_paths:
+            if real_path == kept_real_path or \
+               (is_nested_dropped is True and \
+                real_path.startswith(os.path.join(kept_real_path, ''))):
+                _LOGGER.info("Root is already covered by another: [%s]", 
+                             paths[i])
+
+                break
+        else:
+            kept_real_paths.append(real_path)
+            kept_indices.add(i)
+
+    return [path for (i, path) in enumerate(paths) if i in kept_indices]
+
+def _get_nested_roots(paths):
+    """Return the paths of the roots that are below another root, as the 
+    traversal of that other root would arrive at them, so that it can leave 
+    them to their own.
+    """
+
+    real_paths = [os.path.realpath(path) for path in paths]
+
+    nested_roots = set()
+    for (i, real_path) in enumerate(real_paths):
+        prefix = os.path.join(real_path, '')
+
+        for other_real_path in real_paths:
+            if other_real_path.startswith(prefix) is True:
+                nested_roots.add(
+                    os.path.join(
+                        paths[i], 
+                        os.path.relpath(other_real_path, real_path)))
+
+    return frozenset(nested_roots)
+
+def _merge_counters(counters, new_counters):
+    for (name, value) in new_counters.items():
+        counters[name] = counters.get(name, 0) + value
+
+
+class _ProcessPipeline(object):
+    """The chain of controllers that make up the multiprocess pipeline. 
+    Results are read from the last one.
+    """
+
+    def __init__(self, controllers, result_blocks=None):
+        self.__controllers = controllers
+        self.__result_blocks = result_blocks
+
+    def start(self):
+        for c in self.__controllers:
+            c.start()
+
+    def stop(self):
+        # They all share the same quit-event. Signal all of them before we 
+        # start waiting on any of them.
+        self.__controllers[0].quit_ev.set()
+
+        for c in self.__controllers:
+            c.stop()
+
+    def is_alive(self):
+        for c in self.__controllers:
+            if c.is_alive() is True:
+                return True
+
+        return False
+
+    @property
+    def output_q(self):
+        return self.__controllers[-1].output_q
+
+    @property
+    def result_blocks(self):
+        """The ResultBlocks that the results are packed into, or None."""
+
+        return self.__result_blocks
+
+    @property
+    def worker_count(self):
+        return self.__controllers[-1].worker_count
+
+
 class Orchestrator(object):
-    def __init__(self, path, filter_rules):
-        self.__path = path
+    """Scans one root, or a list of roots. If a list is given, all of them are 
+    scanned by the same workers, and every result is prefixed with the root 
+    that it was found under. Roots that are the same as another are dropped. 
+    So are roots that are below another if nothing is filtered or limited 
+    (the other root reaches everything below them anyway). Otherwise, they're 
+    kept, and the other root's traversal doesn't read them, so that they're 
+    only read (and filtered, and tagged) as themselves.
+
+    If a ScanPool (see fss.pool) is given, the scans are run by one of its 
+    workers rather than by processes that are started for each.
+    """
+
+    def __init__(self, path, filter_rules, workers=None, 
+                 backend=fss.constants.BACKEND_PROCESS, index_filepath=None, 
+                 metadata=False, content_pattern=None, search_workers=None, 
+                 max_depth=None, symlinks=fss.constants.SYMLINKS_FOLLOW, 
+                 one_filesystem=False, collect_stats=False, 
+                 order=fss.constants.ORDER_BFS, frontier_memory_limit=None, 
+                 pool=None):
+        if issubclass(path.__class__, (list, tuple)) is True:
+            is_nested_dropped = \
+                not filter_rules and \
+                max_depth is None and \
+                one_filesystem is False
+
+            self.__roots = _collapse_roots(list(path), is_nested_dropped)
+            self.__nested_roots = _get_nested_roots(self.__roots)
+            self.__is_multi_root = True
+        else:
+            self.__roots = [path]
+            self.__nested_roots = frozenset()
+            self.__is_multi_root = False
+
         self.__filter_rules = filter_rules
+        self.__backend = backend
+        self.__index_filepath = index_filepath
+        self.__metadata = metadata
+        self.__content_pattern = content_pattern
+        self.__max_depth = max_depth
+        self.__symlinks = symlinks
+        self.__one_filesystem = one_filesystem
+        self.__collect_stats = collect_stats
+        self.__order = order
+        self.__frontier_memory_limit = frontier_memory_limit
+        self.__pool = pool
+        self.__watcher = None
+
+        # Whether the scan is to report the directories that it reads (only 
+        # while watch() is scanning).
+        self.__is_reporting_reads = False
+        self.__counters = {}
+        self.__stats = None
+        self.__rollups = None
+        self.__terminated_count = 0
+        self.__hash_counters = {}
+        self.__hash_terminated_count = 0
+
+        # Whatever is running, so that its progress can be read.
+        self.__pipeline_state = None
+        self.__hash_state = None
+        self.__threaded_generator = None
+
+        if order not in (fss.constants.ORDER_BFS, fss.constants.ORDER_DFS):
+            raise ValueError("Order not valid: [%s]" % (order,))
+
+        if workers is not None:
+            self.__workers = workers
+        elif backend == fss.constants.BACKEND_THREAD:
+            self.__workers = fss.config.workers.THREADED_DEFAULT_THREAD_COUNT
+        else:
+            self.__workers = 1
+
+        if content_pattern is not None:
+            if backend != fss.constants.BACKEND_PROCESS:
+                raise ValueError("Content-search requires the process "
+                                 "backend.")
+
+            if issubclass(content_pattern.__class__, str) is True:
+                self.__content_pattern = content_pattern.encode('utf-8')
+
+            # Fail now (rather than in the workers) if it's not valid.
+            re.compile(self.__content_pattern)
+
+        if pool is not None:
+            if backend != fss.constants.BACKEND_PROCESS:
+                raise ValueError("A pool requires the process backend.")
+
+            if content_pattern is not None:
+                raise ValueError("Content-search can't be run on a pool.")
+
+            # Each scan is traversed by one of the pool's workers.
+            if self.__workers != 1:
+                raise ValueError("A pool scan has exactly one worker.")
+
+        if search_workers is not None:
+            self.__search_workers = search_workers
+        else:
+            self.__search_workers = os.cpu_count() or 1
+
+    def recurse(self, limit=None, raw=False):
+        """Yield (entry-type, path) for every entry that passes the 
+        filter-rules. If metadata was requested, yield (entry-type, path, 
+        EntryMetadata).
+
+        If a limit is given, stop after that many results. The workers are 
+        stopped as soon as the last one has arrived (or as soon as the 
+        consumer stops iterating, whichever comes first).
+
+        If a content-pattern was given, only files whose content matches it are 
+        yielded, with a list of (offset, line) for each matching line appended 
+        to the tuple.
+
+        If a list of roots was given, each tuple is prefixed with the root that 
+        the entry was found under.
+
+        If raw, the paths are yielded as bytes (as os.fsencode() would give 
+        them). Where the workers packed their results into shared memory, 
+        they're never decoded to str at all.
+        """
 
-    def recurse(self):
         _LOGGER.info("Orchestrator running.")
 
+        self.__hash_state = None
+
+        scan = self.__recurse(self.__metadata, raw=raw)
+
+        if limit is None:
+            return scan
+
+        return self.__limit(scan, limit)
+
+    def __limit(self, scan, limit):
+        if limit <= 0:
+            return
+
+        i = 0
+        for entry in scan:
+            i += 1
+
+            if i >= limit:
+                # Stop the workers before handing over the last result.
+                scan.close()
+
+                yield entry
+                return
+
+            yield entry
+
+    def count(self):
+        """Return a dictionary of the number of results of each entry-type 
+        (FT_DIR and FT_FILE). The workers only count them; nothing is sent 
+        back for each one. If a content-pattern was given, the files still 
+        have to be sent to the searchers, so the matches are counted here.
+        """
+
+        _LOGGER.info("Orchestrator counting.")
+
+        self.__hash_state = None
+
+        counts = {
+            fss.constants.FT_DIR: 0,
+            fss.constants.FT_FILE: 0,
+        }
+
+        if self.__content_pattern is not None:
+            # Skip the root, if the results are tagged with it.
+            i = 1 if self.__is_multi_root is True else 0
+
+            for entry in self.__recurse(False):
+                counts[entry[i]] += 1
+
+            return counts
+
+        for entry in self.__recurse(False, count_only=True):
+            pass
+
+        counts[fss.constants.FT_DIR] = \
+            self.__counters.get('counted_directories', 0)
+
+        counts[fss.constants.FT_FILE] = \
+            self.__counters.get('counted_files', 0)
+
+        return counts
+
+    def summarize(self, depth=0, top=None):
+        """Return the number of directories and files, and the total size of 
+        the files, below the root and below every directory down to the given 
+        depth (like "du --max-depth"). Only the results that recurse() would 
+        yield are counted.
+
+        The workers add them up themselves and only send one record per 
+        directory when they've finished. If a content-pattern was given, the 
+        matching files are added up here instead.
+
+        Returns a list of (path, DirectoryTotals), in the order of the paths, 
+        or, if top is given, just that many of the largest, largest first. If 
+        a list of roots was given, each tuple is prefixed with the root.
+        """
+
+        _LOGGER.info("Orchestrator summarizing.")
+
+        self.__hash_state = None
+
+        if self.__content_pattern is not None:
+            rollups = self.__summarize_results(depth)
+        else:
+            for entry in self.__recurse(True, summarize_depth=depth):
+                pass
+
+            rollups = self.__rollups
+
+            # If the workers went away without reporting anything.
+            if rollups is None:
+                rollups = fss.rollups.DirectoryRollups(depth)
+
+        summary = []
+        for ((root_index, rel_path), totals) in \
+                rollups.get_cumulative().items():
+            root = self.__roots[root_index or 0]
+            path = os.path.join(root, rel_path) if rel_path else root
+
+            if self.__is_multi_root is True:
+                summary.append((root, path, totals))
+            else:
+                summary.append((path, totals))
+
+        if top is None:
+            summary.sort(key=lambda entry: entry[-2])
+            return summary
+
+        summary.sort(key=lambda entry: entry[-1].bytes, reverse=True)
+        return summary[:top]
+
+    def __summarize_results(self, depth):
+        """Add up the results in this process (when they have to pass 
+        through the searchers anyway).
+        """
+
+        rollups = fss.rollups.DirectoryRollups(depth)
+
+        # Skip the root, if the results are tagged with it.
+        i = 1 if self.__is_multi_root is True else 0
+
+        for entry in self.__recurse(True):
+            if self.__is_multi_root is True:
+                root_index = self.__roots.index(entry[0])
+                root = entry[0]
+            else:
+                root_index = None
+                root = self.__roots[0]
+
+            (entry_type, entry_filepath, metadata) = entry[i:i + 3]
+
+            rel_path = os.path.relpath(
+                        os.path.dirname(entry_filepath), 
+                        root)
+
+            if rel_path == os.curdir:
+                rel_path = ''
+            else:
+                rel_path = fss.filters.normalize_path(rel_path)
+
+            totals = rollups.get_totals(root_index, rel_path)
+
+            if entry_type == fss.constants.FT_DIR:
+                totals[0] += 1
+            else:
+                totals[1] += 1
+                totals[2] += metadata.size
+
+        return rollups
+
+    def first(self):
+        """Return the first result that recurse() would yield, or None if 
+        there are none. The workers are stopped as soon as it's found.
+        """
+
+        for entry in self.recurse(limit=1):
+            return entry
+
+        return None
+
+    def exists(self):
+        """Return True if anything passes the filter-rules (and matches the 
+        content-pattern, if one was given).
+        """
+
+        return self.first() is not None
+
+    def __recurse(self, metadata, count_only=False, summarize_depth=None, 
+                  raw=False):
+        if self.__backend == fss.constants.BACKEND_THREAD:
+            return self.__recurse_threaded(
+                    metadata, 
+                    count_only, 
+                    summarize_depth, 
+                    raw)
+        elif self.__backend == fss.constants.BACKEND_PROCESS:
+            return self.__recurse_process(
+                    metadata, 
+                    count_only, 
+                    summarize_depth, 
+                    raw)
+        else:
+            raise ValueError("Backend not valid: [%s]" % (self.__backend,))
+
+    def __recurse_threaded(self, metadata, count_only=False, 
+                           summarize_depth=None, raw=False):
+        """Traverse using a pool of threads in this process."""
+
+        t = fss.workers.threaded.ThreadedGenerator(
+                self.__filter_rules, 
+                self.__workers,
+                scan_options=self.__get_scan_options(
+                                metadata, 
+                                count_only, 
+                                summarize_depth))
+
+        self.__add_roots(t)
+        self.__threaded_generator = t
+        t.start()
+
+        try:
+            for batch in t.get_batches():
+                for entry in self.__translate_batch(batch, metadata, raw):
+                    yield entry
+        finally:
+            t.stop()
+
+        self.__counters = t.get_counters()
+        self.__stats = t.get_stats()
+        self.__rollups = t.get_rollups()
+
+    def __recurse_process(self, metadata, count_only=False, 
+                          summarize_depth=None, raw=False):
+        """Traverse using the multiprocess pipeline."""
+
+        (p, log_q) = self.__start_process_pipeline(
+                        metadata, 
+                        count_only, 
+                        summarize_depth)
+
+        # Start foreground loop.
+
+        # We block on both of the channels that the pipeline writes to rather 
+        # than polling them.
+        readers = [
+            _get_queue_reader(p.output_q),
+            _get_queue_reader(log_q),
+        ]
+
+        # Loop while any of the components is still running (but only check 
+        # when all components have been started). If the consumer stops 
+        # early (closing us), the workers are stopped right away.
+
+        try:
+            while self.__is_process_pipeline_finished(p) is False:
+                ready = multiprocessing.connection.wait(
+                            readers, 
+                            timeout=fss.config.general.\
+                                        FOREGROUND_WAIT_TIMEOUT_S)
+
+                if not ready and \
+                   self.__check_process_pipeline_died(p, log_q):
+                    break
+
+                # Yield any results.
+
+                for batch in self.__read_process_batches(p):
+                    for entry in self.__translate_batch(
+                                    batch, 
+                                    metadata, 
+                                    raw, 
+                                    p.result_blocks):
+                        yield entry
+
+                # Forward log messages to local log-handler.
+
+                self.__forward_logs(log_q)
+        finally:
+            _LOGGER.info("Terminating worker.")
+
+            self.__stop_process_pipeline(p, log_q)
+
+    def __get_scan_options(self, metadata, count_only=False, 
+                           summarize_depth=None):
+        record_changes = False
+
+        if self.__index_filepath is not None:
+            # Only record changes if we have something to compare against 
+            # (otherwise everything would be "added").
+
+            index = fss.index.ScanIndex(self.__index_filepath)
+
+            try:
+                record_changes = index.begin_scan()
+            finally:
+                index.close()
+
+        return fss.options.ScanOptions(
+                index_filepath=self.__index_filepath,
+                record_changes=record_changes,
+                metadata=metadata,
+                max_depth=self.__max_depth,
+                symlinks=self.__symlinks,
+                one_filesystem=self.__one_filesystem,
+                collect_stats=self.__collect_stats,
+                order=self.__order,
+                frontier_memory_limit=self.__frontier_memory_limit,
+                count_only=count_only,
+                summarize_depth=summarize_depth,
+                nested_roots=self.__nested_roots,
+                report_reads=self.__is_reporting_reads)
+
+    def __get_tagged_roots(self):
+        """Return (root, root-index) for every root. The workers only tag 
+        their results with the index of the root if there can be more than 
+        one.
+        """
+
+        return [
+            (root, i if self.__is_multi_root is True else None)
+            for (i, root)
+            in enumerate(self.__roots)
+        ]
+
+    def __add_roots(self, generator):
+        for (root, root_index) in self.__get_tagged_roots():
+            generator.add_root(root, root_index=root_index)
+
+    def __translate_batch(self, batch, metadata, raw=False, 
+                          result_blocks=None):
+        """The workers send the metadata as plain tuples. Present it as 
+        EntryMetadata. When there are several roots, the workers put the index 
+        of the root after the path. Replace it with the root, at the front.
+
+        A batch that was packed into shared memory is unpacked straight into 
+        that form (lazily).
+        """
+
+        if issubclass(
+                batch.__class__, 
+                fss.workers.transport.PackedBatch) is True:
+            return result_blocks.unpack(batch, roots=self.__roots, raw=raw)
+
+        if raw is True:
+            batch = [
+                (entry[0], os.fsencode(entry[1])) + entry[2:]
+                for entry
+                in batch
+            ]
+
+        if self.__is_multi_root is True:
+            roots = self.__roots
+
+            if metadata is False:
+                return [
+                    (roots[entry[2]], entry[0], entry[1]) + entry[3:]
+                    for entry
+                    in batch
+                ]
+
+            return [
+                (roots[entry[2]], 
+                 entry[0], 
+                 entry[1], 
+                 fss.metadata.EntryMetadata._make(entry[3])) + \
+                    entry[4:]
+                for entry
+                in batch
+            ]
+
+        if metadata is False:
+            return batch
+
+        return [
+            (entry[0], entry[1], fss.metadata.EntryMetadata._make(entry[2])) + \
+                entry[3:]
+            for entry
+            in batch
+        ]
+
+    def get_changes(self):
+        """Return (change-type, entry-type, path) for every entry that was 
+        added or removed, relative to the index, by the last scan. This 
+        requires an index.
+        """
+
+        assert self.__index_filepath is not None, \
+               "Changes are only tracked when an index is used."
+
+        index = fss.index.ScanIndex(self.__index_filepath)
+
+        try:
+            return index.get_changes()
+        finally:
+            index.close()
+
+    def __start_process_pipeline(self, metadata, count_only=False, 
+                                 summarize_depth=None):
+        if self.__pool is not None:
+            return self.__start_pool_job(
+                    metadata, 
+                    count_only, 
+                    summarize_depth)
+
         log_q = multiprocessing.Queue()
 
+        worker_counts = [(fss.constants.PC_GENERATOR, self.__workers)]
+        if self.__content_pattern is not None:
+            worker_counts.append(
+                (fss.constants.PC_SEARCH, self.__search_workers))
+
         # This is shared among all of the workers, in order to track their 
-        # states.
-        m = multiprocessing.Manager()
-        pipeline_state = m.dict({
-            ('running_' + fss.constants.PC_GENERATOR): 
-                fss.constants.PCS_INITIAL,
-        })
+        # states and progress.
+        pipeline_state = fss.workers.state.PipelineState(worker_counts)
+        self.__pipeline_state = pipeline_state
+
+        # The generator's results are packed into shared memory, if they're 
+        # coming straight to us (and there are any).
+
+        if self.__content_pattern is None and \
+           count_only is False and \
+           summarize_depth is None and \
+           fss.config.workers.GENERATOR_PACK_RESULTS is True:
+            result_blocks = fss.workers.transport.ResultBlocks(self.__workers)
+        else:
+            result_blocks = None
 
         # Create the generator.
 
         generator_input_q = multiprocessing.Queue()
-        generator_input_q.put(self.__path)
 
         g = fss.workers.generator.GeneratorController(
                 self.__filter_rules,
                 pipeline_state, 
                 generator_input_q,
-                log_q)
+                log_q,
+                worker_count=self.__workers,
+                scan_options=self.__get_scan_options(
+                                metadata, 
+                                count_only, 
+                                summarize_depth),
+                result_blocks=result_blocks)
+
+        self.__add_roots(g)
+
+        controllers = [g]
+
+        # Create the searcher, which reads the generator's results.
+
+        if self.__content_pattern is not None:
+            s = fss.workers.search.SearchController(
+                    self.__content_pattern,
+                    self.__workers,
+                    pipeline_state,
+                    g.output_q,
+                    log_q,
+                    quit_ev=g.quit_ev,
+                    worker_count=self.__search_workers)
+
+            controllers.append(s)
+
+        p = _ProcessPipeline(controllers, result_blocks=result_blocks)
 
         # Start the pipeline.
 
-        g.start()
+        self.__counters = {}
+        self.__stats = None
+        self.__rollups = None
+        self.__terminated_count = 0
 
-        # Start foreground loop.
+        p.start()
 
-        # Loop while any of the components is still running (but only check 
-        # when all components have been started).
-        keep_running = True
-        while keep_running is True:
-            # Yield any results.
+        return (p, log_q)
 
-            i = 0
-            while i < fss.config.general.MAX_RESULT_BATCH_READ_COUNT:
-                try:
-                    entry = g.output_q.get(block=False)
-                except queue.Empty:
+    def __start_pool_job(self, metadata, count_only=False, 
+                         summarize_depth=None):
+        """Hand the scan to a worker of the pool. The job stands in for the 
+        pipeline (and the log-queue is the worker's own).
+        """
+
+        is_packed = count_only is False and \
+                    summarize_depth is None and \
+                    fss.config.workers.GENERATOR_PACK_RESULTS is True
+
+        scan_options = self.__get_scan_options(
+                        metadata, 
+                        count_only, 
+                        summarize_depth)
+
+        self.__counters = {}
+        self.__stats = None
+        self.__rollups = None
+        self.__terminated_count = 0
+
+        job = self.__pool.start_job(
+                self.__get_tagged_roots(),
+                self.__filter_rules,
+                scan_options,
+                is_packed=is_packed)
+
+        self.__pipeline_state = job
+
+        return (job, job.log_q)
+
+    def __stop_process_pipeline(self, p, log_q):
+        if self.__pool is not None:
+            # The pool cancels the job if we didn't see it finish, and keeps 
+            # the worker (and its queues).
+            self.__pool.finish_job(
+                p, 
+                self.__is_process_pipeline_finished(p))
+
+            return
+
+        p.stop()
+
+        self.__forward_logs(log_q)
+        log_q.close()
+
+    def __read_process_batches(self, p):
+        """Yield the batches of results that are available right now. Every 
+        generator worker sends its own termination message.
+        """
+
+        i = 0
+        while i < fss.config.general.MAX_RESULT_BATCH_READ_COUNT:
+            try:
+                entry = p.output_q.get(block=False)
+            except queue.Empty:
+                break
+
+            if issubclass(
+                    entry.__class__, 
+                    fss.workers.worker_base.TerminationMessage) is True:
+
+                _merge_counters(self.__counters, entry.counters)
+                self.__merge_stats(entry.stats)
+                self.__merge_rollups(entry.rollups)
+                self.__terminated_count += 1
+
+                if self.__is_process_pipeline_finished(p) is True:
                     break
-                else:
-                    if issubclass(
-                            entry.__class__, 
-                            fss.workers.worker_base.TerminationMessage) is True:
 
-                        keep_running = False
-                        break
+                continue
 
-                    (entry_type, entry_filepath) = entry
-                    yield (entry_type, entry_filepath)
+            # Results arrive in batches.
+            yield entry
 
-                i += 1
+            i += 1
 
-            # Forward log messages to local log-handler.
+    def __merge_stats(self, stats):
+        if stats is None:
+            return
 
-            j = 0
-            while j < fss.config.general.MAX_LOG_BATCH_READ_COUNT:
-                try:
-                    (cls_name, level, message) = log_q.get(block=False)
-                except queue.Empty:
+        if self.__stats is None:
+            self.__stats = stats
+        else:
+            self.__stats.merge(stats)
+
+    def __merge_rollups(self, rollups):
+        if rollups is None:
+            return
+
+        if self.__rollups is None:
+            self.__rollups = rollups
+        else:
+            self.__rollups.merge(rollups)
+
+    def __is_process_pipeline_finished(self, p):
+        return self.__terminated_count >= p.worker_count
+
+    def __check_process_pipeline_died(self, p, log_q):
+        """Return True if the workers have gone away without telling us that 
+        they're done, so that we don't wait on them forever.
+        """
+
+        if p.is_alive() is True:
+            return False
+
+        self.__forward_logs(log_q)
+
+        if p.output_q.empty() is False:
+            return False
+
+        _LOGGER.error("Pipeline terminated unexpectedly.")
+        return True
+
+    def find_duplicates(self, min_size=fss.config.duplicates.DEFAULT_MIN_SIZE,
+                        hash_workers=None):
+        """Yield (size, [path, ...]) for every set of files (of at least
+        min-size bytes) that have identical content. Files are grouped by the
+        size that the scan already reports, and a pool of hash processes
+        (hash-workers, by default one per CPU) hashes only the first and last
+        blocks of the files that share a size, and then, in full, only the
+        files that still match.
+
+        Nothing can be reported for a size until the scan has finished, but
+        the hashing starts as soon as two files of the same size are found.
+        Afterward, the counters include the number of bytes that were read
+        ("bytes_read") and the total size of the files that were considered
+        ("total_bytes").
+        """
+
+        _LOGGER.info("Orchestrator finding duplicates.")
+
+        if hash_workers is None:
+            hash_workers = os.cpu_count() or 1
+
+        finder = fss.duplicates.DuplicateFinder(min_size)
+        (h, log_q) = self.__start_hasher(hash_workers)
+
+        readers = [
+            _get_queue_reader(h.output_q),
+            _get_queue_reader(log_q),
+        ]
+
+        # The scan always carries the metadata, for the sizes.
+        scan = self.__recurse(True)
+
+        jobs = []
+        is_finishing = False
+
+        try:
+            # Hash while scanning. We send the jobs, and collect the digests,
+            # in batches.
+
+            # Skip the root, if the results are tagged with it.
+            i = 1 if self.__is_multi_root is True else 0
+
+            # The time of the last flush (see HASH_JOB_FLUSH_INTERVAL_S).
+            last_epoch = time.time()
+            for entry in scan:
+                if entry[i] == fss.constants.FT_FILE:
+                    jobs += finder.add_file(entry[i + 1], entry[i + 2].size)
+
+                if len(jobs) < fss.config.duplicates.HASH_JOB_BATCH_SIZE and \
+                   (time.time() - last_epoch) < \
+                        fss.config.duplicates.HASH_JOB_FLUSH_INTERVAL_S:
+                    continue
+
+                self.__send_hash_jobs(h, jobs)
+
+                for duplicate_set in self.__read_hash_results(h, finder, jobs):
+                    yield duplicate_set
+
+                self.__forward_logs(log_q)
+                last_epoch = time.time()
+
+            # Every size-group is now complete. Keep going until every hash has
+            # come back, and then until every hasher has reported its counters.
+
+            for duplicate_set in finder.finish_scan():
+                yield duplicate_set
+
+            while self.__hash_terminated_count < h.worker_count:
+                self.__send_hash_jobs(h, jobs)
+
+                if is_finishing is False and finder.is_finished() is True:
+                    h.finish()
+                    is_finishing = True
+
+                ready = multiprocessing.connection.wait(
+                            readers,
+                            timeout=fss.config.general.\
+                                        FOREGROUND_WAIT_TIMEOUT_S)
+
+                if not ready and \
+                   h.is_alive() is False and \
+                   h.output_q.empty() is True:
+                    _LOGGER.error("Hasher terminated unexpectedly.")
+                    break
+
+                for duplicate_set in self.__read_hash_results(h, finder, jobs):
+                    yield duplicate_set
+
+                self.__forward_logs(log_q)
+        finally:
+            scan.close()
+
+            _LOGGER.info("Terminating hasher.")
+
+            h.stop()
+
+            self.__forward_logs(log_q)
+            log_q.close()
+
+        _merge_counters(self.__counters, self.__hash_counters)
+        _merge_counters(self.__counters, finder.get_counters())
+
+    def __start_hasher(self, hash_workers):
+        log_q = multiprocessing.Queue()
+
+        self.__hash_state = fss.workers.state.PipelineState(
+                                [(fss.constants.PC_HASHER, hash_workers)])
+
+        h = fss.workers.hasher.HashController(
+                self.__hash_state,
+                multiprocessing.Queue(),
+                log_q,
+                worker_count=hash_workers)
+
+        self.__hash_counters = {}
+        self.__hash_terminated_count = 0
+
+        h.start()
+
+        return (h, log_q)
+
+    def __send_hash_jobs(self, h, jobs):
+        batch_size = fss.config.duplicates.HASH_JOB_BATCH_SIZE
+
+        for i in range(0, len(jobs), batch_size):
+            h.input_q.put(jobs[i:i + batch_size])
+
+        del jobs[:]
+
+    def __read_hash_results(self, h, finder, jobs):
+        """Give the digests that are available right now to the finder. Add
+        the jobs that are needed next to the given list, and yield the
+        duplicate sets that have been completed.
+        """
+
+        i = 0
+        while i < fss.config.general.MAX_RESULT_BATCH_READ_COUNT:
+            try:
+                batch = h.output_q.get(block=False)
+            except queue.Empty:
+                break
+
+            if issubclass(
+                    batch.__class__,
+                    fss.workers.worker_base.TerminationMessage) is True:
+
+                _merge_counters(self.__hash_counters, batch.counters)
+                self.__hash_terminated_count += 1
+
+                continue
+
+            for (hash_type, size, filepath, digest) in batch:
+                (next_jobs, duplicate_sets) = finder.add_digest(
+                                                hash_type,
+                                                size,
+                                                filepath,
+                                                digest)
+
+                jobs += next_jobs
+
+                for duplicate_set in duplicate_sets:
+                    yield duplicate_set
+
+            i += 1
+
+    def watch(self, include_existing=False):
+        """Scan, and then keep watching every directory that was visited 
+        (Linux only). Yields (event-type, entry-type, path) indefinitely for 
+        everything that's created, deleted or moved, subject to the same 
+        filter-rules. If requested, the results of the initial scan are 
+        yielded first (with an event-type of EVENT_EXISTING). The events are 
+        not tagged with their root.
+
+        The directories that are watched are the ones that the scan read, 
+        including those that were only read because a path-rule might 
+        include something below them.
+        """
+
+        if self.__content_pattern is not None:
+            raise ValueError("Content-search can't be watched.")
+
+        self.__watcher = fss.watch.Watcher(
+                            self.__filter_rules, 
+                            max_depth=self.__max_depth,
+                            symlinks=self.__symlinks,
+                            one_filesystem=self.__one_filesystem)
+
+        try:
+            # Register the watches as the directories are found rather than 
+            # afterward, to narrow the window in which changes can be missed.
+
+            for root in self.__roots:
+                self.__watcher.add_root(root)
+
+            # Skip the root, if the results are tagged with it.
+            i = 1 if self.__is_multi_root is True else 0
+
+            self.__is_reporting_reads = True
+            self.__hash_state = None
+
+            for result in self.__recurse(False):
+                (entry_type, entry_filepath) = (result[i], result[i + 1])
+
+                if entry_type == fss.constants.FT_READ_DIR:
+                    self.__watcher.add_directory(entry_filepath)
+                    continue
+
+                # So that a rescan (after an overflow) can tell what changed.
+                self.__watcher.add_entry(entry_type, entry_filepath)
+
+                if include_existing is True:
+                    yield (
+                        fss.constants.EVENT_EXISTING, 
+                        entry_type, 
+                        entry_filepath)
+
+            self.__is_reporting_reads = False
+
+            for event in self.__watcher.events():
+                yield event
+        finally:
+            self.__is_reporting_reads = False
+            self.__watcher.close()
+
+    def get_watch_metrics(self):
+        """Return the metrics of the current (or last) watch."""
+
+        assert self.__watcher is not None, \
+               "Not watching."
+
+        return self.__watcher.get_metrics()
+
+    def arecurse(self):
+        """An asynchronous equivalent of recurse(). Results are delivered in 
+        batches (lists of the same tuples that recurse() yields). The 
+        generator workers are only read from when the consumer asks for more, 
+        so a slow consumer applies backpressure to them. Cancelling the 
+        consumer (or closing the generator) stops the workers.
+        """
+
+        _LOGGER.info("Orchestrator running (async).")
+
+        self.__hash_state = None
+
+        if self.__backend == fss.constants.BACKEND_THREAD:
+            return self.__arecurse_threaded()
+        elif self.__backend == fss.constants.BACKEND_PROCESS:
+            return self.__arecurse_process()
+        else:
+            raise ValueError("Backend not valid: [%s]" % (self.__backend,))
+
+    async def __arecurse_threaded(self):
+        loop = asyncio.get_event_loop()
+
+        t = fss.workers.threaded.ThreadedGenerator(
+                self.__filter_rules, 
+                self.__workers,
+                scan_options=self.__get_scan_options(self.__metadata))
+
+        self.__add_roots(t)
+        self.__threaded_generator = t
+        t.start()
+
+        try:
+            while True:
+                batch = await loop.run_in_executor(None, t.get_batch)
+                if batch is None:
                     break
-                else:
-                    _LOGGER.log(level, cls_name + ": " + message)
 
-        _LOGGER.info("Terminating worker.")
+                yield self.__translate_batch(batch, self.__metadata)
+        finally:
+            await loop.run_in_executor(None, t.stop)
+
+        self.__counters = t.get_counters()
+        self.__stats = t.get_stats()
+
+    async def __arecurse_process(self):
+        loop = asyncio.get_event_loop()
+
+        (p, log_q) = self.__start_process_pipeline(self.__metadata)
+
+        # Rather than blocking, have the event-loop tell us when either of the 
+        # channels becomes readable.
+
+        ready_ev = asyncio.Event()
+
+        fds = [
+            _get_queue_reader(p.output_q).fileno(),
+            _get_queue_reader(log_q).fileno(),
+        ]
+
+        for fd in fds:
+            loop.add_reader(fd, ready_ev.set)
+
+        try:
+            while self.__is_process_pipeline_finished(p) is False:
+                try:
+                    await asyncio.wait_for(
+                            ready_ev.wait(), 
+                            fss.config.general.FOREGROUND_WAIT_TIMEOUT_S)
+                except asyncio.TimeoutError:
+                    if self.__check_process_pipeline_died(p, log_q):
+                        break
+
+                ready_ev.clear()
+
+                for batch in self.__read_process_batches(p):
+                    yield list(
+                        self.__translate_batch(
+                            batch, 
+                            self.__metadata, 
+                            result_blocks=p.result_blocks))
+
+                self.__forward_logs(log_q)
+
+                # Don't starve the event-loop if the results are arriving 
+                # faster than we can hand them off.
+                await asyncio.sleep(0)
+        finally:
+            for fd in fds:
+                loop.remove_reader(fd)
+
+            _LOGGER.info("Terminating worker.")
+
+            await loop.run_in_executor(
+                    None, 
+                    self.__stop_process_pipeline, 
+                    p, 
+                    log_q)
+
+    def __forward_logs(self, log_q):
+        j = 0
+        while j < fss.config.general.MAX_LOG_BATCH_READ_COUNT:
+            try:
+                (cls_name, level, message) = log_q.get(block=False)
+            except queue.Empty:
+                break
+            else:
+                _LOGGER.log(level, cls_name + ": " + message)
+
+            j += 1
+
+    def progress(self):
+        """Return the progress of the current (or last) scan: a dictionary of 
+        counters for each component (see fss.workers.state.PROGRESS_COUNTERS), 
+        as well as the number of its workers that are still running. This may 
+        be called from another thread while the results are being consumed. 
+        The counters are read from shared memory without locking, so they may 
+        be a moment behind.
+        """
+
+        progress = {}
+
+        if self.__backend == fss.constants.BACKEND_THREAD:
+            if self.__threaded_generator is not None:
+                progress[fss.constants.PC_GENERATOR] = \
+                    self.__threaded_generator.get_progress()
+        elif self.__pipeline_state is not None:
+            progress.update(self.__pipeline_state.get_progress())
+
+        if self.__hash_state is not None:
+            progress.update(self.__hash_state.get_progress())
+
+        return progress
+
+    @property
+    def roots(self):
+        """The roots that are scanned (see above for the ones that are 
+        dropped).
+        """
+
+        return self.__roots
+
+    @property
+    def counters(self):
+        """The counters reported by the pipeline at the end of the last 
+        scan.
+        """
+
+        return self.__counters
+
+    @property
+    def stats(self):
+        """Where the time of the last scan went (a fss.stats.ScanStats, with 
+        the phases of all of the generator workers added together), if 
+        collect-stats was given. Otherwise, None.
+        """
 
-        g.stop()
+        return self.__stats
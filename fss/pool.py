@@ -0,0 +1,384 @@
+import logging
+import os
+import queue
+import threading
+import multiprocessing
+
+import fss.constants
+import fss.config.pool
+import fss.config.workers
+import fss.subtrees
+import fss.orchestrator
+import fss.workers.frontier
+import fss.workers.generator
+import fss.workers.state
+import fss.workers.transport
+import fss.workers.worker_base
+
+_LOGGER = logging.getLogger(__name__)
+
+def _forward_logs(log_q):
+    while True:
+        try:
+            (cls_name, level, message) = log_q.get(block=False)
+        except queue.Empty:
+            break
+        else:
+            _LOGGER.log(level, cls_name + ": " + message)
+
+
+class _PoolSlot(object):
+    """One of the pool's worker processes and the channels that it's fed by
+    and that it writes to. A slot runs one job at a time.
+    """
+
+    def __init__(self, index):
+        self.index = index
+        self.process = None
+        self.job_q = None
+        self.output_q = None
+        self.log_q = None
+        self.cancel_ev = None
+
+        # The number of jobs that the current process has been given.
+        self.job_count = 0
+
+
+class PoolJob(object):
+    """A scan that's running on one of the pool's workers. This is what the
+    orchestrator reads the results from, in place of the pipeline that it
+    would otherwise start.
+    """
+
+    def __init__(self, slot, pipeline_state, result_blocks):
+        self.__slot = slot
+        self.__pipeline_state = pipeline_state
+        self.__result_blocks = result_blocks
+        self.__final_progress = None
+
+    def detach(self):
+        """The worker is being handed back to the pool. Keep the progress
+        that it had reached, since the slot is about to be reused.
+        """
+
+        self.__final_progress = self.get_progress()
+        self.__slot = None
+
+    def is_alive(self):
+        if self.__slot is None:
+            return False
+
+        return self.__slot.process.is_alive()
+
+    def get_progress(self):
+        if self.__final_progress is not None:
+            return self.__final_progress
+
+        return self.__pipeline_state.get_worker_progress(
+                fss.constants.PC_GENERATOR,
+                self.__slot.index)
+
+    @property
+    def slot(self):
+        return self.__slot
+
+    @property
+    def output_q(self):
+        return self.__slot.output_q
+
+    @property
+    def log_q(self):
+        return self.__slot.log_q
+
+    @property
+    def result_blocks(self):
+        """The ResultBlocks that the results are packed into, or None."""
+
+        return self.__result_blocks
+
+    @property
+    def worker_count(self):
+        return 1
+
+
+class ScanPool(object):
+    """A set of generator processes that are started once and then reused
+    for many scans, so that a scan of a small tree doesn't pay for starting
+    (and stopping) processes, queues and shared memory every time.
+
+    Each scan (a job) is given to one idle worker, which traverses it alone,
+    and has that worker's channels to itself until it has finished (or been
+    cancelled). Concurrent scans (from different threads) therefore run on
+    different workers; a scan waits if all of them are busy. A worker is
+    replaced with a fresh process after max-jobs-per-worker jobs, or if it
+    died.
+
+    Pass the pool to Orchestrator (pool=...) to run its scans here. Results,
+    counters, progress and early termination work as they do for a one-shot
+    scan.
+    """
+
+    def __init__(self, size=None, max_jobs_per_worker=None):
+        if size is None:
+            size = fss.config.pool.POOL_DEFAULT_SIZE or os.cpu_count() or 1
+
+        if max_jobs_per_worker is None:
+            max_jobs_per_worker = fss.config.pool.POOL_MAX_JOBS_PER_WORKER
+
+        self.__size = size
+        self.__max_jobs_per_worker = max_jobs_per_worker
+
+        self.__pipeline_state = fss.workers.state.PipelineState(
+                                    [(fss.constants.PC_GENERATOR, size)])
+
+        if fss.config.workers.GENERATOR_PACK_RESULTS is True:
+            self.__result_blocks = fss.workers.transport.ResultBlocks(size)
+        else:
+            self.__result_blocks = None
+
+        self.__slots = [_PoolSlot(i) for i in range(size)]
+        self.__idle_slots = list(self.__slots)
+        self.__condition = threading.Condition()
+        self.__is_closed = False
+
+        _LOGGER.info("Starting pool with (%d) worker(s).", size)
+
+        for slot in self.__slots:
+            self.__start_slot(slot)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __start_slot(self, slot):
+        slot.job_q = multiprocessing.Queue()
+        slot.output_q = multiprocessing.Queue(
+                            maxsize=fss.config.workers.\
+                                        GENERATOR_MAX_OUTPUT_QUEUE_SIZE)
+
+        slot.log_q = multiprocessing.Queue()
+        slot.cancel_ev = multiprocessing.Event()
+        slot.job_count = 0
+
+        self.__pipeline_state.reset_slot(
+            self.__pipeline_state.get_slot(
+                fss.constants.PC_GENERATOR,
+                slot.index))
+
+        if self.__result_blocks is not None:
+            self.__result_blocks.reset(slot.index)
+
+        args = (
+            slot.index,
+            self.__pipeline_state,
+            self.__result_blocks,
+            slot.job_q,
+            slot.output_q,
+            slot.log_q,
+            slot.cancel_ev,
+        )
+
+        slot.process = multiprocessing.Process(target=_boot, args=args)
+        slot.process.start()
+
+    def __stop_slot(self, slot):
+        """Tell the worker to exit (after cancelling whatever it's doing),
+        and wait for it.
+        """
+
+        slot.cancel_ev.set()
+        slot.job_q.put(None)
+
+        while True:
+            slot.process.join(timeout=fss.config.pool.POOL_DRAIN_INTERVAL_S)
+            if slot.process.is_alive() is False:
+                break
+
+            self.__drain(slot)
+
+        self.__drain(slot)
+
+        slot.job_q.close()
+        slot.output_q.close()
+        slot.log_q.close()
+
+    def __drain(self, slot):
+        """Discard whatever is waiting in the output-queue (freeing the
+        blocks of any packed batches). Return True if the termination message
+        was among it.
+        """
+
+        is_terminated = False
+
+        while True:
+            try:
+                entry = slot.output_q.get(block=False)
+            except queue.Empty:
+                break
+
+            if issubclass(
+                    entry.__class__,
+                    fss.workers.worker_base.TerminationMessage) is True:
+                is_terminated = True
+            elif issubclass(
+                    entry.__class__,
+                    fss.workers.transport.PackedBatch) is True:
+                self.__result_blocks.release(entry)
+
+        _forward_logs(slot.log_q)
+
+        return is_terminated
+
+    def __cancel(self, slot):
+        """Stop the job that's running on the given slot, and discard its
+        output up to (and including) its termination message, so that
+        nothing of it is left for the next job.
+        """
+
+        slot.cancel_ev.set()
+
+        while self.__drain(slot) is False:
+            if slot.process.is_alive() is False:
+                if self.__drain(slot) is False:
+                    _LOGGER.error("Pool worker (%d) terminated unexpectedly.",
+                                  slot.index)
+
+                break
+
+            slot.process.join(timeout=fss.config.pool.POOL_DRAIN_INTERVAL_S)
+
+        slot.cancel_ev.clear()
+
+    def start_job(self, roots, filter_rules_raw, scan_options,
+                  is_packed=True):
+        """Hand a scan to an idle worker, waiting for one if they're all
+        busy. The roots are a list of (path, root-index), the root-index being
+        None if the results aren't to be tagged with it. Return a PoolJob,
+        which has to be given back to finish_job().
+        """
+
+        with self.__condition:
+            while not self.__idle_slots and self.__is_closed is False:
+                self.__condition.wait()
+
+            if self.__is_closed is True:
+                raise ValueError("Pool is closed.")
+
+            slot = self.__idle_slots.pop()
+
+        if slot.process.is_alive() is False:
+            _LOGGER.warning("Replacing dead pool worker (%d).", slot.index)
+
+            self.__stop_slot(slot)
+            self.__start_slot(slot)
+
+        self.__pipeline_state.reset_slot(
+            self.__pipeline_state.get_slot(
+                fss.constants.PC_GENERATOR,
+                slot.index))
+
+        if self.__result_blocks is None:
+            is_packed = False
+
+        slot.job_count += 1
+        slot.job_q.put((roots, filter_rules_raw, scan_options, is_packed))
+
+        return PoolJob(
+                slot,
+                self.__pipeline_state,
+                self.__result_blocks if is_packed is True else None)
+
+    def finish_job(self, job, is_drained):
+        """Give the job's worker back to the pool. If the job's termination
+        message wasn't read (the consumer stopped early), the job is cancelled
+        first.
+        """
+
+        slot = job.slot
+
+        if is_drained is False:
+            self.__cancel(slot)
+
+        _forward_logs(slot.log_q)
+        job.detach()
+
+        if slot.job_count >= self.__max_jobs_per_worker:
+            _LOGGER.debug("Recycling pool worker (%d).", slot.index)
+
+            self.__stop_slot(slot)
+            self.__start_slot(slot)
+
+        with self.__condition:
+            self.__idle_slots.append(slot)
+            self.__condition.notify()
+
+    def scan(self, path, filter_rules, **kwargs):
+        """Run a scan on the pool. This is a shortcut for the recurse() of an
+        Orchestrator that's been given the pool (and the same arguments).
+        """
+
+        o = fss.orchestrator.Orchestrator(
+                path,
+                filter_rules,
+                pool=self,
+                **kwargs)
+
+        return o.recurse()
+
+    def close(self):
+        """Stop the workers. Any jobs that are still running are cancelled."""
+
+        with self.__condition:
+            if self.__is_closed is True:
+                return
+
+            self.__is_closed = True
+            self.__condition.notify_all()
+
+        _LOGGER.info("Stopping pool.")
+
+        for slot in self.__slots:
+            self.__stop_slot(slot)
+
+    @property
+    def size(self):
+        return self.__size
+
+def _boot(worker_index, pipeline_state, result_blocks, job_q, output_q,
+          log_q, cancel_ev):
+    _LOGGER.info("Booting pool worker (%d).", worker_index)
+
+    while True:
+        job = job_q.get()
+        if job is None:
+            break
+
+        (roots, filter_rules_raw, scan_options, is_packed) = job
+
+        # The worker has the whole traversal to itself.
+
+        frontier = fss.workers.frontier.SoloFrontier()
+        for (path, root_index) in roots:
+            frontier.add_root(path, root_index=root_index)
+
+        if scan_options.symlinks == fss.constants.SYMLINKS_UNIQUE:
+            visited = fss.subtrees.LocalVisitedSet()
+        else:
+            visited = None
+
+        g = fss.workers.generator.GeneratorWorker(
+                filter_rules_raw,
+                frontier,
+                visited,
+                result_blocks if is_packed is True else None,
+                scan_options,
+                pipeline_state,
+                None,
+                output_q,
+                log_q,
+                cancel_ev,
+                worker_index)
+
+        g.run()
@@ -0,0 +1,97 @@
+import collections
+
+import fss.filters
+
+# The totals of a directory, including everything below it.
+DirectoryTotals = collections.namedtuple(
+                    'DirectoryTotals', 
+                    ['directories', 'files', 'bytes'])
+
+
+class DirectoryRollups(object):
+    """The number of directories and files, and the total size of the files, 
+    below each directory, down to a given depth (like "du --max-depth"). Only 
+    the results that recurse() would yield are counted, and the sizes are the 
+    apparent sizes (st_size).
+
+    The workers only add each entry to the directory that it's in (or to its 
+    ancestor at the given depth, if it's deeper). These are sent once the 
+    worker has finished, so there's one record per directory rather than one 
+    per entry. The totals are only accumulated up the tree once they've all 
+    been merged (different workers may have read different parts of the same 
+    subtree).
+    """
+
+    def __init__(self, depth):
+        self.__depth = depth
+
+        # (root-index, relative path) -> [directories, files, bytes] of the 
+        # entries directly in it (or deeper than the depth, below it).
+        self.__totals = {}
+
+    def get_totals(self, root_index, rel_path):
+        """Return the list of [directories, files, bytes] that the entries 
+        of the given directory are to be added to. Every directory that's read 
+        down to the depth has one, even if it's empty.
+        """
+
+        if fss.filters.get_depth(rel_path) > self.__depth:
+            rel_path = fss.filters.truncate_path(rel_path, self.__depth)
+
+        key = (root_index, rel_path)
+
+        totals = self.__totals.get(key)
+        if totals is None:
+            totals = [0, 0, 0]
+            self.__totals[key] = totals
+
+        return totals
+
+    def merge(self, other):
+        """Add the rollups of another worker to these."""
+
+        for (key, (directories, files, bytes_)) in other.items():
+            totals = self.get_totals(*key)
+
+            totals[0] += directories
+            totals[1] += files
+            totals[2] += bytes_
+
+    def items(self):
+        """Return a list of ((root-index, relative path), [directories, 
+        files, bytes]) for the entries directly in each directory.
+        """
+
+        return list(self.__totals.items())
+
+    def get_cumulative(self):
+        """Return a dictionary of (root-index, relative path) to the 
+        DirectoryTotals of everything below that directory.
+        """
+
+        cumulative = {}
+        for ((root_index, rel_path), totals) in self.__totals.items():
+            while True:
+                key = (root_index, rel_path)
+
+                current = cumulative.get(key)
+                if current is None:
+                    cumulative[key] = list(totals)
+                else:
+                    current[0] += totals[0]
+                    current[1] += totals[1]
+                    current[2] += totals[2]
+
+                if rel_path == '':
+                    break
+
+                (rel_path, name) = fss.filters.split_path(rel_path)
+
+        return dict(
+                (key, DirectoryTotals._make(totals))
+                for (key, totals)
+                in cumulative.items())
+
+    @property
+    def depth(self):
+        return self.__depth
@@ -0,0 +1,162 @@
+import bisect
+import heapq
+import time
+
+import fss.constants
+import fss.config.stats
+
+# The phases, in the order that they happen to a directory.
+PHASES = [
+    fss.constants.PHASE_WAIT,
+    fss.constants.PHASE_GUARD,
+    fss.constants.PHASE_READ,
+    fss.constants.PHASE_STAT,
+    fss.constants.PHASE_FILTER,
+    fss.constants.PHASE_OUTPUT,
+]
+
+
+class ScanStats(object):
+    """Where the time of a traversal went. Only collected when requested
+    (see ScanOptions.collect_stats); otherwise the workers don't have one of
+    these, and the only cost is a few checks per directory.
+
+    Each worker (or thread) has its own, and they're merged once the scan has
+    finished. The phases are:
+
+        wait:   waiting for a directory to read (another worker to share one,
+                or the traversal to finish)
+        guard:  the stat() that decides whether a directory is read (symlinks
+                and filesystems)
+        read:   reading a directory-listing, and everything per-entry that
+                isn't one of the other phases
+        stat:   the stat() calls made while listing (the type of each entry
+                with os.listdir(), or the metadata)
+        filter: checking the filter-rules
+        output: sending the results downstream (blocking when the consumer is
+                slow)
+
+    A directory's read-latency is its read and stat time. These go into a
+    histogram, and the slowest directories are kept.
+    """
+
+    def __init__(self):
+        self.__seconds = dict((phase, 0.0) for phase in PHASES)
+        self.__calls = dict((phase, 0) for phase in PHASES)
+
+        self.__latency_counts = \
+            [0] * (len(fss.config.stats.DIRECTORY_LATENCY_BUCKETS_S) + 1)
+
+        # A min-heap of (seconds, path).
+        self.__slowest = []
+
+        self.__directory_epoch = None
+        self.__directory_seconds = None
+
+    def add(self, phase, seconds, calls=1):
+        self.__seconds[phase] += seconds
+        self.__calls[phase] += calls
+
+    def wrap(self, phase, f):
+        """Return a version of the given function that adds the time it takes
+        to the given phase.
+        """
+
+        perf_counter = time.perf_counter
+        seconds = self.__seconds
+        calls = self.__calls
+
+        def timed(*args, **kwargs):
+            epoch = perf_counter()
+
+            try:
+                return f(*args, **kwargs)
+            finally:
+                seconds[phase] += perf_counter() - epoch
+                calls[phase] += 1
+
+        return timed
+
+    def start_directory(self):
+        self.__directory_epoch = time.perf_counter()
+        self.__directory_seconds = dict(self.__seconds)
+
+    def finish_directory(self, path):
+        """Account for the time since start_directory() that wasn't spent in
+        another phase as read time, and record the read-latency of the
+        directory.
+        """
+
+        elapsed = time.perf_counter() - self.__directory_epoch
+
+        def get_delta(phase):
+            return self.__seconds[phase] - self.__directory_seconds[phase]
+
+        latency = elapsed - \
+                  get_delta(fss.constants.PHASE_FILTER) - \
+                  get_delta(fss.constants.PHASE_OUTPUT)
+
+        self.add(
+            fss.constants.PHASE_READ,
+            max(0.0, latency - get_delta(fss.constants.PHASE_STAT)))
+
+        self.__add_latency(latency, path)
+
+    def __add_latency(self, latency, path):
+        i = bisect.bisect_left(
+                fss.config.stats.DIRECTORY_LATENCY_BUCKETS_S,
+                latency)
+
+        self.__latency_counts[i] += 1
+
+        item = (latency, path)
+        if len(self.__slowest) < \
+                fss.config.stats.SLOWEST_DIRECTORY_COUNT:
+            heapq.heappush(self.__slowest, item)
+        elif item > self.__slowest[0]:
+            heapq.heapreplace(self.__slowest, item)
+
+    def merge(self, other):
+        """Add the stats of another worker to these."""
+
+        for (phase, (seconds, calls)) in other.phases.items():
+            self.add(phase, seconds, calls)
+
+        for (i, (upper_bound, count)) in \
+                enumerate(other.directory_latencies):
+            self.__latency_counts[i] += count
+
+        for (latency, path) in other.slowest_directories:
+            if len(self.__slowest) < \
+                    fss.config.stats.SLOWEST_DIRECTORY_COUNT:
+                heapq.heappush(self.__slowest, (latency, path))
+            elif (latency, path) > self.__slowest[0]:
+                heapq.heapreplace(self.__slowest, (latency, path))
+
+    @property
+    def phases(self):
+        """A dictionary of phase to (seconds, calls)."""
+
+        return dict(
+                (phase, (self.__seconds[phase], self.__calls[phase]))
+                for phase
+                in PHASES)
+
+    @property
+    def directory_count(self):
+        return sum(self.__latency_counts)
+
+    @property
+    def directory_latencies(self):
+        """A list of (upper-bound in seconds, directory count), ending with
+        (None, count) for the directories slower than every bound.
+        """
+
+        upper_bounds = fss.config.stats.DIRECTORY_LATENCY_BUCKETS_S + [None]
+        return list(zip(upper_bounds, self.__latency_counts))
+
+    @property
+    def slowest_directories(self):
+        """A list of (seconds, path), slowest first."""
+
+        return sorted(self.__slowest, reverse=True)
@@ -0,0 +1,206 @@
+import logging
+import os
+import ctypes
+import threading
+import multiprocessing
+
+import fss.constants
+import fss.config.workers
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class LocalVisitedSet(object):
+    """The (device, inode) of every directory that has been read, for the
+    threads of one process.
+    """
+
+    def __init__(self):
+        self.__visited = set()
+        self.__lock = threading.Lock()
+
+    def add(self, dev, ino):
+        """Return True if the directory hadn't been seen before."""
+
+        key = (dev, ino)
+
+        with self.__lock:
+            if key in self.__visited:
+                return False
+
+            self.__visited.add(key)
+            return True
+
+
+class SharedVisitedSet(object):
+    """The (device, inode) of every directory that has been read, shared by
+    all of the generator processes. This is a fixed-size, open-addressed
+    hash-table in shared memory (two 64-bit words per slot). The device is
+    stored plus one, so that an empty slot is all zeros.
+    """
+
+    def __init__(self, capacity):
+        self.__capacity = capacity
+        self.__max_count = int(
+                            capacity *
+                            fss.config.workers.GENERATOR_VISITED_MAX_LOAD)
+
+        self.__slots = multiprocessing.Array(ctypes.c_uint64, capacity * 2)
+        self.__count = multiprocessing.Value('q', 0, lock=False)
+
+    def add(self, dev, ino):
+        """Return True if the directory hadn't been seen before, False if it
+        had, and None if the table is full.
+        """
+
+        stored_dev = dev + 1
+        i = hash((dev, ino)) % self.__capacity
+
+        with self.__slots.get_lock():
+            slots = self.__slots.get_obj()
+
+            while True:
+                current_dev = slots[i * 2]
+
+                if current_dev == 0:
+                    if self.__count.value >= self.__max_count:
+                        return None
+
+                    slots[i * 2] = stored_dev
+                    slots[i * 2 + 1] = ino
+                    self.__count.value += 1
+
+                    return True
+
+                if current_dev == stored_dev and slots[i * 2 + 1] == ino:
+                    return False
+
+                i = (i + 1) % self.__capacity
+
+
+class SubtreeGuard(object):
+    """Decides whether a directory should be read, according to how symlinks
+    are to be treated and whether the scan has to stay on the filesystem of
+    the root. Directories that are skipped are still reported; only what's
+    below them isn't.
+
+    The device of the root is passed down along with every directory that's
+    queued, so that each can be compared with it. Symlinks are skipped before
+    they're queued (see check_to_queue()), using what the listing already
+    knows, so that doesn't cost anything. So are the roots that are below 
+    the one being traversed (they're read as themselves).
+    """
+
+    def __init__(self, scan_options, visited=None):
+        self.__symlinks = scan_options.symlinks
+        self.__one_filesystem = scan_options.one_filesystem
+        self.__visited = visited
+
+        # If the shared table fills up, each worker falls back to its own.
+        # Cycles are still broken, though a subtree might be read once by
+        # each worker.
+        self.__local_visited = None
+
+        self.__is_stat_required = \
+            self.__one_filesystem is True or \
+            self.__symlinks == fss.constants.SYMLINKS_UNIQUE
+
+        self.__is_skipping_symlinks = \
+            self.__symlinks == fss.constants.SYMLINKS_SKIP
+
+        self.__nested_roots = scan_options.nested_roots
+
+        self.__skipped_symlink_count = 0
+        self.__skipped_mount_count = 0
+        self.__skipped_revisit_count = 0
+        self.__skipped_nested_root_count = 0
+
+    def check_to_queue(self, entry_path, is_symlink):
+        """Return whether a directory that was found in a listing should be 
+        queued. The listing says whether it's a symlink, or None if it 
+        doesn't know (e.g. the listing came from the index), in which case we 
+        have to look. The roots are never checked, so they're always 
+        followed.
+        """
+
+        if entry_path in self.__nested_roots:
+            self.__skipped_nested_root_count += 1
+            return False
+
+        if self.__is_skipping_symlinks is False:
+            return True
+
+        if is_symlink is None:
+            is_symlink = os.path.islink(entry_path)
+
+        if is_symlink is True:
+            self.__skipped_symlink_count += 1
+            return False
+
+        return True
+
+    def check_to_read(self, entry_path, rel_path, dev):
+        """Return a 2-tuple of whether the directory should be read and the
+        device of the root (which is only known once the root is read).
+        """
+
+        if self.__is_stat_required is False:
+            return (True, dev)
+
+        is_root = not rel_path
+
+        try:
+            st = os.stat(entry_path)
+        except OSError:
+            # Reading it will fail too, and that's reported there.
+            return (True, dev)
+
+        if self.__one_filesystem is True:
+            if is_root is True:
+                dev = st.st_dev
+            elif st.st_dev != dev:
+                _LOGGER.debug("Not crossing into another filesystem: [%s]",
+                              entry_path)
+
+                self.__skipped_mount_count += 1
+                return (False, dev)
+
+        if self.__symlinks == fss.constants.SYMLINKS_UNIQUE and \
+           self.__add_visited(st.st_dev, st.st_ino) is False:
+            _LOGGER.debug("Not reading directory again: [%s]", entry_path)
+
+            self.__skipped_revisit_count += 1
+            return (False, dev)
+
+        return (True, dev)
+
+    def __add_visited(self, dev, ino):
+        if self.__local_visited is None:
+            is_new = self.__visited.add(dev, ino)
+            if is_new is not None:
+                return is_new
+
+            _LOGGER.warning("The visited-directory table is full. Falling "
+                            "back to a table local to this worker.")
+
+            self.__local_visited = LocalVisitedSet()
+
+        return self.__local_visited.add(dev, ino)
+
+    def get_counters(self):
+        counters = {}
+
+        if self.__symlinks == fss.constants.SYMLINKS_SKIP:
+            counters['skipped_symlinks'] = self.__skipped_symlink_count
+
+        if self.__symlinks == fss.constants.SYMLINKS_UNIQUE:
+            counters['skipped_revisits'] = self.__skipped_revisit_count
+
+        if self.__one_filesystem is True:
+            counters['skipped_mounts'] = self.__skipped_mount_count
+
+        if self.__nested_roots:
+            counters['skipped_nested_roots'] = \
+                self.__skipped_nested_root_count
+
+        return counters
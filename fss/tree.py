@@ -0,0 +1,257 @@
+import logging
+import os
+import array
+import collections
+
+import fss.constants
+import fss.filters
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class PathTree(object):
+    """Every entry below a set of roots, held compactly in memory so that it
+    can be queried with filter-rules (the same way that the workers apply
+    them) without touching the filesystem.
+
+    Each distinct name is stored once. An entry is just its parent, the index
+    of its name and its type, in arrays, and once the tree is finished, the
+    children of every directory are a contiguous range of one array. Paths
+    are only put together as the results of a query are produced.
+
+    Entries are added as a scan yields them, in any order (a directory is
+    created as soon as anything below it is added). Nothing can be added once
+    the tree is finished, and only a finished tree can be queried (from any
+    number of threads).
+    """
+
+    def __init__(self):
+        self.__names = []
+        self.__name_indices = {}
+
+        self.__parents = array.array('q')
+        self.__name_ids = array.array('L')
+        self.__is_dirs = bytearray()
+
+        # The node of every directory, by path (only while building).
+        self.__directories = {}
+
+        # (absolute path, node)
+        self.__roots = []
+
+        # The roots that aren't below another root.
+        self.__top_root_count = 0
+
+        # The children of node (n) are children[offsets[n]:offsets[n + 1]].
+        self.__child_offsets = None
+        self.__children = None
+
+    def __get_name_id(self, name):
+        try:
+            return self.__name_indices[name]
+        except KeyError:
+            name_id = len(self.__names)
+
+            self.__names.append(name)
+            self.__name_indices[name] = name_id
+
+            return name_id
+
+    def __add_node(self, parent, name, is_dir):
+        node = len(self.__parents)
+
+        self.__parents.append(parent)
+        self.__name_ids.append(self.__get_name_id(name))
+        self.__is_dirs.append(1 if is_dir is True else 0)
+
+        return node
+
+    def __get_directory(self, path):
+        try:
+            return self.__directories[path]
+        except KeyError:
+            pass
+
+        (parent_path, name) = os.path.split(path)
+        if parent_path == path:
+            raise ValueError("Entry is not below a root: [%s]" % (path,))
+
+        node = self.__add_node(self.__get_directory(parent_path), name, True)
+        self.__directories[path] = node
+
+        return node
+
+    def add_root(self, path):
+        assert self.__children is None, \
+               "The tree is finished."
+
+        # Keyed the way that os.path.dirname() gives it for its entries.
+        key = os.path.dirname(os.path.join(path, ''))
+
+        node = self.__add_node(-1, path, True)
+        self.__directories[key] = node
+        self.__roots.append((os.path.abspath(path), node))
+        self.__top_root_count += 1
+
+    def __attach_root(self, node, path):
+        """A root turned out to be below another one (the other one's scan 
+        reported it). Make it an entry of its parent, so that it's found from 
+        either.
+        """
+
+        (parent_path, name) = os.path.split(path)
+
+        self.__parents[node] = self.__get_directory(parent_path)
+        self.__name_ids[node] = self.__get_name_id(name)
+        self.__top_root_count -= 1
+
+    def add(self, entry_type, path):
+        assert self.__children is None, \
+               "The tree is finished."
+
+        is_dir = entry_type == fss.constants.FT_DIR
+
+        # The directory might already have been created for something below
+        # it, or be a root.
+        if is_dir is True:
+            node = self.__directories.get(path)
+            if node is not None:
+                if self.__parents[node] == -1:
+                    self.__attach_root(node, path)
+
+                return
+
+        (parent_path, name) = os.path.split(path)
+        node = self.__add_node(self.__get_directory(parent_path), name, is_dir)
+
+        if is_dir is True:
+            self.__directories[path] = node
+
+    def finish(self):
+        """Lay the children of every directory out contiguously."""
+
+        node_count = len(self.__parents)
+
+        offsets = array.array('L', [0]) * (node_count + 1)
+        for parent in self.__parents:
+            if parent >= 0:
+                offsets[parent + 1] += 1
+
+        for i in range(node_count):
+            offsets[i + 1] += offsets[i]
+
+        children = array.array('L', [0]) * offsets[node_count]
+        positions = array.array('L', offsets)
+
+        for (node, parent) in enumerate(self.__parents):
+            if parent >= 0:
+                children[positions[parent]] = node
+                positions[parent] += 1
+
+        self.__child_offsets = offsets
+        self.__children = children
+
+        self.__directories = None
+        self.__name_indices = None
+
+        _LOGGER.debug("Tree finished with (%d) entries and (%d) names.",
+                      node_count - self.__top_root_count, len(self.__names))
+
+    def find(self, path):
+        """Return the node of the given directory (an absolute path), or None
+        if it isn't a directory in the tree.
+        """
+
+        path = os.path.normpath(path)
+
+        for (root_path, node) in self.__roots:
+            if path == root_path:
+                return node
+
+            prefix = os.path.join(root_path, '')
+            if path.startswith(prefix) is False:
+                continue
+
+            for name in path[len(prefix):].split(os.sep):
+                node = self.__find_child(node, name)
+                if node is None or self.__is_dirs[node] == 0:
+                    break
+            else:
+                return node
+
+        return None
+
+    def __find_child(self, node, name):
+        children = self.__children
+        for i in range(self.__child_offsets[node],
+                       self.__child_offsets[node + 1]):
+            child = children[i]
+            if self.__names[self.__name_ids[child]] == name:
+                return child
+
+        return None
+
+    def query(self, node, path, filter_rules, max_depth=None):
+        """Yield (entry-type, path) for every entry below the given node (see
+        find()) that passes the filter-rules (a FilterRules), breadth-first,
+        as the generator would. The paths are joined to the given one.
+        """
+
+        is_path_aware = filter_rules.is_path_aware
+        check_to_permit = filter_rules.check_to_permit
+        check_to_descend = filter_rules.check_to_descend
+
+        names = self.__names
+        name_ids = self.__name_ids
+        is_dirs = self.__is_dirs
+        offsets = self.__child_offsets
+        children = self.__children
+
+        pending = collections.deque([(node, path, '')])
+
+        while pending:
+            (node, dir_path, rel_path) = pending.popleft()
+
+            depth = fss.filters.get_depth(rel_path) + 1
+            if max_depth is not None and depth > max_depth:
+                continue
+
+            can_descend = max_depth is None or depth < max_depth
+
+            for i in range(offsets[node], offsets[node + 1]):
+                child = children[i]
+                filename = names[name_ids[child]]
+                is_dir = is_dirs[child] == 1
+
+                file_type = fss.constants.FT_DIR \
+                                if is_dir is True \
+                                else fss.constants.FT_FILE
+
+                if is_dir is True or is_path_aware is True:
+                    entry_rel_path = fss.filters.join_path(rel_path, filename)
+                else:
+                    entry_rel_path = None
+
+                is_permitted = check_to_permit(
+                                file_type,
+                                filename,
+                                entry_rel_path)
+
+                filepath = os.path.join(dir_path, filename)
+
+                if is_dir is True and \
+                   can_descend is True and \
+                   (is_permitted is True or \
+                    check_to_descend(entry_rel_path) is True):
+                    pending.append((child, filepath, entry_rel_path))
+
+                if is_permitted is True:
+                    yield (file_type, filepath)
+
+    @property
+    def entry_count(self):
+        return len(self.__parents) - self.__top_root_count
+
+    @property
+    def name_count(self):
+        return len(self.__names)
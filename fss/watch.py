@@ -0,0 +1,549 @@
+import logging
+import os
+import time
+import struct
+import select
+import fcntl
+import termios
+import ctypes
+import ctypes.util
+
+import fss.constants
+import fss.config.watch
+import fss.filters
+import fss.listing
+
+_LOGGER = logging.getLogger(__name__)
+
+# From <sys/inotify.h>.
+
+_IN_MOVED_FROM = 0x00000040
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_DELETE = 0x00000200
+_IN_DELETE_SELF = 0x00000400
+_IN_MOVE_SELF = 0x00000800
+_IN_Q_OVERFLOW = 0x00004000
+_IN_IGNORED = 0x00008000
+_IN_ONLYDIR = 0x01000000
+_IN_ISDIR = 0x40000000
+
+_IN_CLOEXEC = 0o2000000
+_IN_NONBLOCK = 0o0004000
+
+_WATCH_MASK = _IN_CREATE | _IN_DELETE | _IN_MOVED_FROM | _IN_MOVED_TO | \
+              _IN_DELETE_SELF | _IN_MOVE_SELF | _IN_ONLYDIR
+
+_EVENT_HEADER = struct.Struct('iIII')
+
+_EVENT_TYPES = [
+    (_IN_CREATE, fss.constants.EVENT_CREATE),
+    (_IN_DELETE, fss.constants.EVENT_DELETE),
+    (_IN_MOVED_FROM, fss.constants.EVENT_MOVED_FROM),
+    (_IN_MOVED_TO, fss.constants.EVENT_MOVED_TO),
+]
+
+_LIBC = None
+
+
+def _get_libc():
+    global _LIBC
+
+    if _LIBC is None:
+        filename = ctypes.util.find_library('c') or 'libc.so.6'
+        libc = ctypes.CDLL(filename, use_errno=True)
+
+        if hasattr(libc, 'inotify_init1') is False:
+            raise NotImplementedError("inotify is not available on this "
+                                      "system.")
+
+        libc.inotify_init1.argtypes = [ctypes.c_int]
+        libc.inotify_add_watch.argtypes = \
+            [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+
+        _LIBC = libc
+
+    return _LIBC
+
+def _raise_errno(message):
+    errno = ctypes.get_errno()
+    raise OSError(errno, message + ': ' + os.strerror(errno))
+
+
+class Watcher(object):
+    """Watches a set of directories using inotify (Linux only) and produces
+    (event-type, entry-type, path) for everything that is created, deleted or
+    moved within them, subject to the same filter-rules as the scan. New
+    directories are watched as they appear, as far as the symlinks and 
+    one-filesystem settings allow the scan to read them. 
+
+    A directory can only be watched once, so if it can be reached by more 
+    than one path (through symlinks), its events are reported under the 
+    path that it was first watched as.
+
+    The permitted entries of every watched directory are remembered (the scan
+    reports them with add_entry(), and the events keep them up to date), so
+    that, if the kernel drops events, every directory can be listed again and
+    compared with what we knew, and whatever was created or deleted in the
+    meantime (files, too) is reported.
+    """
+
+    def __init__(self, filter_rules_raw, max_depth=None, 
+                 symlinks=fss.constants.SYMLINKS_FOLLOW, one_filesystem=False):
+        self.__libc = _get_libc()
+        self.__filter_rules = fss.filters.FilterRules(filter_rules_raw)
+        self.__max_depth = max_depth
+        self.__symlinks = symlinks
+        self.__one_filesystem = one_filesystem
+        self.__lister = fss.listing.DirectoryLister()
+
+        self.__fd = self.__libc.inotify_init1(_IN_NONBLOCK | _IN_CLOEXEC)
+        if self.__fd == -1:
+            _raise_errno("inotify_init1() failed")
+
+        self.__roots = []
+        self.__paths = {}
+        self.__wds = {}
+
+        # The device of each root (only if we have to stay on it).
+        self.__root_devs = {}
+
+        # The (normalized) path of a watched directory -> {name: entry-type} 
+        # of its permitted entries, as far as we know.
+        self.__listings = {}
+
+        self.__event_count = 0
+        self.__overflow_count = 0
+        self.__last_consume_delay_s = 0.0
+        self.__max_consume_delay_s = 0.0
+
+    def add_root(self, path):
+        self.__roots.append(path)
+
+        if self.__one_filesystem is True:
+            try:
+                self.__root_devs[path] = os.stat(path).st_dev
+            except OSError:
+                pass
+
+        self.add_directory(path)
+
+    def __get_root(self, path):
+        """Return the root that the path is below, or None. If a root is 
+        below another, what's below it belongs to it (see Orchestrator).
+        """
+
+        found_root = None
+
+        for root in self.__roots:
+            if path.startswith(os.path.join(root, '')) and \
+               (found_root is None or len(root) > len(found_root)):
+                found_root = root
+
+        return found_root
+
+    def __get_rel_path(self, path):
+        """Return the path relative to the root that it's in (separated by 
+        "/"), as the filter-rules expect.
+        """
+
+        root = self.__get_root(path)
+        if root is None:
+            return os.path.basename(path)
+
+        return path[len(os.path.join(root, '')):].replace(os.sep, '/')
+
+    def __check_to_watch(self, path, is_symlink):
+        """Return whether a directory that has appeared (below a watched one) 
+        would be read by the scan, according to the symlinks and 
+        one-filesystem settings. is_symlink is None if it isn't known yet. 
+        Directories that have already been read are caught by 
+        add_directory().
+        """
+
+        if self.__symlinks == fss.constants.SYMLINKS_SKIP:
+            if is_symlink is None:
+                is_symlink = os.path.islink(path)
+
+            if is_symlink is True:
+                return False
+
+        if self.__one_filesystem is True:
+            try:
+                dev = os.stat(path).st_dev
+            except OSError:
+                return False
+
+            root_dev = self.__root_devs.get(self.__get_root(path))
+            if root_dev is not None and dev != root_dev:
+                _LOGGER.debug("Not watching directory on another "
+                              "filesystem: [%s]", path)
+
+                return False
+
+        return True
+
+    def __get_listing(self, path):
+        return self.__listings.setdefault(os.path.normpath(path), {})
+
+    def add_entry(self, entry_type, path):
+        """Record an entry that the scan reported (in a watched directory), 
+        so that a rescan knows that it already existed.
+        """
+
+        (parent_path, name) = os.path.split(path)
+        self.__get_listing(parent_path)[name] = entry_type
+
+    def __is_too_deep(self, rel_path):
+        return self.__max_depth is not None and \
+               fss.filters.get_depth(rel_path) > self.__max_depth
+
+    def __check_to_descend(self, rel_path, is_permitted):
+        if self.__max_depth is not None and \
+           fss.filters.get_depth(rel_path) >= self.__max_depth:
+            return False
+
+        return is_permitted is True or \
+               self.__filter_rules.check_to_descend(rel_path) is True
+
+    def add_directory(self, path):
+        """Start watching a directory (not recursively). Returns False if the
+        directory couldn't be watched (e.g. it's already gone), or if it's 
+        already being watched under another path.
+        """
+
+        wd = self.__libc.inotify_add_watch(
+                self.__fd,
+                os.fsencode(path),
+                _WATCH_MASK)
+
+        if wd == -1:
+            errno = ctypes.get_errno()
+
+            _LOGGER.warning("Could not watch directory: [%s] (%s)",
+                            path, os.strerror(errno))
+
+            return False
+
+        # The kernel returns the same descriptor for a directory that's 
+        # already watched (e.g. when it's reached again through a symlink). 
+        # Keep the path that we had.
+
+        known_path = self.__paths.get(wd)
+        if known_path is not None and known_path != path:
+            _LOGGER.debug("Directory is already watched as [%s]: [%s]",
+                          known_path, path)
+
+            return False
+
+        self.__paths[wd] = path
+        self.__wds[path] = wd
+
+        return True
+
+    def __remove_subtree(self, path):
+        """Stop watching a directory and everything below it (it's been moved
+        away).
+        """
+
+        prefix = os.path.join(path, '')
+
+        for (watched_path, wd) in list(self.__wds.items()):
+            if watched_path == path or watched_path.startswith(prefix):
+                self.__libc.inotify_rm_watch(self.__fd, wd)
+                self.__forget(wd)
+
+        path = os.path.normpath(path)
+        prefix = os.path.join(path, '')
+
+        for listed_path in list(self.__listings.keys()):
+            if listed_path == path or listed_path.startswith(prefix):
+                del self.__listings[listed_path]
+
+    def __forget(self, wd):
+        try:
+            path = self.__paths.pop(wd)
+        except KeyError:
+            return
+
+        if self.__wds.get(path) == wd:
+            del self.__wds[path]
+            self.__listings.pop(os.path.normpath(path), None)
+
+    def __walk_new_directory(self, path, is_symlink=False):
+        """Watch a directory that has just appeared, as well as anything below
+        it. Whatever was created in it before the watch was in place is
+        reported as having been created. is_symlink is None if it isn't 
+        known (an event only ever announces a real directory).
+        """
+
+        pending = [(path, is_symlink)]
+        while pending:
+            (entry_path, is_symlink) = pending.pop()
+
+            if entry_path not in self.__wds and \
+               (self.__check_to_watch(entry_path, is_symlink) is False or \
+                self.add_directory(entry_path) is False):
+                continue
+
+            listing = self.__get_listing(entry_path)
+
+            try:
+                entries = self.__lister.list(entry_path)
+                for (filename, filepath, is_dir, is_symlink, stat_source) \
+                        in entries:
+                    entry_type = fss.constants.FT_DIR \
+                                    if is_dir is True \
+                                    else fss.constants.FT_FILE
+
+                    rel_path = self.__get_rel_path(filepath)
+                    if self.__is_too_deep(rel_path) is True:
+                        continue
+
+                    is_permitted = self.__filter_rules.check_to_permit(
+                                    entry_type,
+                                    filename,
+                                    rel_path)
+
+                    if is_dir is True and \
+                       self.__check_to_descend(rel_path, is_permitted) is True:
+                        pending.append((filepath, is_symlink))
+
+                    if is_permitted is False:
+                        continue
+
+                    listing[filename] = entry_type
+                    yield (fss.constants.EVENT_CREATE, entry_type, filepath)
+            except OSError:
+                _LOGGER.exception("Skipping unreadable directory: [%s]",
+                                  entry_path)
+
+    def __rescan(self):
+        """The kernel dropped events. List every directory again (from the
+        roots down), and report whatever was created or deleted since we last 
+        knew its entries. Watch any new directories, and forget any that have 
+        gone away.
+        """
+
+        _LOGGER.warning("inotify queue overflowed. Rescanning.")
+
+        # The events for these come from the listing of their parents.
+        for (path, wd) in list(self.__wds.items()):
+            if os.path.isdir(path) is False:
+                self.__libc.inotify_rm_watch(self.__fd, wd)
+                self.__forget(wd)
+
+        pending = list(self.__roots)
+        while pending:
+            entry_path = pending.pop()
+
+            try:
+                entries = list(self.__lister.list(entry_path))
+            except OSError:
+                _LOGGER.exception("Skipping unreadable directory: [%s]",
+                                  entry_path)
+
+                continue
+
+            # The permitted entries, and the directories to read after this 
+            # one that aren't watched yet.
+            current = {}
+            new_directories = []
+
+            for (filename, filepath, is_dir, is_symlink, stat_source) \
+                    in entries:
+                entry_type = fss.constants.FT_DIR \
+                                if is_dir is True \
+                                else fss.constants.FT_FILE
+
+                rel_path = self.__get_rel_path(filepath)
+                if self.__is_too_deep(rel_path) is True:
+                    continue
+
+                is_permitted = self.__filter_rules.check_to_permit(
+                                entry_type,
+                                filename,
+                                rel_path)
+
+                if is_permitted is True:
+                    current[filename] = entry_type
+
+                if is_dir is True and \
+                   self.__check_to_descend(rel_path, is_permitted) is True:
+                    if filepath in self.__wds:
+                        pending.append(filepath)
+                    else:
+                        new_directories.append((filepath, is_symlink))
+
+            listing = self.__get_listing(entry_path)
+
+            for (filename, entry_type) in sorted(listing.items()):
+                if current.get(filename) == entry_type:
+                    continue
+
+                filepath = os.path.join(entry_path, filename)
+
+                if entry_type == fss.constants.FT_DIR:
+                    self.__remove_subtree(filepath)
+
+                yield (fss.constants.EVENT_DELETE, entry_type, filepath)
+
+            for (filename, entry_type) in sorted(current.items()):
+                if listing.get(filename) == entry_type:
+                    continue
+
+                yield (
+                    fss.constants.EVENT_CREATE, 
+                    entry_type, 
+                    os.path.join(entry_path, filename))
+
+            self.__listings[os.path.normpath(entry_path)] = current
+
+            for (filepath, is_symlink) in new_directories:
+                for event in self.__walk_new_directory(filepath, is_symlink):
+                    yield event
+
+    def __read_events(self, timeout_s):
+        """Return a list of raw (wd, mask, cookie, name) events, or an empty
+        list if nothing happened within the timeout.
+        """
+
+        (readable, writable, exceptional) = \
+            select.select([self.__fd], [], [], timeout_s)
+
+        if not readable:
+            return []
+
+        try:
+            data = os.read(
+                    self.__fd,
+                    fss.config.watch.WATCH_READ_BUFFER_SIZE)
+        except BlockingIOError:
+            return []
+
+        events = []
+        i = 0
+        while i < len(data):
+            (wd, mask, cookie, length) = _EVENT_HEADER.unpack_from(data, i)
+            i += _EVENT_HEADER.size
+
+            name = data[i:i + length].rstrip(b'\0')
+            i += length
+
+            events.append((wd, mask, cookie, os.fsdecode(name)))
+
+        return events
+
+    def __translate(self, wd, mask, name):
+        """Yield the (event-type, entry-type, path) for a raw event."""
+
+        if mask & _IN_Q_OVERFLOW:
+            self.__overflow_count += 1
+
+            for root in self.__roots:
+                yield (fss.constants.EVENT_OVERFLOW, fss.constants.FT_DIR, root)
+
+            for event in self.__rescan():
+                yield event
+
+            return
+
+        if mask & (_IN_IGNORED | _IN_DELETE_SELF | _IN_MOVE_SELF):
+            if mask & _IN_IGNORED:
+                self.__forget(wd)
+
+            return
+
+        try:
+            parent_path = self.__paths[wd]
+        except KeyError:
+            # We've already stopped watching this directory.
+            return
+
+        entry_type = fss.constants.FT_DIR \
+                        if mask & _IN_ISDIR \
+                        else fss.constants.FT_FILE
+
+        filepath = os.path.join(parent_path, name)
+
+        rel_path = self.__get_rel_path(filepath)
+        if self.__is_too_deep(rel_path) is True:
+            return
+
+        is_permitted = self.__filter_rules.check_to_permit(
+                        entry_type, 
+                        name, 
+                        rel_path)
+
+        if is_permitted is True:
+            listing = self.__get_listing(parent_path)
+
+            if mask & (_IN_CREATE | _IN_MOVED_TO):
+                listing[name] = entry_type
+            else:
+                listing.pop(name, None)
+
+            for (flag, event_type) in _EVENT_TYPES:
+                if mask & flag:
+                    yield (event_type, entry_type, filepath)
+                    break
+
+        if entry_type == fss.constants.FT_DIR:
+            if mask & _IN_MOVED_FROM:
+                self.__remove_subtree(filepath)
+            elif mask & (_IN_CREATE | _IN_MOVED_TO) and \
+                 self.__check_to_descend(rel_path, is_permitted) is True:
+                for event in self.__walk_new_directory(filepath):
+                    yield event
+
+    def events(self):
+        """Yield events until closed."""
+
+        while True:
+            raw_events = self.__read_events(
+                            fss.config.watch.WATCH_POLL_INTERVAL_S)
+
+            read_time = time.time()
+
+            for (wd, mask, cookie, name) in raw_events:
+                for event in self.__translate(wd, mask, name):
+                    self.__event_count += 1
+
+                    delay_s = time.time() - read_time
+                    self.__last_consume_delay_s = delay_s
+                    self.__max_consume_delay_s = \
+                        max(self.__max_consume_delay_s, delay_s)
+
+                    yield event
+
+    def __get_pending_bytes(self):
+        """The size of the events waiting to be read from the kernel."""
+
+        buf = ctypes.c_int(0)
+        fcntl.ioctl(self.__fd, termios.FIONREAD, buf)
+
+        return buf.value
+
+    def get_metrics(self):
+        """The number of watches, events and overflows so far, how long 
+        events waited between being read from the kernel and being consumed 
+        (this isn't the time since they happened, which inotify doesn't 
+        record), and how much is waiting in the kernel queue.
+        """
+
+        return {
+            'watch_count': len(self.__paths),
+            'event_count': self.__event_count,
+            'overflow_count': self.__overflow_count,
+            'last_consume_delay_s': self.__last_consume_delay_s,
+            'max_consume_delay_s': self.__max_consume_delay_s,
+            'pending_bytes': self.__get_pending_bytes() \
+                                if self.__fd is not None \
+                                else 0,
+        }
+
+    def close(self):
+        if self.__fd is not None:
+            os.close(self.__fd)
+            self.__fd = None
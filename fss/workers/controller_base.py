@@ -1,4 +1,8 @@
+import logging
 import multiprocessing
+import queue
+
+_LOGGER = logging.getLogger(__name__)
 
 
 class ControllerBase(object):
@@ -29,12 +33,34 @@ class ControllerBase(object):
     def quit_ev(self):
         return self.__quit_ev
 
+    def drain(self):
+        """Discard whatever is waiting in the output-queue, and forward any 
+        waiting log messages. This is used while shutting down.
+        """
+
+        while True:
+            try:
+                self.__output_q.get(block=False)
+            except queue.Empty:
+                break
+
+        while True:
+            try:
+                (cls_name, level, message) = self.__log_q.get(block=False)
+            except queue.Empty:
+                break
+            else:
+                _LOGGER.log(level, cls_name + ": " + message)
+
     def start(self):
         raise NotImplementedError()
 
     def stop(self):
         raise NotImplementedError()
 
+    def is_alive(self):
+        raise NotImplementedError()
+
     @property
     def output_queue_size(self):
         raise NotImplementedError()
@@ -0,0 +1,376 @@
+import logging
+import multiprocessing
+import queue
+import os
+import struct
+import tempfile
+import collections
+
+import fss.constants
+import fss.config.workers
+
+_LOGGER = logging.getLogger(__name__)
+
+# A spilled directory: the lengths of its path and relative path, the device 
+# of its root plus one (zero if not known yet) and the index of its root (-1 
+# if not tagged), followed by the two paths.
+_RECORD_HEADER = struct.Struct('<IIQq')
+
+def _encode_item(item):
+    (path, rel_path, dev, root_index) = item
+
+    path_bytes = os.fsencode(path)
+    rel_path_bytes = os.fsencode(rel_path)
+
+    header = _RECORD_HEADER.pack(
+                len(path_bytes),
+                len(rel_path_bytes),
+                0 if dev is None else dev + 1,
+                -1 if root_index is None else root_index)
+
+    return header + path_bytes + rel_path_bytes
+
+def _read_items(f, count):
+    items = []
+    for i in range(count):
+        (path_length, rel_path_length, stored_dev, root_index) = \
+            _RECORD_HEADER.unpack(f.read(_RECORD_HEADER.size))
+
+        path = os.fsdecode(f.read(path_length))
+        rel_path = os.fsdecode(f.read(rel_path_length))
+
+        items.append((
+            path, 
+            rel_path, 
+            None if stored_dev == 0 else stored_dev - 1, 
+            None if root_index == -1 else root_index))
+
+    return items
+
+
+class SharedFrontier(object):
+    """The set of directories that still have to be read, shared between all
+    of the generator workers. Each worker keeps its own directories locally,
+    and only hands some of them over to the shared queue when another worker
+    is waiting for work.
+
+    We track the number of directories that have been discovered but not yet
+    finished (whether they're queued locally, queued in the shared queue, or
+    being read). When that drops to zero, the traversal is complete.
+    """
+
+    def __init__(self, q):
+        self.__q = q
+        self.__pending = multiprocessing.Value('q', 0)
+        self.__waiting = multiprocessing.Value('i', 0)
+        self.__finished_ev = multiprocessing.Event()
+
+    def add_root(self, path, root_index=None):
+        with self.__pending.get_lock():
+            self.__pending.value += 1
+
+        # Directories are queued along with their path relative to the root, 
+        # the device of the root (once it's known), and the index of the root 
+        # (if results are to be tagged with it).
+        self.__q.put((path, '', None, root_index))
+
+    def transition(self, added_count):
+        """A directory has been finished, and the given number of directories
+        were discovered (and queued) while reading it.
+        """
+
+        with self.__pending.get_lock():
+            self.__pending.value += added_count - 1
+            is_finished = self.__pending.value == 0
+
+        if is_finished is True:
+            _LOGGER.debug("Frontier is exhausted.")
+            self.__finished_ev.set()
+
+    def share(self, item):
+        self.__q.put(item)
+
+    def get(self, quit_ev):
+        """Block until there is a shared directory for us, or until the
+        traversal has finished (or we've been told to quit), in which case
+        queue.Empty is raised.
+        """
+
+        try:
+            return self.__q.get(block=False)
+        except queue.Empty:
+            if self.__finished_ev.is_set() is True:
+                raise
+
+        with self.__waiting.get_lock():
+            self.__waiting.value += 1
+
+        try:
+            while True:
+                try:
+                    return self.__q.get(
+                            timeout=fss.config.workers.\
+                                        GENERATOR_FRONTIER_POLL_INTERVAL_S)
+                except queue.Empty:
+                    if self.__finished_ev.is_set() is True or \
+                       quit_ev.is_set() is True:
+                        raise
+        finally:
+            with self.__waiting.get_lock():
+                self.__waiting.value -= 1
+
+    @property
+    def waiting_count(self):
+        """The number of workers that are currently starved for work."""
+
+        return self.__waiting.value
+
+
+class SoloFrontier(object):
+    """The counterpart of SharedFrontier for a traversal that's done by a
+    single worker (see fss.pool). The roots are the only directories that
+    come from outside the worker. waiting_count is always zero, since nobody 
+    else is waiting for work, so the worker never calls share(); if it did, 
+    the directory would just come back to it from get().
+    """
+
+    def __init__(self):
+        self.__roots = collections.deque()
+
+    def add_root(self, path, root_index=None):
+        self.__roots.append((path, '', None, root_index))
+
+    def transition(self, added_count):
+        pass
+
+    def share(self, item):
+        self.__roots.append(item)
+
+    def get(self, quit_ev):
+        """Return the next root (or shared directory). queue.Empty is raised 
+        once there are no more (the worker's own directories have run out 
+        too, by then).
+        """
+
+        try:
+            return self.__roots.popleft()
+        except IndexError:
+            raise queue.Empty()
+
+    @property
+    def waiting_count(self):
+        """Always zero (see above)."""
+
+        return 0
+
+
+class LocalFrontier(object):
+    """The directories that one worker has found but not yet read, in the 
+    order that they're to be read: breadth-first (oldest first) or 
+    depth-first (newest first). Depth-first keeps far fewer directories 
+    pending on wide trees.
+
+    At most memory-limit directories are kept in memory. Past that, they're 
+    written to a temporary file and read back when they're needed, in the 
+    same order. Breadth-first, every directory that's added while any are 
+    spilled goes to the end of the file, and the part that's been read back 
+    is dropped from the front once it's half of the file. Depth-first, the oldest half of the 
+    ones in memory is written as a segment on top of the others in the file, 
+    and the newest segment is read back once memory is empty.
+
+    This isn't thread-safe.
+    """
+
+    def __init__(self, order=fss.constants.ORDER_BFS, memory_limit=None):
+        self.__is_dfs = order == fss.constants.ORDER_DFS
+
+        if memory_limit is None:
+            memory_limit = fss.config.workers.GENERATOR_FRONTIER_MEMORY_LIMIT
+
+        # At least two, so that depth-first always has something to spill.
+        self.__memory_limit = max(2, memory_limit)
+
+        self.__memory = collections.deque()
+        self.__spill_f = None
+
+        # Breadth-first: the spilled directories that haven't been written 
+        # yet, and the offset and number of the ones in the file that 
+        # haven't been read back.
+        self.__spill_buffer = []
+        self.__read_offset = 0
+        self.__file_count = 0
+
+        # Depth-first: the offset and the number of directories of each 
+        # segment in the file, oldest first.
+        self.__segments = []
+
+        self.__spilled_count = 0
+        self.__spilled_total = 0
+        self.__compaction_count = 0
+
+    def put(self, item):
+        if self.__is_dfs is True:
+            self.__memory.append(item)
+
+            if len(self.__memory) > self.__memory_limit:
+                self.__spill_segment()
+        elif self.__spilled_count == 0 and \
+             len(self.__memory) < self.__memory_limit:
+            self.__memory.append(item)
+        else:
+            # Everything in memory is older than everything that's spilled.
+
+            self.__spill_buffer.append(item)
+            self.__spilled_count += 1
+            self.__spilled_total += 1
+
+            if len(self.__spill_buffer) >= \
+                    fss.config.workers.GENERATOR_FRONTIER_SPILL_BATCH_SIZE:
+                self.__flush_spill_buffer()
+
+    def get(self):
+        """Return the next directory to read, or raise queue.Empty."""
+
+        if not self.__memory and self.__spilled_count > 0:
+            self.__load()
+
+        if not self.__memory:
+            raise queue.Empty()
+
+        if self.__is_dfs is True:
+            return self.__memory.pop()
+
+        return self.__memory.popleft()
+
+    def steal(self):
+        """Return the oldest directory in memory (the one with the most below 
+        it, probably), to be handed to another worker, or raise queue.Empty.
+        """
+
+        if not self.__memory and self.__spilled_count > 0:
+            self.__load()
+
+        if not self.__memory:
+            raise queue.Empty()
+
+        return self.__memory.popleft()
+
+    def qsize(self):
+        return len(self.__memory) + self.__spilled_count
+
+    def __get_spill_file(self):
+        if self.__spill_f is None:
+            _LOGGER.debug("Spilling pending directories to disk.")
+
+            self.__spill_f = tempfile.TemporaryFile(
+                                prefix='fss-frontier-',
+                                dir=fss.config.workers.\
+                                        GENERATOR_FRONTIER_SPILL_PATH)
+
+        return self.__spill_f
+
+    def __spill_segment(self):
+        count = len(self.__memory) // 2
+        records = [
+            _encode_item(self.__memory.popleft()) 
+            for i 
+            in range(count)
+        ]
+
+        f = self.__get_spill_file()
+        f.seek(0, os.SEEK_END)
+
+        self.__segments.append((f.tell(), count))
+        f.write(b''.join(records))
+
+        self.__spilled_count += count
+        self.__spilled_total += count
+
+    def __flush_spill_buffer(self):
+        f = self.__get_spill_file()
+        f.seek(0, os.SEEK_END)
+        f.write(b''.join(
+            _encode_item(item) 
+            for item 
+            in self.__spill_buffer))
+
+        self.__file_count += len(self.__spill_buffer)
+        self.__spill_buffer = []
+
+    def __load(self):
+        if self.__is_dfs is True:
+            (offset, count) = self.__segments.pop()
+
+            f = self.__spill_f
+            f.seek(offset)
+
+            items = _read_items(f, count)
+            f.truncate(offset)
+        elif self.__file_count > 0:
+            count = min(self.__file_count, self.__memory_limit)
+
+            f = self.__spill_f
+            f.seek(self.__read_offset)
+
+            items = _read_items(f, count)
+
+            self.__file_count -= count
+            if self.__file_count == 0:
+                f.truncate(0)
+                self.__read_offset = 0
+            else:
+                self.__read_offset = f.tell()
+                self.__check_compact()
+        else:
+            # The rest were never written.
+
+            items = self.__spill_buffer
+            self.__spill_buffer = []
+
+        self.__memory.extend(items)
+        self.__spilled_count -= len(items)
+
+    def __check_compact(self):
+        """Move the part of the file that hasn't been read back to the front 
+        of it, if what has been read back is at least half of it.
+        """
+
+        f = self.__spill_f
+
+        size = f.seek(0, os.SEEK_END)
+        if self.__read_offset * 2 < size:
+            return
+
+        chunk_size = fss.config.workers.GENERATOR_FRONTIER_COMPACT_CHUNK_SIZE
+
+        # The destination is always behind the source, so it can be copied 
+        # front to back.
+
+        read_offset = self.__read_offset
+        write_offset = 0
+        while True:
+            f.seek(read_offset)
+            data = f.read(chunk_size)
+            if not data:
+                break
+
+            f.seek(write_offset)
+            f.write(data)
+
+            read_offset += len(data)
+            write_offset += len(data)
+
+        f.truncate(write_offset)
+        self.__read_offset = 0
+        self.__compaction_count += 1
+
+    def close(self):
+        if self.__spill_f is not None:
+            self.__spill_f.close()
+            self.__spill_f = None
+
+    def get_counters(self):
+        return {
+            'spilled_directories': self.__spilled_total,
+            'spill_compactions': self.__compaction_count,
+        }
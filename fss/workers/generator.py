@@ -3,172 +3,277 @@ import time
 import logging
 import queue
 import os
-import fnmatch
-import pprint
 
 import fss.constants
-import fss.config
 import fss.config.workers
+import fss.filters
+import fss.listing
+import fss.options
+import fss.rollups
+import fss.subtrees
+import fss.workers.frontier
 import fss.workers.controller_base
 import fss.workers.worker_base
 
 _LOGGER = logging.getLogger(__name__)
 
-_LOGGER_FILTER = logging.getLogger(__name__ + '.-filter–')
-
-_IS_FILTER_DEBUG = bool(int(os.environ.get('FSS_FILTER_DEBUG', '0')))
-
-if _IS_FILTER_DEBUG is True:
-    _LOGGER_FILTER.setLevel(logging.DEBUG)
-else:
-    _LOGGER_FILTER.setLevel(logging.WARNING)
-
 
 class GeneratorWorker(fss.workers.worker_base.WorkerBase):
     """This class knows how to recursively traverse a path to produce a list of 
     file-paths.
     """
 
-    def __init__(self, filter_rules_raw, *args):
+    def __init__(self, filter_rules_raw, frontier, visited, result_blocks, 
+                 scan_options, *args):
         super(GeneratorWorker, self).__init__(*args)
 
         _LOGGER.info("Creating generator.")
 
-        # Set after we've popped the first item off the queue.
-        self.__processed_first = False
-
-        self.__filter_rules = None
-        self.__load_filter_rules(filter_rules_raw)
-        self.__local_input_q = queue.Queue()
-
-    def __load_filter_rules(self, filter_rules_raw):
-        _LOGGER.debug("Loading filter-rules.")
-
-        # We expect this to be a listof 3-tuples: 
-        #
-        #     (entry-type, filter-type, pattern)
-        
-        self.__filter_rules = {
-            fss.constants.FT_DIR: {
-                fss.constants.FILTER_INCLUDE: [],
-                fss.constants.FILTER_EXCLUDE: [],
-            },
-            fss.constants.FT_FILE: {
-                fss.constants.FILTER_INCLUDE: [],
-                fss.constants.FILTER_EXCLUDE: [],
-            },
-        }
-
-        for (entry_type, filter_type, pattern) in filter_rules_raw:
-            self.__filter_rules[entry_type][filter_type].append(pattern)
+        self.__filter_rules = fss.filters.FilterRules(filter_rules_raw)
+        self.__frontier = frontier
 
-        # If an include filter was given for DIRECTORIES, add an exclude filter 
-        # for "*". Since we check the include rules, first, we'll simply not be 
-        # implicitly including anything else.
+        # The ResultBlocks to pack our results into, if they're going 
+        # straight to the parent.
+        self.__result_blocks = result_blocks
 
-        rules = self.__filter_rules[fss.constants.FT_DIR]
-        if rules[fss.constants.FILTER_INCLUDE]:
-            rules[fss.constants.FILTER_EXCLUDE].append('*')
+        # The number of directories queued while reading the current one.
+        self.__queued_count = 0
 
-        # If an include filter was given for FILES, add an exclude filter for
-        # "*". Since we check the include rules, first, we'll simply not be 
-        # implicitly including anything else.
+        self.__queued_total = 0
+        self.__directory_count = 0
+        self.__error_count = 0
+        self.__byte_count = 0
 
-        rules = self.__filter_rules[fss.constants.FT_FILE]
-        if rules[fss.constants.FILTER_INCLUDE]:
-            rules[fss.constants.FILTER_EXCLUDE].append('*')
+        if scan_options is None:
+            scan_options = fss.options.ScanOptions()
 
-        if fss.config.IS_DEBUG is True:
-            _LOGGER.debug("Final rules:\n%s", 
-                          pprint.pformat(self.__filter_rules))
+        self.__local_input_q = fss.workers.frontier.LocalFrontier(
+                                scan_options.order, 
+                                scan_options.frontier_memory_limit)
 
-    def __check_to_permit(self, entry_type, entry_filename):
-        """Applying the filter rules."""
+        if scan_options.collect_stats is True:
+            self.enable_stats()
 
-        rules = self.__filter_rules[entry_type]
+        stats = self.stats
 
-        # Should explicitly include?
-        for pattern in rules[fss.constants.FILTER_INCLUDE]:
-            if fnmatch.fnmatch(entry_filename, pattern):
-                _LOGGER_FILTER.debug("Entry explicitly INCLUDED: [%s] [%s] "
-                                     "[%s]", 
-                                     entry_type, pattern, entry_filename)
+        self.__lister = fss.listing.DirectoryLister(scan_options, stats)
+        self.__guard = fss.subtrees.SubtreeGuard(scan_options, visited)
+        self.__max_depth = scan_options.max_depth
+        self.__has_metadata = scan_options.metadata
+        self.__is_reporting_reads = scan_options.report_reads
 
-                return True
+        # The per-directory totals, if we're only summarizing the results.
+        if scan_options.summarize_depth is not None:
+            self.__rollups = fss.rollups.DirectoryRollups(
+                                scan_options.summarize_depth)
+        else:
+            self.__rollups = None
+
+        # The number of results of each type, if we're only counting (or 
+        # summarizing) them rather than sending them.
+        if scan_options.count_only is True or self.__rollups is not None:
+            self.__counts = {
+                fss.constants.FT_DIR: 0,
+                fss.constants.FT_FILE: 0,
+            }
+        else:
+            self.__counts = None
 
-        # Should explicitly exclude?
-        for pattern in rules[fss.constants.FILTER_EXCLUDE]:
-            if fnmatch.fnmatch(entry_filename, pattern):
-                _LOGGER_FILTER.debug("Entry explicitly EXCLUDED: [%s] [%s] "
-                                     "[%s]", 
-                                     entry_type, pattern, entry_filename)
+        # When the phases are being timed, these are swapped for versions 
+        # that time themselves, so that nothing is added to the loop 
+        # otherwise.
 
-                return False
+        if stats is None:
+            self.__check_to_read = self.__guard.check_to_read
+            self.__check_to_queue = self.__guard.check_to_queue
+            self.__check_to_permit = self.__filter_rules.check_to_permit
+            self.__check_to_descend = self.__filter_rules.check_to_descend
+        else:
+            self.__check_to_read = stats.wrap(
+                                    fss.constants.PHASE_GUARD, 
+                                    self.__guard.check_to_read)
 
-        # Implicitly include.
+            self.__check_to_queue = stats.wrap(
+                                        fss.constants.PHASE_GUARD, 
+                                        self.__guard.check_to_queue)
 
-        _LOGGER_FILTER.debug("Entry IMPLICITLY included: [%s] [%s]", 
-                             entry_type, entry_filename)
+            self.__check_to_permit = stats.wrap(
+                                        fss.constants.PHASE_FILTER, 
+                                        self.__filter_rules.check_to_permit)
 
-        return True
+            self.__check_to_descend = stats.wrap(
+                                        fss.constants.PHASE_FILTER, 
+                                        self.__filter_rules.check_to_descend)
 
     def get_next_item(self):
         """Override the default functionality to not only try to pull things 
         off the external input-queue, but to first try to pull things from a 
-        local input-queue that we'll primarily depend on. We'll only use the 
-        external input-queue to get the initial root-path (we could reuse it to 
-        do the recursion, but it's more costly and prone to delay).
+        local input-queue that we'll primarily depend on. The external 
+        input-queue provides the root-path as well as any directories that 
+        other workers have shared with us (it's more costly and prone to delay, 
+        so we only use it when we've run out of our own work).
         """
 
         # Try to pop something off the local input-queue.
 
         try:
-            return self.__local_input_q.get(block=False)
+            return self.__local_input_q.get()
         except queue.Empty:
             pass
 
-        # Try to pop something off the external input-queue.
+        # Whatever we've found so far shouldn't sit in our output batch while 
+        # we wait (the consumer might only be waiting for one result).
 
-        return self.input_q.get(block=False)
+        self.flush_output()
 
-    def process_item(self, entry_path):
-        _LOGGER.debug("Processing: [%s]", entry_path)
+        # Wait for something on the external input-queue. This will raise 
+        # queue.Empty once all of the workers have run out of work.
 
-        entry_filename = os.path.basename(entry_path)
+        return self.__frontier.get(self.quit_ev)
 
-        # The first item in the queue is the root-directory to be scanned. It's 
-        # not subject to the filter-rules.
-        if self.__processed_first is True:
-            if self.__check_to_permit(
-                fss.constants.FT_DIR, 
-                entry_filename) is False:
+    def process_item(self, item):
+        _LOGGER.debug("Processing: [%s]", item[0])
 
-                # Skip.
-                return True
-        else:
-            self.__processed_first = True
+        # Directories are filtered (and checked against the max-depth) before 
+        # they're queued, so we don't have to check the rules for this one.
 
         try:
-            entries = os.listdir(entry_path)
-        except:
-            _LOGGER.exception("Skipping unreadable directory: [%s]", 
-                              entry_path)
+            return self.__process_directory(*item)
+        finally:
+            self.__frontier.transition(self.__queued_count)
+            self.__queued_total += self.__queued_count
+            self.__queued_count = 0
+
+            if self.__frontier.waiting_count > 0:
+                self.__share_work()
+
+    def __share_work(self):
+        """Hand some of our queued directories to the workers that have run out 
+        of work.
+        """
+
+        share_count = min(
+                        self.__local_input_q.qsize() // 2, 
+                        fss.config.workers.GENERATOR_MAX_SHARE_COUNT)
+
+        for i in range(share_count):
+            try:
+                item = self.__local_input_q.steal()
+            except queue.Empty:
+                break
+
+            self.__frontier.share(item)
+
+    def __process_directory(self, entry_path, rel_path, dev, root_index):
+        depth = fss.filters.get_depth(rel_path) + 1
+
+        if self.__max_depth is not None and depth > self.__max_depth:
+            return
+
+        (is_readable, dev) = self.__check_to_read(
+                                entry_path, 
+                                rel_path, 
+                                dev)
+
+        if is_readable is False:
+            return
+
+        stats = self.stats
+        if stats is None:
+            return self.__read_directory(
+                    entry_path, 
+                    rel_path, 
+                    dev, 
+                    root_index, 
+                    depth)
+
+        stats.start_directory()
+
+        try:
+            return self.__read_directory(
+                    entry_path, 
+                    rel_path, 
+                    dev, 
+                    root_index, 
+                    depth)
+        finally:
+            stats.finish_directory(entry_path)
+
+    def __read_directory(self, entry_path, rel_path, dev, root_index, depth):
+        # Don't queue directories whose entries would be too deep.
+        can_descend = self.__max_depth is None or depth < self.__max_depth
+        is_path_aware = self.__filter_rules.is_path_aware
+
+        self.__directory_count += 1
+
+        if self.__is_reporting_reads is True:
+            if root_index is None:
+                self.push_to_output((fss.constants.FT_READ_DIR, entry_path))
+            else:
+                self.push_to_output(
+                    (fss.constants.FT_READ_DIR, entry_path, root_index))
+
+        if self.__rollups is not None:
+            totals = self.__rollups.get_totals(root_index, rel_path)
         else:
-            for filename in entries:
+            totals = None
+
+        try:
+            entries = self.__lister.list(entry_path)
+            for (filename, filepath, is_dir, is_symlink, stat_source) \
+                    in entries:
                 if self.check_quit() is True:
-                    _LOGGER.warning("Generator has been told to quit before "
-                                    "finishing. WITHIN=[%s]", entry_path)
+                    _LOGGER.debug("Generator has been told to quit before "
+                                  "finishing. WITHIN=[%s]", entry_path)
 
                     return False
 
-                filepath = os.path.join(entry_path, filename)
-                is_dir = os.path.isdir(filepath)
-
                 file_type = fss.constants.FT_DIR \
                                 if is_dir is True \
                                 else fss.constants.FT_FILE
 
-                if self.__check_to_permit(file_type, filename) is False:
+                if is_dir is True or is_path_aware is True:
+                    entry_rel_path = fss.filters.join_path(rel_path, filename)
+                else:
+                    entry_rel_path = None
+
+                is_permitted = self.__check_to_permit(
+                                file_type, 
+                                filename,
+                                entry_rel_path)
+
+                # The metadata is only collected for the entries that are 
+                # reported. If the entry has gone away in the meantime, it's 
+                # skipped.
+
+                if is_permitted is True and stat_source is not None:
+                    metadata = self.__lister.get_metadata(stat_source)
+                    if metadata is None:
+                        continue
+                else:
+                    metadata = None
+
+                # A directory that isn't permitted is still read if a 
+                # path-rule might include something below it. Otherwise, it's 
+                # pruned here, before it's ever queued.
+
+                if is_dir is True and \
+                   can_descend is True and \
+                   (is_permitted is True or \
+                    self.__check_to_descend(entry_rel_path) is True) and \
+                   self.__check_to_queue(filepath, is_symlink) is True:
+
+                    # We'll populate our own input-queue with downstream 
+                    # paths.
+
+                    _LOGGER.debug("Pushing directory to local input-queue: "
+                                  "[%s]", filepath)
+
+                    self.__local_input_q.put(
+                        (filepath, entry_rel_path, dev, root_index))
+                    self.__queued_count += 1
+
+                if is_permitted is False:
                     continue
 
                 if self.tick_count % \
@@ -178,18 +283,107 @@ class GeneratorWorker(fss.workers.worker_base.WorkerBase):
                         "Generator progress: (%d)", 
                         self.tick_count)
 
-                # We'll populate our own input-queue with downstream paths.
-                if is_dir:
-                    self.push_to_output((fss.constants.FT_DIR, filepath))
-                    
-                    _LOGGER.debug("Pushing directory to local input-queue: "
-                                  "[%s]", filepath)
+                if metadata is not None and is_dir is False:
+                    self.__byte_count += metadata[0]
+
+                if self.__counts is not None:
+                    self.__counts[file_type] += 1
 
-                    self.__local_input_q.put(filepath)
+                    if totals is not None:
+                        if is_dir is True:
+                            totals[0] += 1
+                        else:
+                            totals[1] += 1
+                            totals[2] += metadata[0]
+
+                    self.increment_tick()
+
+                    continue
+
+                # If there are several roots, the index of the root goes after 
+                # the path.
+
+                if root_index is None:
+                    if metadata is None:
+                        self.push_to_output((file_type, filepath))
+                    else:
+                        self.push_to_output((file_type, filepath, metadata))
+                elif metadata is None:
+                    self.push_to_output((file_type, filepath, root_index))
                 else:
-                    self.push_to_output((fss.constants.FT_FILE, filepath))
+                    self.push_to_output(
+                        (file_type, filepath, root_index, metadata))
 
                 self.increment_tick()
+        except OSError:
+            _LOGGER.exception("Skipping unreadable directory: [%s]", 
+                              entry_path)
+
+            self.__error_count += 1
+
+    def send_output(self, batch):
+        if self.__result_blocks is not None:
+            packed = self.__result_blocks.pack(
+                        self.worker_index,
+                        batch, 
+                        self.__has_metadata, 
+                        self.quit_ev)
+
+            if packed is not None:
+                self.output_q.put(packed)
+                return
+
+        super(GeneratorWorker, self).send_output(batch)
+
+    def post_loop_hook(self):
+        super(GeneratorWorker, self).post_loop_hook()
+
+        self.__lister.close()
+        self.__local_input_q.close()
+
+        counters = self.__lister.get_counters()
+
+        self.log(
+            logging.INFO,
+            "Generator listed (%d) entries with (%d) stats and (%d) stats "
+            "avoided.",
+            counters['entries'], counters['stats'], counters['stats_avoided'])
+
+    def get_counters(self):
+        counters = self.__lister.get_counters()
+        counters.update(self.__guard.get_counters())
+        counters.update(self.__local_input_q.get_counters())
+
+        if self.__counts is not None:
+            counters['counted_directories'] = \
+                self.__counts[fss.constants.FT_DIR]
+
+            counters['counted_files'] = self.__counts[fss.constants.FT_FILE]
+
+        return counters
+
+    def get_rollups(self):
+        return self.__rollups
+
+    def get_progress(self):
+        # The bytes are only known when metadata was requested.
+
+        progress = {
+            fss.constants.PROGRESS_ENTRIES: 
+                self.__lister.get_counters()['entries'],
+            fss.constants.PROGRESS_DIRECTORIES: self.__directory_count,
+            fss.constants.PROGRESS_QUEUED: self.__queued_total,
+            fss.constants.PROGRESS_BYTES: self.__byte_count,
+            fss.constants.PROGRESS_ERRORS: self.__error_count,
+        }
+
+        # Nothing is pushed, so the default (the number pushed) doesn't 
+        # apply.
+        if self.__counts is not None:
+            progress[fss.constants.PROGRESS_RESULTS] = \
+                sum(self.__counts.values())
+
+        return progress
 
     def get_component_name(self):
         return fss.constants.PC_GENERATOR
@@ -200,43 +394,100 @@ class GeneratorWorker(fss.workers.worker_base.WorkerBase):
 
 
 class GeneratorController(fss.workers.controller_base.ControllerBase):
-    def __init__(self, filter_rules_raw, *args, **kwargs):
+    def __init__(self, filter_rules_raw, *args, worker_count=1, 
+                 scan_options=None, result_blocks=None, **kwargs):
         super(GeneratorController, self).__init__(*args, **kwargs)
 
-        args = (
-            filter_rules_raw,
-            self.pipeline_state, 
-            self.input_q,
-            self.output_q, 
-            self.log_q, 
-            self.quit_ev
-        )
+        self.__frontier = fss.workers.frontier.SharedFrontier(self.input_q)
 
-        self.__p = multiprocessing.Process(target=_boot, args=args)
+        if scan_options is not None and \
+           scan_options.symlinks == fss.constants.SYMLINKS_UNIQUE:
+            visited = fss.subtrees.SharedVisitedSet(
+                        fss.config.workers.GENERATOR_VISITED_CAPACITY)
+        else:
+            visited = None
+        self.__worker_count = worker_count
+        self.__processes = []
+
+        for i in range(worker_count):
+            args = (
+                filter_rules_raw,
+                self.__frontier,
+                visited,
+                result_blocks,
+                scan_options,
+                i,
+                self.pipeline_state, 
+                self.input_q,
+                self.output_q, 
+                self.log_q, 
+                self.quit_ev
+            )
+
+            p = multiprocessing.Process(target=_boot, args=args)
+            self.__processes.append(p)
+
+    def add_root(self, path, root_index=None):
+        self.__frontier.add_root(path, root_index=root_index)
 
     def start(self):
-        _LOGGER.info("Starting generator.")
-        self.__p.start()
+        _LOGGER.info("Starting generator with (%d) worker(s).", 
+                     self.__worker_count)
+
+        for p in self.__processes:
+            p.start()
 
     def stop(self):
         _LOGGER.info("Stopping generator.")
         self.quit_ev.set()
-# TODO(dustin): Audit for a period of time, and then stop it.
-        self.__p.join()
+
+        # If we're stopping early, the workers may be blocked on a full 
+        # output-queue (or waiting for the log-queue to empty), so keep 
+        # draining them until they've exited.
+
+        for p in self.__processes:
+            while True:
+                p.join(timeout=fss.config.workers.STOP_DRAIN_INTERVAL_S)
+                if p.is_alive() is False:
+                    break
+
+                self.drain()
+
+        self.drain()
+
+        self.input_q.close()
+        self.output_q.close()
+
+    def is_alive(self):
+        for p in self.__processes:
+            if p.is_alive() is True:
+                return True
+
+        return False
+
+    @property
+    def worker_count(self):
+        return self.__worker_count
 
     @property
     def output_queue_size(self):
         return fss.config.workers.GENERATOR_MAX_OUTPUT_QUEUE_SIZE
 
-def _boot(filter_rules_raw, pipeline_state, input_q, output_q, log_q, quit_ev):
-    _LOGGER.info("Booting generator worker.")
+def _boot(filter_rules_raw, frontier, visited, result_blocks, scan_options, 
+          worker_index, pipeline_state, input_q, output_q, log_q, quit_ev):
+    _LOGGER.info("Booting generator worker (%d).", worker_index)
 
     g = GeneratorWorker(
             filter_rules_raw,
+            frontier,
+            visited,
+            result_blocks,
+            scan_options,
             pipeline_state, 
             input_q, 
             output_q, 
             log_q, 
-            quit_ev)
+            quit_ev,
+            worker_index)
 
     g.run()
@@ -0,0 +1,219 @@
+import logging
+import multiprocessing
+import queue
+import os
+import hashlib
+
+import fss.constants
+import fss.config.duplicates
+import fss.config.workers
+import fss.workers.controller_base
+import fss.workers.worker_base
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class HashWorker(fss.workers.worker_base.WorkerBase):
+    """This class takes batches of (hash-type, size, path) and hashes either
+    the first and last blocks of each file (HASH_PARTIAL) or the whole file
+    (HASH_FULL). It produces (hash-type, size, path, digest). The digest is
+    None if the file couldn't be read.
+    """
+
+    def __init__(self, *args):
+        super(HashWorker, self).__init__(*args)
+
+        _LOGGER.info("Creating hasher.")
+
+        self.__partial_count = 0
+        self.__full_count = 0
+        self.__error_count = 0
+        self.__bytes_read = 0
+
+    def get_next_item(self):
+        """We're fed by the orchestrator, which tells us when it's done by
+        sending a termination message. Until then, block.
+        """
+
+        while True:
+            try:
+                return self.input_q.get(
+                        timeout=fss.config.duplicates.HASH_POLL_INTERVAL_S)
+            except queue.Empty:
+                # Don't sit on results while we're waiting for more work.
+                self.flush_output()
+
+                if self.quit_ev.is_set() is True:
+                    raise
+
+    def process_item(self, batch):
+        for (hash_type, size, filepath) in batch:
+            if self.check_quit() is True:
+                return False
+
+            try:
+                if hash_type == fss.constants.HASH_PARTIAL:
+                    digest = self.__hash_partial(filepath, size)
+                    self.__partial_count += 1
+                else:
+                    digest = self.__hash_full(filepath)
+                    self.__full_count += 1
+            except OSError:
+                _LOGGER.debug("Could not hash file: [%s]", filepath)
+
+                self.__error_count += 1
+                digest = None
+
+            self.push_to_output((hash_type, size, filepath, digest))
+            self.increment_tick()
+
+    def __get_hash(self):
+        return hashlib.new(fss.config.duplicates.HASH_ALGORITHM)
+
+    def __hash_partial(self, filepath, size):
+        """Hash the first and last blocks. If the file is no larger than the
+        two blocks, this reads (and hashes) the whole file.
+        """
+
+        block_size = fss.config.duplicates.PARTIAL_HASH_BLOCK_SIZE
+        h = self.__get_hash()
+
+        with open(filepath, 'rb') as f:
+            if size <= block_size * 2:
+                data = f.read()
+                self.__bytes_read += len(data)
+                h.update(data)
+            else:
+                data = f.read(block_size)
+                self.__bytes_read += len(data)
+                h.update(data)
+
+                f.seek(-block_size, os.SEEK_END)
+
+                data = f.read(block_size)
+                self.__bytes_read += len(data)
+                h.update(data)
+
+        return h.digest()
+
+    def __hash_full(self, filepath):
+        chunk_size = fss.config.duplicates.FULL_HASH_CHUNK_SIZE
+        h = self.__get_hash()
+
+        with open(filepath, 'rb') as f:
+            while True:
+                data = f.read(chunk_size)
+                if not data:
+                    break
+
+                self.__bytes_read += len(data)
+                h.update(data)
+
+        return h.digest()
+
+    def get_counters(self):
+        return {
+            'partial_hashes': self.__partial_count,
+            'full_hashes': self.__full_count,
+            'unreadable_files': self.__error_count,
+            'bytes_read': self.__bytes_read,
+        }
+
+    def get_progress(self):
+        return {
+            fss.constants.PROGRESS_ENTRIES: 
+                self.__partial_count + self.__full_count,
+            fss.constants.PROGRESS_BYTES: self.__bytes_read,
+            fss.constants.PROGRESS_ERRORS: self.__error_count,
+        }
+
+    def get_component_name(self):
+        return fss.constants.PC_HASHER
+
+    def get_upstream_component_name(self):
+        return None
+
+    @property
+    def terminate_on_idle(self):
+        return True
+
+
+class HashController(fss.workers.controller_base.ControllerBase):
+    def __init__(self, *args, worker_count=1, **kwargs):
+        super(HashController, self).__init__(*args, **kwargs)
+
+        self.__worker_count = worker_count
+        self.__processes = []
+
+        for i in range(worker_count):
+            args = (
+                i,
+                self.pipeline_state,
+                self.input_q,
+                self.output_q,
+                self.log_q,
+                self.quit_ev
+            )
+
+            p = multiprocessing.Process(target=_boot, args=args)
+            self.__processes.append(p)
+
+    def start(self):
+        _LOGGER.info("Starting hasher with (%d) worker(s).",
+                     self.__worker_count)
+
+        for p in self.__processes:
+            p.start()
+
+    def finish(self):
+        """Tell the workers that there's nothing more to hash. Each will send
+        a termination message once it's done with what it already has.
+        """
+
+        for i in range(self.__worker_count):
+            self.input_q.put(fss.workers.worker_base.TerminationMessage())
+
+    def stop(self):
+        _LOGGER.info("Stopping hasher.")
+        self.quit_ev.set()
+
+        for p in self.__processes:
+            while True:
+                p.join(timeout=fss.config.workers.STOP_DRAIN_INTERVAL_S)
+                if p.is_alive() is False:
+                    break
+
+                self.drain()
+
+        self.drain()
+
+        self.input_q.close()
+        self.output_q.close()
+
+    def is_alive(self):
+        for p in self.__processes:
+            if p.is_alive() is True:
+                return True
+
+        return False
+
+    @property
+    def worker_count(self):
+        return self.__worker_count
+
+    @property
+    def output_queue_size(self):
+        return fss.config.duplicates.HASH_MAX_OUTPUT_QUEUE_SIZE
+
+def _boot(worker_index, pipeline_state, input_q, output_q, log_q, quit_ev):
+    _LOGGER.info("Booting hash worker (%d).", worker_index)
+
+    h = HashWorker(
+            pipeline_state,
+            input_q,
+            output_q,
+            log_q,
+            quit_ev,
+            worker_index)
+
+    h.run()
@@ -0,0 +1,302 @@
+import logging
+import multiprocessing
+import queue
+import os
+import mmap
+import re
+
+import fss.constants
+import fss.config.workers
+import fss.workers.controller_base
+import fss.workers.worker_base
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class SearchWorker(fss.workers.worker_base.WorkerBase):
+    """This class takes batches of results from the generator and searches the
+    content of each file for a regular-expression. The file is memory-mapped
+    rather than read, so only the pages that are actually scanned are loaded.
+    Results are produced only for files that match:
+
+        (entry-type, path, [(offset, line), ...])
+    """
+
+    def __init__(self, pattern, upstream_state, *args):
+        super(SearchWorker, self).__init__(*args)
+
+        _LOGGER.info("Creating searcher.")
+
+        self.__regex = re.compile(pattern, re.MULTILINE)
+        self.__upstream_state = upstream_state
+
+        self.__searched_count = 0
+        self.__matched_count = 0
+        self.__skipped_size_count = 0
+        self.__skipped_binary_count = 0
+        self.__skipped_error_count = 0
+        self.__searched_bytes = 0
+
+        # The counters reported by the upstream workers whose termination
+        # messages we happened to receive (and their stats, if they were 
+        # collected). We pass them along.
+        self.__upstream_counters = {}
+        self.__upstream_stats = None
+
+    def get_next_item(self):
+        """Every upstream (generator) worker sends its own termination
+        message, and any one of us might receive it. Once all of them have
+        been received, everything that they've produced is already in the
+        queue, so we can stop as soon as it's empty.
+        """
+
+        while True:
+            try:
+                item = self.input_q.get(
+                        timeout=fss.config.workers.\
+                                    SEARCH_UPSTREAM_POLL_INTERVAL_S)
+            except queue.Empty:
+                if self.__upstream_state.is_finished() is True or \
+                   self.quit_ev.is_set() is True:
+                    raise
+
+                continue
+
+            if issubclass(
+                    item.__class__,
+                    fss.workers.worker_base.TerminationMessage) is False:
+                return item
+
+            upstream_component_name = self.get_upstream_component_name()
+
+            _LOGGER.debug("Component [%s] received termination message "
+                          "from upstream component [%s].",
+                          self.get_component_name(), upstream_component_name)
+
+            for (name, value) in item.counters.items():
+                self.__upstream_counters[name] = \
+                    self.__upstream_counters.get(name, 0) + value
+
+            if item.stats is not None:
+                if self.__upstream_stats is None:
+                    self.__upstream_stats = item.stats
+                else:
+                    self.__upstream_stats.merge(item.stats)
+
+            self.__upstream_state.add_termination()
+
+    def process_item(self, batch):
+        for entry in batch:
+            (entry_type, entry_filepath) = (entry[0], entry[1])
+
+            if entry_type != fss.constants.FT_FILE:
+                continue
+
+            if self.check_quit() is True:
+                return False
+
+            matches = self.__search(entry_filepath)
+            if matches:
+                self.__matched_count += 1
+                self.push_to_output(tuple(entry) + (matches,))
+
+            self.increment_tick()
+
+    def __search(self, filepath):
+        """Return a list of (offset, line) for each line that matches (or an
+        empty list).
+        """
+
+        try:
+            with open(filepath, 'rb') as f:
+                size = os.fstat(f.fileno()).st_size
+
+                # Empty files can't be mapped (and can't match).
+                if size == 0:
+                    return []
+
+                if size > fss.config.workers.SEARCH_MAX_FILE_SIZE:
+                    self.__skipped_size_count += 1
+                    return []
+
+                with mmap.mmap(
+                        f.fileno(),
+                        0,
+                        access=mmap.ACCESS_READ) as mm:
+
+                    head = mm[:fss.config.workers.SEARCH_BINARY_CHECK_SIZE]
+                    if b'\0' in head:
+                        self.__skipped_binary_count += 1
+                        return []
+
+                    self.__searched_count += 1
+                    self.__searched_bytes += size
+
+                    return self.__find_lines(mm, size)
+        except (OSError, ValueError):
+            _LOGGER.debug("Could not search file: [%s]", filepath)
+
+            self.__skipped_error_count += 1
+            return []
+
+    def __find_lines(self, mm, size):
+        matches = []
+        max_line_length = fss.config.workers.SEARCH_MAX_LINE_LENGTH
+
+        i = 0
+        while i < size:
+            m = self.__regex.search(mm, i)
+            if m is None:
+                break
+
+            line_start = mm.rfind(b'\n', 0, m.start()) + 1
+            line_end = mm.find(b'\n', m.end())
+            if line_end == -1:
+                line_end = size
+
+            # For a long line, keep the part around the match.
+            if line_end - line_start > max_line_length:
+                line_start = max(
+                                line_start, 
+                                m.start() - max_line_length // 2)
+
+            line = mm[line_start:min(line_end, line_start + max_line_length)]
+            matches.append((m.start(), line))
+
+            if len(matches) >= fss.config.workers.SEARCH_MAX_MATCHES_PER_FILE:
+                break
+
+            # Only report each line once.
+            i = line_end + 1
+
+        return matches
+
+    def get_counters(self):
+        counters = dict(self.__upstream_counters)
+
+        counters.update({
+            'searched_files': self.__searched_count,
+            'searched_bytes': self.__searched_bytes,
+            'matched_files': self.__matched_count,
+            'skipped_large_files': self.__skipped_size_count,
+            'skipped_binary_files': self.__skipped_binary_count,
+            'skipped_unreadable_files': self.__skipped_error_count,
+        })
+
+        return counters
+
+    def get_stats(self):
+        return self.__upstream_stats
+
+    def get_progress(self):
+        return {
+            fss.constants.PROGRESS_ENTRIES: self.__searched_count,
+            fss.constants.PROGRESS_BYTES: self.__searched_bytes,
+            fss.constants.PROGRESS_ERRORS: self.__skipped_error_count,
+        }
+
+    def get_component_name(self):
+        return fss.constants.PC_SEARCH
+
+    def get_upstream_component_name(self):
+        return fss.constants.PC_GENERATOR
+
+    @property
+    def terminate_on_idle(self):
+        return True
+
+
+class UpstreamState(object):
+    """Tracks how many of the upstream workers have finished, across all of
+    the downstream workers.
+    """
+
+    def __init__(self, upstream_worker_count):
+        self.__upstream_worker_count = upstream_worker_count
+        self.__terminated_count = multiprocessing.Value('i', 0)
+
+    def add_termination(self):
+        with self.__terminated_count.get_lock():
+            self.__terminated_count.value += 1
+
+    def is_finished(self):
+        return self.__terminated_count.value >= self.__upstream_worker_count
+
+
+class SearchController(fss.workers.controller_base.ControllerBase):
+    def __init__(self, pattern, upstream_worker_count, *args,
+                 worker_count=1, **kwargs):
+        super(SearchController, self).__init__(*args, **kwargs)
+
+        self.__upstream_state = UpstreamState(upstream_worker_count)
+        self.__worker_count = worker_count
+        self.__processes = []
+
+        for i in range(worker_count):
+            args = (
+                pattern,
+                self.__upstream_state,
+                i,
+                self.pipeline_state,
+                self.input_q,
+                self.output_q,
+                self.log_q,
+                self.quit_ev
+            )
+
+            p = multiprocessing.Process(target=_boot, args=args)
+            self.__processes.append(p)
+
+    def start(self):
+        _LOGGER.info("Starting searcher with (%d) worker(s).",
+                     self.__worker_count)
+
+        for p in self.__processes:
+            p.start()
+
+    def stop(self):
+        _LOGGER.info("Stopping searcher.")
+        self.quit_ev.set()
+
+        for p in self.__processes:
+            while True:
+                p.join(timeout=fss.config.workers.STOP_DRAIN_INTERVAL_S)
+                if p.is_alive() is False:
+                    break
+
+                self.drain()
+
+        self.drain()
+
+        self.output_q.close()
+
+    def is_alive(self):
+        for p in self.__processes:
+            if p.is_alive() is True:
+                return True
+
+        return False
+
+    @property
+    def worker_count(self):
+        return self.__worker_count
+
+    @property
+    def output_queue_size(self):
+        return fss.config.workers.SEARCH_MAX_OUTPUT_QUEUE_SIZE
+
+def _boot(pattern, upstream_state, worker_index, pipeline_state, input_q,
+          output_q, log_q, quit_ev):
+    _LOGGER.info("Booting search worker (%d).", worker_index)
+
+    s = SearchWorker(
+            pattern,
+            upstream_state,
+            pipeline_state,
+            input_q,
+            output_q,
+            log_q,
+            quit_ev,
+            worker_index)
+
+    s.run()
@@ -0,0 +1,111 @@
+import multiprocessing
+
+import fss.constants
+
+# The progress counters that every worker publishes. Not every component
+# uses all of them.
+PROGRESS_COUNTERS = [
+    fss.constants.PROGRESS_ENTRIES,
+    fss.constants.PROGRESS_DIRECTORIES,
+    fss.constants.PROGRESS_QUEUED,
+    fss.constants.PROGRESS_BYTES,
+    fss.constants.PROGRESS_ERRORS,
+    fss.constants.PROGRESS_RESULTS,
+]
+
+_COUNTER_INDICES = dict((name, i) for (i, name) in enumerate(PROGRESS_COUNTERS))
+
+
+class PipelineState(object):
+    """The state and progress counters of every worker in the pipeline, in
+    shared memory. Each worker only ever writes to its own slot, so nothing
+    is locked; the values that are read may be a moment out of date, but
+    each is a whole machine-word.
+    """
+
+    def __init__(self, worker_counts):
+        """The worker-counts is a list of (component-name, worker-count)."""
+
+        self.__slots = {}
+        self.__component_slots = {}
+
+        i = 0
+        for (component_name, worker_count) in worker_counts:
+            self.__component_slots[component_name] = \
+                list(range(i, i + worker_count))
+
+            for worker_index in range(worker_count):
+                self.__slots[(component_name, worker_index)] = i
+                i += 1
+
+        self.__states = multiprocessing.Array('b', i, lock=False)
+        self.__counters = multiprocessing.Array(
+                            'q',
+                            i * len(PROGRESS_COUNTERS),
+                            lock=False)
+
+    def get_slot(self, component_name, worker_index):
+        return self.__slots[(component_name, worker_index)]
+
+    def set_state(self, slot, state):
+        self.__states[slot] = state
+
+    def get_state(self, slot):
+        return self.__states[slot]
+
+    def set_counter(self, slot, name, value):
+        self.__counters[slot * len(PROGRESS_COUNTERS) + \
+                        _COUNTER_INDICES[name]] = value
+
+    def get_counter(self, slot, name):
+        return self.__counters[slot * len(PROGRESS_COUNTERS) + \
+                               _COUNTER_INDICES[name]]
+
+    def reset_slot(self, slot):
+        """Return a slot to its initial state, with its counters zeroed, so 
+        that it can be reused by a worker that runs another job.
+        """
+
+        self.__states[slot] = fss.constants.PCS_INITIAL
+
+        offset = slot * len(PROGRESS_COUNTERS)
+        for i in range(len(PROGRESS_COUNTERS)):
+            self.__counters[offset + i] = 0
+
+    def __get_counters(self, slots):
+        counters = dict((name, 0) for name in PROGRESS_COUNTERS)
+        running_count = 0
+
+        for slot in slots:
+            if self.__states[slot] in (fss.constants.PCS_INITIAL,
+                                       fss.constants.PCS_RUNNING):
+                running_count += 1
+
+            offset = slot * len(PROGRESS_COUNTERS)
+            for (i, name) in enumerate(PROGRESS_COUNTERS):
+                counters[name] += self.__counters[offset + i]
+
+        counters['running_workers'] = running_count
+        return counters
+
+    def get_progress(self):
+        """Return a dictionary of the counters of each component (summed over
+        its workers), as well as the number of its workers that are still
+        running.
+        """
+
+        progress = {}
+        for (component_name, slots) in self.__component_slots.items():
+            progress[component_name] = self.__get_counters(slots)
+
+        return progress
+
+    def get_worker_progress(self, component_name, worker_index):
+        """Return the progress (as get_progress() does) of only one worker of 
+        the given component.
+        """
+
+        slot = self.__slots[(component_name, worker_index)]
+        return {
+            component_name: self.__get_counters([slot]),
+        }
@@ -0,0 +1,554 @@
+import logging
+import threading
+import queue
+import time
+
+import fss.constants
+import fss.config.workers
+import fss.filters
+import fss.listing
+import fss.options
+import fss.rollups
+import fss.stats
+import fss.subtrees
+import fss.workers.frontier
+import fss.workers.state
+
+_LOGGER = logging.getLogger(__name__)
+
+# Pushed to the result-queue once the traversal is complete.
+_FINISHED = None
+
+
+class _PendingDirectories(object):
+    """A LocalFrontier that all of the threads share. get() blocks until 
+    there's a directory, or returns None once this has been closed. 
+    Anything added after that is dropped.
+    """
+
+    def __init__(self, frontier):
+        self.__frontier = frontier
+        self.__cv = threading.Condition()
+        self.__is_closed = False
+
+    def put_many(self, items):
+        with self.__cv:
+            if self.__is_closed is True:
+                return
+
+            for item in items:
+                self.__frontier.put(item)
+
+            self.__cv.notify(len(items))
+
+    def get(self):
+        with self.__cv:
+            while self.__is_closed is False:
+                try:
+                    return self.__frontier.get()
+                except queue.Empty:
+                    self.__cv.wait()
+
+            return None
+
+    def close(self):
+        with self.__cv:
+            self.__is_closed = True
+            self.__frontier.close()
+
+            self.__cv.notify_all()
+
+    def get_counters(self):
+        with self.__cv:
+            return self.__frontier.get_counters()
+
+
+class ThreadedGenerator(object):
+    """Traverses the filesystem from within the current process using a pool
+    of threads. The GIL is released while the threads are waiting on the
+    directory-listing calls, so, on filesystems where the cost is latency
+    rather than CPU (NFS, SMB), many directories can be read concurrently
+    without paying for the pickling and IPC of the process-based generator.
+
+    The results are produced as batches: one list of (entry-type, path) (or
+    (entry-type, path, metadata)) tuples per directory.
+    """
+
+    def __init__(self, filter_rules_raw, thread_count, scan_options=None):
+        self.__filter_rules = fss.filters.FilterRules(filter_rules_raw)
+        self.__thread_count = thread_count
+        if scan_options is None:
+            scan_options = fss.options.ScanOptions()
+
+        self.__scan_options = scan_options
+        self.__max_depth = scan_options.max_depth
+        self.__is_reporting_reads = scan_options.report_reads
+        self.__summarize_depth = scan_options.summarize_depth
+        self.__is_count_only = scan_options.count_only is True or \
+                               self.__summarize_depth is not None
+        self.__visited = fss.subtrees.LocalVisitedSet()
+
+        self.__directory_q = _PendingDirectories(
+                                fss.workers.frontier.LocalFrontier(
+                                    scan_options.order, 
+                                    scan_options.frontier_memory_limit))
+        self.__result_q = queue.Queue(
+                            maxsize=fss.config.workers.\
+                                        THREADED_MAX_OUTPUT_QUEUE_SIZE)
+
+        self.__quit_ev = threading.Event()
+
+        # The first exception (other than OSError) that a thread hit. It's 
+        # raised to the consumer instead of the end of the results.
+        self.__error = None
+
+        # The number of directories that have been queued but not finished.
+        self.__pending = 0
+        self.__pending_lock = threading.Lock()
+
+        # Progress, also guarded by the pending-lock.
+        self.__progress = dict(
+                            (name, 0) 
+                            for name 
+                            in fss.workers.state.PROGRESS_COUNTERS)
+
+        # The number of results of each type, if we're only counting them. 
+        # Also guarded by the pending-lock.
+        self.__counts = {
+            fss.constants.FT_DIR: 0,
+            fss.constants.FT_FILE: 0,
+        }
+
+        self.__listers = []
+        self.__guards = []
+        self.__stats = []
+        self.__rollups = []
+        self.__threads = []
+
+    def add_root(self, path, root_index=None):
+        with self.__pending_lock:
+            self.__pending += 1
+
+        # Directories are queued along with their path relative to the root, 
+        # the device of the root (once it's known), and the index of the root 
+        # (if results are to be tagged with it).
+        self.__directory_q.put_many([(path, '', None, root_index)])
+
+    def start(self):
+        _LOGGER.info("Starting threaded generator with (%d) thread(s).",
+                     self.__thread_count)
+
+        for i in range(self.__thread_count):
+            if self.__scan_options.collect_stats is True:
+                stats = fss.stats.ScanStats()
+                self.__stats.append(stats)
+            else:
+                stats = None
+
+            lister = fss.listing.DirectoryLister(self.__scan_options, stats)
+            self.__listers.append(lister)
+
+            guard = fss.subtrees.SubtreeGuard(
+                        self.__scan_options, 
+                        self.__visited)
+
+            self.__guards.append(guard)
+
+            # Each thread adds up its own directories.
+            if self.__summarize_depth is not None:
+                rollups = fss.rollups.DirectoryRollups(self.__summarize_depth)
+                self.__rollups.append(rollups)
+            else:
+                rollups = None
+
+            t = threading.Thread(
+                    target=self.__run, 
+                    args=(lister, guard, stats, rollups))
+
+            t.daemon = True
+            t.start()
+
+            self.__threads.append(t)
+
+    def stop(self):
+        _LOGGER.info("Stopping threaded generator.")
+
+        self.__quit_ev.set()
+        self.__directory_q.close()
+
+        # Threads may be blocked on a full result-queue, so keep draining it 
+        # until they've exited.
+
+        for t in self.__threads:
+            while True:
+                t.join(timeout=fss.config.workers.STOP_DRAIN_INTERVAL_S)
+                if t.is_alive() is False:
+                    break
+
+                self.__drain_results()
+
+        # Wake anyone still waiting on results.
+
+        self.__drain_results()
+        self.__result_q.put(_FINISHED)
+
+    def __drain_results(self):
+        while True:
+            try:
+                self.__result_q.get(block=False)
+            except queue.Empty:
+                break
+
+    def get_batch(self):
+        """Block until the next list of results is available. Returns None 
+        once the traversal is complete (or has been stopped). If one of the 
+        threads failed, its exception is raised instead.
+        """
+
+        batch = self.__result_q.get()
+        if batch is _FINISHED and self.__error is not None:
+            raise self.__error
+
+        return batch
+
+    def get_batches(self):
+        """Yield lists of results until the traversal is complete."""
+
+        while True:
+            batch = self.get_batch()
+            if batch is _FINISHED:
+                break
+
+            yield batch
+
+    def get_progress(self):
+        """Return the progress counters (see 
+        fss.workers.state.PROGRESS_COUNTERS).
+        """
+
+        with self.__pending_lock:
+            progress = dict(self.__progress)
+
+        progress['running_workers'] = \
+            sum(1 for t in self.__threads if t.is_alive() is True)
+
+        return progress
+
+    def get_counters(self):
+        counters = self.__directory_q.get_counters()
+        for source in self.__listers + self.__guards:
+            for (name, value) in source.get_counters().items():
+                counters[name] = counters.get(name, 0) + value
+
+        if self.__is_count_only is True:
+            with self.__pending_lock:
+                counters['counted_directories'] = \
+                    self.__counts[fss.constants.FT_DIR]
+
+                counters['counted_files'] = \
+                    self.__counts[fss.constants.FT_FILE]
+
+        return counters
+
+    def get_stats(self):
+        """Return the ScanStats of all of the threads, merged, or None if 
+        they weren't collected.
+        """
+
+        if not self.__stats:
+            return None
+
+        stats = fss.stats.ScanStats()
+        for thread_stats in self.__stats:
+            stats.merge(thread_stats)
+
+        return stats
+
+    def get_rollups(self):
+        """Return the DirectoryRollups of all of the threads, merged, or None 
+        if we weren't summarizing.
+        """
+
+        if self.__summarize_depth is None:
+            return None
+
+        rollups = fss.rollups.DirectoryRollups(self.__summarize_depth)
+        for thread_rollups in self.__rollups:
+            rollups.merge(thread_rollups)
+
+        return rollups
+
+    def __put_result(self, item):
+        """Wait for room in the result-queue, unless we've been told to quit.
+        """
+
+        while self.__quit_ev.is_set() is False:
+            try:
+                self.__result_q.put(
+                    item,
+                    timeout=fss.config.workers.THREADED_QUIT_CHECK_INTERVAL_S)
+            except queue.Full:
+                continue
+            else:
+                return True
+
+        return False
+
+    def __run(self, lister, guard, stats, rollups):
+        # See GeneratorWorker.
+
+        if stats is None:
+            checks = (
+                guard.check_to_read,
+                guard.check_to_queue,
+                self.__filter_rules.check_to_permit,
+                self.__filter_rules.check_to_descend,
+            )
+        else:
+            checks = (
+                stats.wrap(fss.constants.PHASE_GUARD, guard.check_to_read),
+                stats.wrap(fss.constants.PHASE_GUARD, guard.check_to_queue),
+                stats.wrap(
+                    fss.constants.PHASE_FILTER, 
+                    self.__filter_rules.check_to_permit),
+                stats.wrap(
+                    fss.constants.PHASE_FILTER, 
+                    self.__filter_rules.check_to_descend),
+            )
+
+        try:
+            self.__traverse(lister, checks, stats, rollups)
+        finally:
+            lister.close()
+
+    def __traverse(self, lister, checks, phase_stats, rollups):
+        while True:
+            if phase_stats is None:
+                item = self.__directory_q.get()
+            else:
+                epoch = time.perf_counter()
+                item = self.__directory_q.get()
+
+                phase_stats.add(
+                    fss.constants.PHASE_WAIT, 
+                    time.perf_counter() - epoch)
+
+            if item is None or self.__quit_ev.is_set() is True:
+                break
+
+            # Whatever happens, the directory has to be accounted for below, 
+            # or the traversal would never finish.
+
+            try:
+                (batch, subdirectories, counts, stats) = \
+                    self.__process_directory(
+                        lister,
+                        checks,
+                        phase_stats,
+                        rollups,
+                        *item)
+            except Exception as e:
+                _LOGGER.exception("Threaded traversal failed while reading: "
+                                  "[%s]", item[0])
+
+                self.__fail(e)
+                (batch, subdirectories, counts, stats) = ([], [], None, {})
+
+            if batch:
+                if phase_stats is None:
+                    is_put = self.__put_result(batch)
+                else:
+                    epoch = time.perf_counter()
+                    is_put = self.__put_result(batch)
+
+                    phase_stats.add(
+                        fss.constants.PHASE_OUTPUT, 
+                        time.perf_counter() - epoch)
+
+                if is_put is False:
+                    break
+
+            # Account for the new directories before they're queued, so that
+            # the count can't drop to zero while they're still outstanding.
+
+            with self.__pending_lock:
+                self.__pending += len(subdirectories) - 1
+                is_finished = self.__pending == 0
+
+                for (name, value) in stats.items():
+                    self.__progress[name] += value
+
+                if counts is not None:
+                    for (file_type, count) in counts.items():
+                        self.__counts[file_type] += count
+
+            if subdirectories:
+                self.__directory_q.put_many(subdirectories)
+
+            if is_finished is True:
+                _LOGGER.debug("Threaded traversal is complete.")
+                self.__put_result(_FINISHED)
+
+    def __fail(self, e):
+        """Stop the traversal, and hand the exception to the consumer (in 
+        place of the end of the results).
+        """
+
+        with self.__pending_lock:
+            if self.__error is not None:
+                return
+
+            self.__error = e
+
+        self.__quit_ev.set()
+
+        # The consumer (or stop()) is draining the queue, so this won't block 
+        # for long.
+        self.__result_q.put(_FINISHED)
+
+    def __process_directory(self, lister, checks, phase_stats, rollups, 
+                            entry_path, rel_path, dev, root_index):
+        """Return the results for the given directory, the queue-items of 
+        the subdirectories that have to be read, the number of results of 
+        each type (only if we're counting or summarizing them rather than 
+        producing them) and the progress counters to add. The checks are the 
+        guard's and filter-rules' (see __run()).
+        """
+
+        _LOGGER.debug("Processing: [%s]", entry_path)
+
+        batch = []
+        subdirectories = []
+        counts = None
+        stats = {}
+
+        depth = fss.filters.get_depth(rel_path) + 1
+
+        if self.__max_depth is not None and depth > self.__max_depth:
+            return (batch, subdirectories, counts, stats)
+
+        (check_to_read, check_to_queue, check_to_permit, check_to_descend) = \
+            checks
+
+        (is_readable, dev) = check_to_read(entry_path, rel_path, dev)
+        if is_readable is False:
+            return (batch, subdirectories, counts, stats)
+
+        if self.__is_count_only is True:
+            counts = {
+                fss.constants.FT_DIR: 0,
+                fss.constants.FT_FILE: 0,
+            }
+
+        if rollups is not None:
+            totals = rollups.get_totals(root_index, rel_path)
+        else:
+            totals = None
+
+        if phase_stats is not None:
+            phase_stats.start_directory()
+
+        entry_count = 0
+        byte_count = 0
+        error_count = 0
+
+        can_descend = self.__max_depth is None or depth < self.__max_depth
+        is_path_aware = self.__filter_rules.is_path_aware
+
+        # See GeneratorWorker.
+        if self.__is_reporting_reads is True:
+            if root_index is None:
+                batch.append((fss.constants.FT_READ_DIR, entry_path))
+            else:
+                batch.append(
+                    (fss.constants.FT_READ_DIR, entry_path, root_index))
+
+        try:
+            for (filename, filepath, is_dir, is_symlink, stat_source) in \
+                    lister.list(entry_path):
+                # Whatever we have so far is dropped.
+                if self.__quit_ev.is_set() is True:
+                    break
+
+                entry_count += 1
+
+                file_type = fss.constants.FT_DIR \
+                                if is_dir is True \
+                                else fss.constants.FT_FILE
+
+                if is_dir is True or is_path_aware is True:
+                    entry_rel_path = fss.filters.join_path(rel_path, filename)
+                else:
+                    entry_rel_path = None
+
+                is_permitted = check_to_permit(
+                                file_type,
+                                filename,
+                                entry_rel_path)
+
+                # See GeneratorWorker.
+
+                if is_permitted is True and stat_source is not None:
+                    metadata = lister.get_metadata(stat_source)
+                    if metadata is None:
+                        continue
+                else:
+                    metadata = None
+
+                if is_dir is True and \
+                   can_descend is True and \
+                   (is_permitted is True or \
+                    check_to_descend(entry_rel_path) is True) and \
+                   check_to_queue(filepath, is_symlink) is True:
+                    subdirectories.append(
+                        (filepath, entry_rel_path, dev, root_index))
+
+                if is_permitted is False:
+                    continue
+
+                if metadata is not None and is_dir is False:
+                    byte_count += metadata[0]
+
+                if counts is not None:
+                    counts[file_type] += 1
+
+                    if totals is not None:
+                        if is_dir is True:
+                            totals[0] += 1
+                        else:
+                            totals[1] += 1
+                            totals[2] += metadata[0]
+
+                    continue
+
+                # See GeneratorWorker.
+
+                if root_index is None:
+                    if metadata is None:
+                        batch.append((file_type, filepath))
+                    else:
+                        batch.append((file_type, filepath, metadata))
+                elif metadata is None:
+                    batch.append((file_type, filepath, root_index))
+                else:
+                    batch.append((file_type, filepath, root_index, metadata))
+        except OSError:
+            _LOGGER.exception("Skipping unreadable directory: [%s]",
+                              entry_path)
+
+            error_count += 1
+
+        if phase_stats is not None:
+            phase_stats.finish_directory(entry_path)
+
+        stats = {
+            fss.constants.PROGRESS_ENTRIES: entry_count,
+            fss.constants.PROGRESS_DIRECTORIES: 1,
+            fss.constants.PROGRESS_QUEUED: len(subdirectories),
+            fss.constants.PROGRESS_BYTES: byte_count,
+            fss.constants.PROGRESS_ERRORS: error_count,
+            fss.constants.PROGRESS_RESULTS: 
+                len(batch) if counts is None else sum(counts.values()),
+        }
+
+        return (batch, subdirectories, counts, stats)
@@ -0,0 +1,251 @@
+import multiprocessing
+import struct
+import sys
+import time
+import operator
+import itertools
+
+import fss.constants
+import fss.config.workers
+import fss.metadata
+
+# The metadata tuple (see fss.metadata.get_metadata_tuple()), packed.
+_METADATA_STRUCT = struct.Struct('<qdQQI')
+
+_ROOT_INDEX_SIZE = 4
+
+# Paths are packed the way that os.fsencode() would encode them.
+_FS_ENCODING = sys.getfilesystemencoding()
+_FS_ERRORS = sys.getfilesystemencodeerrors()
+
+_get_type = operator.itemgetter(0)
+_get_path = operator.itemgetter(1)
+
+# The entry-type of each result is packed as one byte.
+_TYPE_CODES = {
+    fss.constants.FT_DIR: 0,
+    fss.constants.FT_FILE: 1,
+    fss.constants.FT_READ_DIR: 2,
+}
+
+_CODE_TYPES = (
+    fss.constants.FT_DIR, 
+    fss.constants.FT_FILE, 
+    fss.constants.FT_READ_DIR,
+)
+
+
+class PackedBatch(object):
+    """The message that's sent in place of a batch of results that was
+    packed into a block. The results keep the order that they were produced 
+    in. A block holds, in that order, the entry-type of each result (a byte), 
+    the index of the root of each (if there are several roots), the metadata 
+    of each (if requested), and then the paths, separated by NULs.
+    """
+
+    def __init__(self, block_index, count, length, has_roots, has_metadata):
+        self.block_index = block_index
+        self.count = count
+        self.length = length
+        self.has_roots = has_roots
+        self.has_metadata = has_metadata
+
+
+class ResultBlocks(object):
+    """Fixed-size blocks in shared memory that the generator workers pack
+    their batches of results into. Only a small PackedBatch is sent through
+    the output-queue for each, rather than the pickled results.
+
+    Each worker has its own blocks, and each block has a flag (also in shared
+    memory) that's set by the worker when it fills the block and cleared by
+    the reader once it has been read. Only one side ever writes a flag at a
+    time, so nothing is locked, and handing a block back is a single write. A
+    worker waits for one of its blocks to become free, so the blocks also
+    bound how far the workers can run ahead of the consumer.
+    """
+
+    def __init__(self, worker_count, block_count=None, block_size=None):
+        if block_count is None:
+            block_count = fss.config.workers.GENERATOR_RESULT_BLOCK_COUNT
+
+        if block_size is None:
+            block_size = fss.config.workers.GENERATOR_RESULT_BLOCK_SIZE
+
+        self.__block_count = block_count
+        self.__block_size = block_size
+        self.__buffer = multiprocessing.Array(
+                            'B',
+                            worker_count * block_count * block_size,
+                            lock=False)
+
+        self.__is_used = multiprocessing.Array(
+                            'b',
+                            worker_count * block_count,
+                            lock=False)
+
+        self.__view = None
+
+    def __get_view(self):
+        # A memoryview can't be pickled, so this is created in each process
+        # as it's needed.
+        if self.__view is None:
+            self.__view = memoryview(self.__buffer).cast('B')
+
+        return self.__view
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_ResultBlocks__view'] = None
+
+        return state
+
+    def pack(self, worker_index, batch, has_metadata, quit_ev):
+        """Pack a batch of results (as the generator produces them) into one
+        of the given worker's free blocks, waiting for one if necessary. 
+        Return the PackedBatch to send, or None if the batch doesn't fit in a 
+        block (it has to be sent as it is) or if we've been told to quit while 
+        waiting.
+        """
+
+        # The root-index follows the path, and then the metadata.
+        has_roots = len(batch[0]) == (4 if has_metadata is True else 3)
+
+        parts = [
+            bytes(map(_TYPE_CODES.__getitem__, map(_get_type, batch))),
+        ]
+
+        if has_roots is True:
+            root_indices = bytearray(len(batch) * _ROOT_INDEX_SIZE)
+            struct.pack_into(
+                '<%dI' % (len(batch),),
+                root_indices,
+                0,
+                *map(operator.itemgetter(2), batch))
+
+            parts.append(root_indices)
+
+        if has_metadata is True:
+            metadata_i = 3 if has_roots is True else 2
+            parts.append(
+                b''.join(
+                    itertools.starmap(
+                        _METADATA_STRUCT.pack,
+                        map(operator.itemgetter(metadata_i), batch))))
+
+        parts.append(
+            '\0'.join(map(_get_path, batch)).encode(_FS_ENCODING, _FS_ERRORS))
+
+        length = sum(len(part) for part in parts)
+        if length > self.__block_size:
+            return None
+
+        block_index = self.__acquire(worker_index, quit_ev)
+        if block_index is None:
+            return None
+
+        view = self.__get_view()
+
+        offset = block_index * self.__block_size
+        for part in parts:
+            view[offset:offset + len(part)] = part
+            offset += len(part)
+
+        return PackedBatch(
+                block_index,
+                len(batch),
+                length,
+                has_roots,
+                has_metadata)
+
+    def __acquire(self, worker_index, quit_ev):
+        is_used = self.__is_used
+        first = worker_index * self.__block_count
+        stop = first + self.__block_count
+
+        while True:
+            for block_index in range(first, stop):
+                if is_used[block_index] == 0:
+                    is_used[block_index] = 1
+                    return block_index
+
+            if quit_ev.is_set() is True:
+                return None
+
+            time.sleep(fss.config.workers.GENERATOR_RESULT_BLOCK_WAIT_S)
+
+    def release(self, packed):
+        """Free the block of a batch that's being discarded unread."""
+
+        self.__is_used[packed.block_index] = 0
+
+    def reset(self, worker_index):
+        """Free all of the given worker's blocks (when a worker has been 
+        replaced, the messages for any that it had filled are gone).
+        """
+
+        first = worker_index * self.__block_count
+        for block_index in range(first, first + self.__block_count):
+            self.__is_used[block_index] = 0
+
+    def unpack(self, packed, roots=None, raw=False):
+        """Return an iterator of the results in the given block, in the form
+        that the orchestrator yields them (prefixed with the root, from the
+        given list, if the workers tagged them with its index). Each part of 
+        the block is read in one pass (the paths are decoded straight out of 
+        shared memory, and then split), so that the block is free for reuse 
+        as soon as this returns. Only the tuples are created as they're 
+        iterated.
+
+        If raw, the paths are left as bytes.
+        """
+
+        view = self.__get_view()
+        count = packed.count
+
+        offset = packed.block_index * self.__block_size
+        stop = offset + packed.length
+
+        try:
+            iterables = []
+
+            types = bytes(view[offset:offset + count])
+            offset += count
+
+            if packed.has_roots is True:
+                length = count * _ROOT_INDEX_SIZE
+                root_indices = struct.unpack_from(
+                                '<%dI' % (count,),
+                                view,
+                                offset)
+
+                iterables.append(map(roots.__getitem__, root_indices))
+                offset += length
+
+            if packed.has_metadata is True:
+                length = count * _METADATA_STRUCT.size
+                metadata = _METADATA_STRUCT.iter_unpack(
+                            bytes(view[offset:offset + length]))
+
+                metadata_iterable = \
+                    map(fss.metadata.EntryMetadata._make, metadata)
+
+                offset += length
+            else:
+                metadata_iterable = None
+
+            iterables.append(map(_CODE_TYPES.__getitem__, types))
+
+            if raw is True:
+                paths = bytes(view[offset:stop]).split(b'\0')
+            else:
+                paths = str(view[offset:stop], _FS_ENCODING, _FS_ERRORS).\
+                            split('\0')
+
+            iterables.append(paths)
+
+            if metadata_iterable is not None:
+                iterables.append(metadata_iterable)
+        finally:
+            self.__is_used[packed.block_index] = 0
+
+        return zip(*iterables)
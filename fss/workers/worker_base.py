@@ -2,38 +2,63 @@ import logging
 import time
 import queue
 
+import fss.constants
 import fss.config.workers
+import fss.stats
 
 _LOGGER = logging.getLogger(__name__)
 
 
 class TerminationMessage(object):
-    pass
+    """Sent downstream when a component has finished. It carries the final 
+    counters of the component that sent it, its ScanStats (if it collected 
+    them), and its DirectoryRollups (if it was summarizing).
+    """
+
+    def __init__(self, counters=None, stats=None, rollups=None):
+        self.counters = counters if counters is not None else {}
+        self.stats = stats
+        self.rollups = rollups
+
 
 # TODO(dustin): We might want to improve our tick-countting... Maybe have 
 #               separate total-tick and hit-tick counters.
 
 
 class WorkerBase(object):
-    def __init__(self, pipeline_state, input_q, output_q, log_q, quit_ev):
+    def __init__(self, pipeline_state, input_q, output_q, log_q, quit_ev, 
+                 worker_index=0):
+        # A PipelineState.
         self.__pipeline_state = pipeline_state
         self.__input_q = input_q
         self.__output_q = output_q
         self.__log_q = log_q
         self.__quit_ev = quit_ev
+        self.__worker_index = worker_index
         
         self.__tick = 0
         self.__push_count = 0
+        self.__output_batch = []
+        self.__output_batch_epoch = None
         self.__read_count = 0
         self.__last_check_epoch = None
 
+        # A ScanStats, if enabled.
+        self.__stats = None
+
+        self.__slot = pipeline_state.get_slot(
+                        self.get_component_name(), 
+                        worker_index)
+
     def log(self, log_type, message, *args):
         message = message % args
         self.__log_q.put((self.__class__.__name__, log_type, message))
 
     def wait_for_log_empty(self):
         while True:
-            if self.__log_q.empty() is True:
+            # If we've been told to quit, nobody might be reading them.
+            if self.__log_q.empty() is True or \
+               self.quit_ev.is_set() is True:
                 _LOGGER.debug("Log queue is empty: [%s]", 
                               self.__class__.__name__)
                 break
@@ -54,6 +79,8 @@ class WorkerBase(object):
            (time.time() - self.__last_check_epoch) > fss.config.workers.QUIT_CHECK_INTERVAL_S:
 
             if self.quit_ev.is_set() is True:
+                component_name = self.get_component_name()
+
                 self.log(
                     logging.INFO, 
                     "[%s] component terminated.", 
@@ -65,23 +92,77 @@ class WorkerBase(object):
 
         return False
 
-    def __set_data(self, key, value):
-        component_name = self.get_component_name()
-        self.pipeline_state['data_' + component_name + '_' + key] = value
-
     def __set_state(self, state):
-        component_name = self.get_component_name()
-        self.pipeline_state['running_' + component_name] = state
+        self.__pipeline_state.set_state(self.__slot, state)
+
+    def __get_state(self):
+        return self.__pipeline_state.get_state(self.__slot)
+
+    def enable_stats(self):
+        """Start timing the phases of our work (see fss.stats.ScanStats). 
+        The stats are sent with the termination message.
+        """
+
+        self.__stats = fss.stats.ScanStats()
 
-    def __get_state(self, component_name):
-        return self.pipeline_state['running_' + component_name]
+    def publish_progress(self):
+        """Copy our progress counters to shared memory, where the parent can 
+        read them. This is called after every item.
+        """
 
-    def __get_data(self, component_name, key):
-        return self.pipeline_state['data_' + component_name + '_' + key]
+        self.__pipeline_state.set_counter(
+            self.__slot, 
+            fss.constants.PROGRESS_RESULTS, 
+            self.__push_count)
+
+        for (name, value) in self.get_progress().items():
+            self.__pipeline_state.set_counter(self.__slot, name, value)
 
     def push_to_output(self, item):
+        """Add an item to the current output batch, and send the batch if it's 
+        full or old enough.
+        """
+
         self.__push_count += 1
-        self.output_q.put(item)
+
+        if not self.__output_batch:
+            self.__output_batch_epoch = time.time()
+
+        self.__output_batch.append(item)
+
+        if len(self.__output_batch) >= \
+                fss.config.workers.OUTPUT_BATCH_SIZE:
+            self.flush_output()
+        else:
+            self.check_flush_output()
+
+    def check_flush_output(self):
+        """Send the current output batch if its oldest item has been waiting 
+        longer than the flush-interval.
+        """
+
+        if self.__output_batch and \
+           (time.time() - self.__output_batch_epoch) >= \
+                fss.config.workers.OUTPUT_BATCH_FLUSH_INTERVAL_S:
+            self.flush_output()
+
+    def flush_output(self):
+        """Send the current output batch downstream as a single message."""
+
+        if not self.__output_batch:
+            return
+
+        if self.__stats is None:
+            self.send_output(self.__output_batch)
+        else:
+            epoch = time.perf_counter()
+            self.send_output(self.__output_batch)
+
+            self.__stats.add(
+                fss.constants.PHASE_OUTPUT, 
+                time.perf_counter() - epoch)
+
+        self.__output_batch = []
 
     def set_finished(self):
         """This stores the number of items that have been pushed, and 
@@ -100,13 +181,13 @@ class WorkerBase(object):
             "Component [%s] is being marked as finished.", 
             component_name)
 
-        existing_state = self.__get_state(component_name)
+        existing_state = self.__get_state()
 
         assert existing_state == fss.constants.PCS_RUNNING, \
                "Can not change to 'finished' state from unsupported " \
                "state: (" + str(existing_state) + ")"
 
-        self.__set_data('count', self.__push_count)
+        self.publish_progress()
         self.__set_state(fss.constants.PCS_FINISHED)
 
     def __handle_queue_idle(self):
@@ -131,6 +212,9 @@ class WorkerBase(object):
 
             return False
 
+        # Don't sit on results while we're waiting for more work.
+        self.flush_output()
+
         time.sleep(fss.config.workers.WORKER_IDLE_SLEEP_S)
 
         self.__tick += 1
@@ -148,6 +232,9 @@ class WorkerBase(object):
         self.pre_loop_hook()
         
         while True:
+            if self.__stats is not None:
+                epoch = time.perf_counter()
+
             try:
                 item = self.get_next_item()
             except queue.Empty:
@@ -157,6 +244,11 @@ class WorkerBase(object):
                     break
 
                 continue
+            finally:
+                if self.__stats is not None:
+                    self.__stats.add(
+                        fss.constants.PHASE_WAIT, 
+                        time.perf_counter() - epoch)
 
             if issubclass(item.__class__, TerminationMessage) is True:
                 upstream_component_name = self.get_upstream_component_name()
@@ -178,7 +270,11 @@ class WorkerBase(object):
                     "Component [%s] progress: (%d)", 
                     component_name, self.__tick)
 
-            if self.process_item(item) is False:
+            result = self.process_item(item)
+            self.check_flush_output()
+            self.publish_progress()
+
+            if result is False:
                 self.log(
                     logging.INFO, 
                     "Item process for component [%s] has requested loop "
@@ -196,9 +292,14 @@ class WorkerBase(object):
             "Component [%s] loop has terminated.", 
             component_name)
 
+        self.flush_output()
         self.wait_for_log_empty()
 
-        self.__output_q.put(TerminationMessage())
+        self.__output_q.put(
+            TerminationMessage(
+                self.get_counters(), 
+                self.get_stats(), 
+                self.get_rollups()))
 
         self.__set_state(fss.constants.PCS_STOPPED)
 
@@ -218,6 +319,16 @@ class WorkerBase(object):
     def quit_ev(self):
         return self.__quit_ev
 
+    @property
+    def stats(self):
+        """Our ScanStats, or None if they're not being collected."""
+
+        return self.__stats
+
+    @property
+    def worker_index(self):
+        return self.__worker_index
+
     @property
     def tick_count(self):
 # TODO(dustin): Rename the member-variable to "__tick_count".
@@ -236,6 +347,40 @@ class WorkerBase(object):
     def post_loop_hook(self):
         self.set_finished()
 
+    def send_output(self, batch):
+        """Send a batch of results downstream."""
+
+        self.output_q.put(batch)
+
+    def get_counters(self):
+        """Return a dictionary of counters to be reported along with the 
+        termination message.
+        """
+
+        return {}
+
+    def get_stats(self):
+        """Return the ScanStats to be reported along with the termination 
+        message, or None.
+        """
+
+        return self.__stats
+
+    def get_rollups(self):
+        """Return the DirectoryRollups to be reported along with the 
+        termination message, or None.
+        """
+
+        return None
+
+    def get_progress(self):
+        """Return a dictionary of the progress counters (see 
+        fss.workers.state.PROGRESS_COUNTERS) that apply to this component. The 
+        number of results pushed is reported automatically.
+        """
+
+        return {}
+
     def process_item(self, item):
         raise NotImplementedError()
 